@@ -0,0 +1,6 @@
+"""
+Image alignment tools for the varifocal transformer pix2pix dataset.
+
+aligner.gui holds the Tkinter alignment tool, aligner.engine the headless
+export code it shares with the command line (python -m aligner).
+"""
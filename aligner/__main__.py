@@ -0,0 +1,7 @@
+import sys
+
+from .cli import main
+
+# Guarded so process-pool workers that re-import __main__ don't rerun the CLI
+if __name__ == "__main__":
+    sys.exit(main())
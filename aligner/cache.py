@@ -0,0 +1,146 @@
+"""
+Memory-bounded cache of decoded images and a background prefetcher.
+
+Entries are keyed by file path, modification time, size and a variant name
+('full' for the decoded image, 'preview' for a PreviewPyramid), so an edited
+file is never served stale. The cache is thread-safe: the GUI's prefetch
+thread fills it while the main thread reads from it, and two threads asking
+for the same entry share one decode.
+"""
+
+import os
+import queue
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# Default budget for decoded data kept in memory
+DEFAULT_CACHE_BYTES = 1 << 30
+
+
+def image_nbytes(image):
+    """Approximate memory used by a decoded PIL image"""
+    bytes_per_band = 2 if image.mode.startswith('I;16') else 4 if image.mode in ('I', 'F') else 1
+    return image.width * image.height * len(image.getbands()) * bytes_per_band
+
+
+def decode_image(path):
+    """Fully decode an image file"""
+    with Image.open(path) as image:
+        image.load()
+        # load() keeps the file handle for some formats; copy detaches it
+        return image.copy()
+
+
+class ImageCache:
+    """Thread-safe LRU of decoded data, bounded by total size in bytes"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def key(self, path, variant):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, variant)
+
+    def get(self, path, variant='full'):
+        """Cached value for a file, or None"""
+        try:
+            key = self.key(path, variant)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put_key(self, key, value, nbytes):
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            # Anything larger than the whole budget is not worth keeping
+            if nbytes > self.max_bytes:
+                return
+            self.entries[key] = (value, nbytes)
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_bytes
+
+    def get_or_load(self, path, loader, variant='full', nbytes=None):
+        """Return the cached value for a file, calling loader() to produce it on a miss
+
+        nbytes(value) sizes new entries; by default values are PIL images.
+        Concurrent requests for the same entry wait for the first loader.
+        """
+        key = self.key(path, variant)
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    return entry[0]
+                pending = self.loading.get(key)
+                if pending is None:
+                    pending = self.loading[key] = threading.Event()
+                    break
+            pending.wait()
+
+        try:
+            value = loader()
+            self.put_key(key, value, (nbytes or image_nbytes)(value))
+            return value
+        finally:
+            with self.lock:
+                del self.loading[key]
+            pending.set()
+
+    def load_image(self, path):
+        """Fully decoded image, from the cache when possible"""
+        return self.get_or_load(path, lambda: decode_image(path))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+# Process-wide cache shared by the GUI preview, auto alignment and in-process export
+shared_cache = ImageCache()
+
+
+class Prefetcher:
+    """Background thread that warms a cache
+
+    Each call to prefetch() replaces the outstanding work, so when the user
+    moves on quickly only the newest neighbours are loaded.
+    """
+
+    def __init__(self, image_cache):
+        self.image_cache = image_cache
+        self.tasks = queue.Queue()
+        self.generation = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def prefetch(self, tasks):
+        """Queue (path, loader, variant, nbytes) tasks, dropping any that were not started yet"""
+        self.generation += 1
+        for task in tasks:
+            self.tasks.put((self.generation, task))
+
+    def run(self):
+        while True:
+            generation, (path, loader, variant, nbytes) = self.tasks.get()
+            if generation != self.generation:
+                continue
+            try:
+                self.image_cache.get_or_load(path, loader, variant, nbytes)
+            except Exception:
+                # Prefetching is best effort; the main thread reports real errors on load
+                pass
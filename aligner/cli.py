@@ -0,0 +1,397 @@
+"""
+Command line entry point.
+
+    python -m aligner                      open the alignment GUI
+    python -m aligner batch BASE_DIR ...   export aligned images headlessly
+    python -m aligner autoalign BASE_DIR   register every run and write settings
+    python -m aligner drift BASE_DIR       measure drift of every series frame against series_0.jpg
+    python -m aligner dataset BASE_DIR     write aligned pairs as .npy training shards
+    python -m aligner plan BASE_DIR        queue an export for several machines
+    python -m aligner work QUEUE_DIR       export runs from a queue; start one per machine
+    python -m aligner status QUEUE_DIR     show how far a queued export has got
+
+The subcommands never import tkinter, so it runs on machines without a
+display.
+"""
+
+import argparse
+import os
+import sys
+import time
+from contextlib import nullcontext
+
+from . import dataset, encoders, engine, framecache, metrics, quality, registration, runs, store, workqueue
+
+# Minimum seconds between progress lines
+PROGRESS_INTERVAL = 0.5
+
+# Worst runs listed after a batch export
+WORST_RUNS_SHOWN = 5
+
+
+def add_encoder_arguments(parser):
+    parser.add_argument("--format", choices=encoders.FORMATS, default='keep',
+                        help="output format: keep each input's format (default), PNG, lossless WebP, "
+                             "JPEG or raw .npy arrays")
+    parser.add_argument("--png-compress-level", type=int, choices=range(10), default=None, metavar="0-9",
+                        help="zlib level for PNG output; low levels encode much faster (PIL default: 6)")
+    parser.add_argument("--jpeg-quality", type=int, default=None, help="JPEG quality 1-95 (PIL default: 75)")
+    parser.add_argument("--jpeg-subsampling", choices=encoders.JPEG_SUBSAMPLING, default=None,
+                        help="JPEG chroma subsampling (PIL default: 4:2:0)")
+    parser.add_argument("--webp-method", type=int, choices=range(7), default=None, metavar="0-6",
+                        help="WebP effort; 0 is fastest (PIL default: 4)")
+    parser.add_argument("--keep-depth", action='store_true',
+                        help="export grayscale and 16-bit grayscale images with their own bit depth "
+                             "and channels instead of as 8-bit RGB")
+
+
+def encoder_from_args(args):
+    return encoders.make_encoder(args.format, args.png_compress_level, args.jpeg_quality,
+                                 args.jpeg_subsampling, args.webp_method, args.keep_depth)
+
+
+def add_tile_budget_argument(parser):
+    parser.add_argument("--tile-budget", type=float, default=None, metavar="MB",
+                        help="crop in strips using at most this much working memory per image; "
+                             "slower, for output windows too large to crop in one piece")
+
+
+def tile_budget_from_args(args):
+    return int(args.tile_budget * (1 << 20)) if args.tile_budget else None
+
+
+def add_frame_cache_arguments(parser):
+    parser.add_argument("--frame-cache", default=None, metavar="DIR",
+                        help="keep decoded frames in DIR as memory-mapped arrays, so later exports "
+                             "skip decoding; best on a fast local disk")
+    parser.add_argument("--frame-cache-size", type=float, default=framecache.DEFAULT_MAX_BYTES / (1 << 30),
+                        metavar="GB", help="size cap of the frame cache; least recently used frames go first "
+                                           "(default: %(default).0f)")
+
+
+def frame_cache_from_args(args):
+    if not args.frame_cache:
+        return None
+    return framecache.make_config(args.frame_cache, args.frame_cache_size * (1 << 30))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m aligner",
+                                     description="Align single/series image pairs from capture runs.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("gui", help="open the alignment GUI (default)")
+
+    batch = subparsers.add_parser("batch", help="export aligned images without the GUI")
+    batch.add_argument("base_directory", help="directory containing the run folders")
+    batch.add_argument("--settings", default=None,
+                       help=f"JSON alignment settings (default: {store.SETTINGS_FILENAME} in the base directory)")
+    batch.add_argument("--output", default=None,
+                       help=f"output directory (default: {engine.OUTPUT_DIR_NAME} next to the base directory)")
+    batch.add_argument("--width", type=int, default=engine.OUTPUT_WIDTH, help="output width")
+    batch.add_argument("--height", type=int, default=engine.OUTPUT_HEIGHT, help="output height")
+    batch.add_argument("--workers", type=int, default=None,
+                       help="worker processes (default: one per core, 1 disables the pool)")
+    batch.add_argument("--full", action="store_true",
+                       help="re-export every image, not only those whose inputs or settings changed")
+    batch.add_argument("--metrics", default=None,
+                       help="write per-stage timings and counters to this file (.csv for CSV, JSON otherwise)")
+    batch.add_argument("--profile", default=None,
+                       help="profile the export with cProfile and write the stats to this file "
+                            "(use --workers 1 to include the image work)")
+    add_encoder_arguments(batch)
+    add_tile_budget_argument(batch)
+    add_frame_cache_arguments(batch)
+
+    autoalign = subparsers.add_parser("autoalign",
+                                      help="compute offsets for every run with FFT phase correlation")
+    autoalign.add_argument("base_directory", help="directory containing the run folders")
+    autoalign.add_argument("--settings", default=None,
+                           help=f"JSON settings file to update, created if missing "
+                                f"(default: {store.SETTINGS_FILENAME} in the base directory)")
+    autoalign.add_argument("--overwrite", action="store_true",
+                           help="re-align runs that already have settings")
+    autoalign.add_argument("--workers", type=int, default=None,
+                           help="worker processes (default: one per core)")
+    autoalign.add_argument("--affine", action="store_true",
+                           help="also estimate rotation and scale of the series images")
+    autoalign.add_argument("--seeded", action="store_true",
+                           help="start each new run from the nearest aligned run and refine it with a "
+                                "local search; much faster on runs of one rig, runs serially")
+
+    drift = subparsers.add_parser("drift",
+                                  help="register every series frame against series_0.jpg; "
+                                       "the drift is corrected on export")
+    drift.add_argument("base_directory", help="directory containing the run folders")
+    drift.add_argument("--settings", default=None,
+                       help=f"JSON settings file to update (default: {store.SETTINGS_FILENAME} in the base directory)")
+    drift.add_argument("--subpixel", action="store_true",
+                       help="keep fractional drift; exported frames are then resampled")
+    drift.add_argument("--overwrite", action="store_true",
+                       help="re-measure runs that already have a drift")
+    drift.add_argument("--workers", type=int, default=None,
+                       help="worker processes (default: one per core)")
+
+    pairs = subparsers.add_parser("dataset",
+                                  help="write aligned (series, single) pairs into .npy shards for training")
+    pairs.add_argument("base_directory", help="directory containing the run folders")
+    pairs.add_argument("--settings", default=None,
+                       help=f"JSON alignment settings (default: {store.SETTINGS_FILENAME} in the base directory)")
+    pairs.add_argument("--output", default=None,
+                       help=f"dataset directory (default: {dataset.DATASET_DIR_NAME} next to the base directory)")
+    pairs.add_argument("--width", type=int, default=engine.OUTPUT_WIDTH, help="aligned output width")
+    pairs.add_argument("--height", type=int, default=engine.OUTPUT_HEIGHT, help="aligned output height")
+    pairs.add_argument("--crop", choices=dataset.CROP_MODES, default='full',
+                       help="store the whole output window, non-overlapping tiles or random crops")
+    pairs.add_argument("--crop-size", type=int, default=256, help="tile or random crop size")
+    pairs.add_argument("--crops-per-pair", type=int, default=4, help="random crops per image pair")
+    pairs.add_argument("--shard-size", type=int, default=dataset.SHARD_SIZE, help="samples per shard")
+    pairs.add_argument("--seed", type=int, default=0, help="seed for random crops")
+    pairs.add_argument("--workers", type=int, default=None, help="threads (default: one per core)")
+
+    plan = subparsers.add_parser("plan",
+                                 help="write one export job per run to a queue directory on a shared file system")
+    plan.add_argument("base_directory", help="directory containing the run folders")
+    plan.add_argument("--settings", default=None,
+                      help=f"JSON alignment settings (default: {store.SETTINGS_FILENAME} in the base directory)")
+    plan.add_argument("--queue", default=None,
+                      help=f"queue directory (default: {workqueue.QUEUE_DIR_NAME} next to the base directory)")
+    plan.add_argument("--output", default=None,
+                      help=f"output directory (default: {engine.OUTPUT_DIR_NAME} next to the base directory)")
+    plan.add_argument("--width", type=int, default=engine.OUTPUT_WIDTH, help="output width")
+    plan.add_argument("--height", type=int, default=engine.OUTPUT_HEIGHT, help="output height")
+    add_encoder_arguments(plan)
+
+    work = subparsers.add_parser("work", help="claim and export runs from a queue directory")
+    work.add_argument("queue_dir", help="queue directory written by plan")
+    work.add_argument("--workers", type=int, default=None,
+                      help="threads per run (default: one per core)")
+    work.add_argument("--lease", type=float, default=workqueue.LEASE_SECONDS,
+                      help="seconds without a heartbeat before another worker takes over a run")
+    work.add_argument("--no-wait", action="store_true",
+                      help="exit when no run is free instead of waiting to take over runs of crashed workers")
+    work.add_argument("--id", default=None, help="worker name recorded in the queue (default: host-pid)")
+    add_tile_budget_argument(work)
+    add_frame_cache_arguments(work)
+
+    status = subparsers.add_parser("status", help="show how many runs of a queue are done")
+    status.add_argument("queue_dir", help="queue directory written by plan")
+    status.add_argument("--lease", type=float, default=workqueue.LEASE_SECONDS,
+                        help="seconds without a heartbeat after which a run counts as pending")
+
+    return parser
+
+
+def find_runs(base_directory):
+    """Run folders from the base directory's run index, rescanning only what changed"""
+    index = runs.RunIndex(base_directory)
+    index.scan()
+    index.save()
+    return index.run_folders()
+
+
+def progress_printer(unit):
+    """Progress callback printing done/total, rate and ETA to stderr at most every PROGRESS_INTERVAL"""
+    rate = metrics.ProgressRate()
+    last_print = [0.0]
+
+    def progress(done, total, item):
+        now = time.monotonic()
+        if done < total and now - last_print[0] < PROGRESS_INTERVAL:
+            return
+        last_print[0] = now
+        end = "\n" if done == total or not sys.stderr.isatty() else ""
+        print(f"\r{rate.describe(done, total, unit)}", end=end, file=sys.stderr, flush=True)
+
+    return progress
+
+
+def print_quality(output_base):
+    """List the worst-aligned runs of the quality report"""
+    report = quality.load_report(output_base)
+    if not report:
+        return
+    flagged = [name for name in report if report[name]['flagged']]
+    print(f"Alignment quality: {len(flagged)} of {len(report)} runs flagged "
+          f"(see {os.path.join(output_base, quality.REPORT_CSV_FILENAME)})")
+    for name in quality.ranked(report)[:WORST_RUNS_SHOWN]:
+        run = report[name]
+        marker = " FLAGGED" if run['flagged'] else ""
+        print(f"  {name}: score {run['score']:.3f}, NCC {run['ncc']:.3f}{marker}")
+
+
+def run_batch(args):
+    metrics.collector.reset()
+    base_directory = os.path.abspath(args.base_directory)
+    alignment_settings = store.load_settings(args.settings or store.settings_path(base_directory))
+
+    run_folders = find_runs(base_directory)
+    if not run_folders:
+        print(f"No run folders with both {engine.SINGLE_NAME} and {engine.SERIES_NAME} found in {base_directory}")
+        return 1
+
+    start = time.monotonic()
+    with metrics.profiled(args.profile) if args.profile else nullcontext():
+        total_processed, up_to_date, output_base = engine.export_all(
+            base_directory, alignment_settings, output_base=args.output, run_folders=run_folders,
+            output_width=args.width, output_height=args.height, workers=args.workers,
+            progress=progress_printer("images"), incremental=not args.full,
+            encoder=encoder_from_args(args), tile_budget=tile_budget_from_args(args),
+            frame_cache=frame_cache_from_args(args))
+    elapsed = time.monotonic() - start
+
+    print(f"Processed {total_processed} images from {len(alignment_settings)} runs "
+          f"({up_to_date} already up to date) in {metrics.format_duration(elapsed)}.")
+    breakdown = metrics.collector.breakdown()
+    if breakdown:
+        print(f"Time per stage: {breakdown}")
+    print(f"Saved to: {output_base}")
+    print_quality(output_base)
+    if args.metrics:
+        metrics.collector.dump(args.metrics)
+        print(f"Metrics written to {args.metrics}")
+    if args.profile:
+        print(f"Profile written to {args.profile}")
+    return 0
+
+
+def run_autoalign(args):
+    base_directory = os.path.abspath(args.base_directory)
+    settings_path = args.settings or store.settings_path(base_directory)
+    alignment_settings = {}
+    if os.path.exists(settings_path):
+        alignment_settings = store.load_settings(settings_path)
+
+    run_folders = find_runs(base_directory)
+    if not run_folders:
+        print(f"No run folders with both {engine.SINGLE_NAME} and {engine.SERIES_NAME} found in {base_directory}")
+        return 1
+
+    rate = metrics.ProgressRate()
+
+    def progress(done, total, run_name):
+        print(f"[{rate.describe(done, total, 'runs')}] {run_name}")
+
+    alignment_settings = registration.auto_align_all(run_folders, alignment_settings,
+                                                     overwrite=args.overwrite,
+                                                     workers=args.workers,
+                                                     progress=progress,
+                                                     affine=args.affine,
+                                                     seeded=args.seeded)
+    store.save_settings(settings_path, alignment_settings)
+    print(f"Saved settings for {len(alignment_settings)} runs to {settings_path}")
+    return 0
+
+
+def run_drift(args):
+    base_directory = os.path.abspath(args.base_directory)
+    settings_path = args.settings or store.settings_path(base_directory)
+    alignment_settings = store.load_settings(settings_path)
+
+    run_folders = find_runs(base_directory)
+    if not run_folders:
+        print(f"No run folders with both {engine.SINGLE_NAME} and {engine.SERIES_NAME} found in {base_directory}")
+        return 1
+
+    rate = metrics.ProgressRate()
+
+    def progress(done, total, run_name):
+        print(f"[{rate.describe(done, total, 'runs')}] {run_name}")
+
+    alignment_settings = registration.correct_drift_all(run_folders, alignment_settings,
+                                                        subpixel=args.subpixel,
+                                                        overwrite=args.overwrite,
+                                                        workers=args.workers,
+                                                        progress=progress)
+    store.save_settings(settings_path, alignment_settings)
+    print(f"Saved settings for {len(alignment_settings)} runs to {settings_path}")
+    return 0
+
+
+def run_dataset(args):
+    base_directory = os.path.abspath(args.base_directory)
+    alignment_settings = store.load_settings(args.settings or store.settings_path(base_directory))
+
+    run_folders = find_runs(base_directory)
+    if not run_folders:
+        print(f"No run folders with both {engine.SINGLE_NAME} and {engine.SERIES_NAME} found in {base_directory}")
+        return 1
+
+    samples, output_base = dataset.export_dataset(
+        base_directory, alignment_settings, output_base=args.output, run_folders=run_folders,
+        output_width=args.width, output_height=args.height, crop_mode=args.crop,
+        crop_size=args.crop_size, crops_per_pair=args.crops_per_pair, shard_size=args.shard_size,
+        seed=args.seed, workers=args.workers, progress=progress_printer("pairs"))
+
+    print(f"Wrote {samples} samples to {output_base}")
+    return 0
+
+
+def run_plan(args):
+    base_directory = os.path.abspath(args.base_directory)
+    alignment_settings = store.load_settings(args.settings or store.settings_path(base_directory))
+
+    run_folders = find_runs(base_directory)
+    if not run_folders:
+        print(f"No run folders with both {engine.SINGLE_NAME} and {engine.SERIES_NAME} found in {base_directory}")
+        return 1
+
+    queue_dir, plan = workqueue.plan_export(base_directory, alignment_settings, queue_dir=args.queue,
+                                            output_base=args.output, run_folders=run_folders,
+                                            output_width=args.width, output_height=args.height,
+                                            encoder=encoder_from_args(args))
+    counts = workqueue.WorkQueue(queue_dir, plan).status()
+    print(f"Planned {len(plan['jobs'])} runs ({counts['done']} already done) in {queue_dir}")
+    print(f"Start workers with: python -m aligner work {queue_dir}")
+    return 0
+
+
+def run_work(args):
+    metrics.collector.reset()
+    rate = metrics.ProgressRate()
+
+    def progress(done, total, run_name):
+        print(f"[{done}/{total} runs done] exported {run_name}")
+
+    exported = workqueue.run_worker(args.queue_dir, worker_id=args.id, workers=args.workers,
+                                    lease_seconds=args.lease, wait=not args.no_wait, progress=progress,
+                                    tile_budget=tile_budget_from_args(args),
+                                    frame_cache=frame_cache_from_args(args))
+    counts = workqueue.WorkQueue(args.queue_dir).status(args.lease)
+    print(f"Exported {exported} runs in {metrics.format_duration(rate.elapsed())}; "
+          f"queue: {counts['done']} done, {counts['running']} running, {counts['pending']} pending")
+    return 0
+
+
+def run_status(args):
+    queue = workqueue.WorkQueue(args.queue_dir)
+    counts = queue.status(args.lease)
+    print(f"{counts['done']}/{len(queue.plan['jobs'])} runs done, {counts['running']} running, "
+          f"{counts['pending']} pending")
+    if counts['done'] == len(queue.plan['jobs']):
+        print_quality(queue.plan['output_base'])
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "batch":
+        return run_batch(args)
+    if args.command == "autoalign":
+        return run_autoalign(args)
+    if args.command == "drift":
+        return run_drift(args)
+    if args.command == "dataset":
+        return run_dataset(args)
+    if args.command == "plan":
+        return run_plan(args)
+    if args.command == "work":
+        return run_work(args)
+    if args.command == "status":
+        return run_status(args)
+
+    # Only the GUI needs tkinter
+    from .gui import main as gui_main
+    gui_main()
+    return 0
@@ -0,0 +1,290 @@
+"""
+Sharded paired-training-data export for pix2pix.
+
+Instead of loose image files, every (series_K, single.png) pair of a run is
+aligned and cropped exactly like the regular export and written into
+fixed-shape uint8 .npy shards:
+
+    DATASET/shard-00000.series.npy   (N, H, W, 3) aligned series frames
+    DATASET/shard-00000.single.npy   (N, H, W, 3) matching single.png crops
+    DATASET/index.json               shapes, shard list and sample origins
+
+Each pair can be stored whole or as tiled or random crops of the output
+window. The shards are plain .npy files, so a data loader can open them with
+np.load(..., mmap_mode='r') and read samples without copying or decoding
+(see ShardedPairs).
+"""
+
+import os
+import json
+import numpy as np
+
+from . import cache, engine, metrics, pipeline, store
+
+DATASET_DIR_NAME = "PIX2PIX_SHARDS"
+INDEX_FILENAME = "index.json"
+INDEX_VERSION = 1
+
+CROP_MODES = ('full', 'tiles', 'random')
+
+# Samples per shard file
+SHARD_SIZE = 512
+
+
+def default_dataset_base(base_directory):
+    """Dataset lives next to the base directory, like the image export"""
+    return os.path.join(os.path.dirname(base_directory), DATASET_DIR_NAME)
+
+
+def crop_windows(output_width, output_height, crop_mode='full', crop_size=256, crops_per_pair=4,
+                 rng=None):
+    """(left, top, width, height) windows to store from one aligned pair"""
+    if crop_mode == 'full':
+        return [(0, 0, output_width, output_height)]
+    if crop_size > output_width or crop_size > output_height:
+        raise ValueError(f"Crop size {crop_size} does not fit the {output_width}x{output_height} output")
+    if crop_mode == 'tiles':
+        # Non-overlapping tiles; the remainder at the right and bottom edges is dropped
+        return [(left, top, crop_size, crop_size)
+                for top in range(0, output_height - crop_size + 1, crop_size)
+                for left in range(0, output_width - crop_size + 1, crop_size)]
+    if crop_mode == 'random':
+        lefts = rng.integers(0, output_width - crop_size + 1, crops_per_pair)
+        tops = rng.integers(0, output_height - crop_size + 1, crops_per_pair)
+        return [(int(left), int(top), crop_size, crop_size) for left, top in zip(lefts, tops)]
+    raise ValueError(f"Unknown crop mode {crop_mode!r}, expected one of {', '.join(CROP_MODES)}")
+
+
+def plan_pairs(run_folders, alignment_settings, output_width=engine.OUTPUT_WIDTH,
+               output_height=engine.OUTPUT_HEIGHT, crop_mode='full', crop_size=256,
+               crops_per_pair=4, seed=0):
+    """One pair per series image of every aligned run, with its crop windows and sample slots
+
+    Runs are skipped for the same reasons export_all skips them. Random
+    windows depend only on the seed and the pair's position, so the same
+    inputs always give the same dataset.
+    """
+    rng = np.random.default_rng(seed)
+    pairs = []
+    first_index = 0
+    for run_folder in run_folders:
+        run_name = os.path.basename(run_folder)
+        if run_name not in alignment_settings:
+            continue
+        settings = alignment_settings[run_name]
+
+        try:
+            overlap_bounds = engine.run_overlap_region(run_folder, settings, output_width, output_height)
+        except OSError:
+            continue
+        if not overlap_bounds:
+            continue
+
+        single_path = os.path.join(run_folder, engine.SINGLE_NAME)
+        series_paths = sorted(path for path in engine.find_image_files(run_folder)
+                              if os.path.basename(path) != engine.SINGLE_NAME)
+        for series_path in series_paths:
+            windows = crop_windows(output_width, output_height, crop_mode, crop_size,
+                                   crops_per_pair, rng)
+            pairs.append({
+                'run': run_name,
+                'single_path': single_path,
+                'series_path': series_path,
+                'single_offset': engine.image_offset(engine.SINGLE_NAME, settings),
+                'series_offset': engine.image_offset(os.path.basename(series_path), settings),
+                'series_affine': engine.image_affine(os.path.basename(series_path), settings),
+                'layout': engine.run_layout(settings),
+                'overlap_bounds': overlap_bounds,
+                'output_width': output_width,
+                'output_height': output_height,
+                'windows': windows,
+                'first_index': first_index
+            })
+            first_index += len(windows)
+    return pairs
+
+
+def aligned_array(path, offset, pair, affine=(0.0, 1.0)):
+    """Aligned, cropped output window of one image as an HxWx3 uint8 array"""
+    image = cache.shared_cache.get(path)
+    if image is None:
+        image = cache.decode_image(path)
+    x_offset, y_offset = offset
+    aligned = engine.align_and_crop_to_overlap(image, x_offset, y_offset, pair['overlap_bounds'],
+                                               pair['output_width'], pair['output_height'], *affine,
+                                               layout=pair['layout'])
+    return np.asarray(aligned)
+
+
+@metrics.timed('decode')
+def read_pair(pair):
+    """Aligned arrays of a pair; the single.png side is computed once per run"""
+    params = (pair['single_offset'], pair['overlap_bounds']['left'], pair['overlap_bounds']['top'],
+              pair['output_width'], pair['output_height'], pair['layout'])
+    single = cache.shared_cache.get_or_load(
+        pair['single_path'], lambda: aligned_array(pair['single_path'], pair['single_offset'], pair),
+        variant=('dataset', params), nbytes=lambda array: array.nbytes)
+    series = aligned_array(pair['series_path'], pair['series_offset'], pair, pair['series_affine'])
+    return pair, series, single
+
+
+@metrics.timed('crop')
+def crop_pair(loaded):
+    """Cut the pair's windows out of both aligned images"""
+    pair, series, single = loaded
+    crops = [(series[top:top + height, left:left + width], single[top:top + height, left:left + width])
+             for left, top, width, height in pair['windows']]
+    return pair, crops
+
+
+class ShardWriter:
+    """Preallocated .npy shards that samples are written into by index
+
+    Shards are written under temporary names and renamed when the writer is
+    closed, so an interrupted export never leaves shards that look complete.
+    """
+
+    def __init__(self, directory, total, sample_shape, shard_size=SHARD_SIZE):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.shards = []
+        os.makedirs(directory, exist_ok=True)
+        for shard_index, start in enumerate(range(0, total, shard_size)):
+            count = min(shard_size, total - start)
+            shard = {'count': count, 'arrays': {}, 'files': {}}
+            for side in ('series', 'single'):
+                filename = f"shard-{shard_index:05d}.{side}.npy"
+                shard['files'][side] = filename
+                shard['arrays'][side] = np.lib.format.open_memmap(
+                    os.path.join(directory, filename + ".tmp"), mode='w+', dtype=np.uint8,
+                    shape=(count,) + sample_shape)
+            self.shards.append(shard)
+
+    @metrics.timed('shard_write')
+    def write(self, cropped):
+        """Store the crops of a pair at the pair's sample slots"""
+        pair, crops = cropped
+        for offset, (series, single) in enumerate(crops):
+            shard, slot = divmod(pair['first_index'] + offset, self.shard_size)
+            self.shards[shard]['arrays']['series'][slot] = series
+            self.shards[shard]['arrays']['single'][slot] = single
+        return pair['series_path']
+
+    def close(self, complete=True):
+        """Flush the shards and publish them, or delete them if the export did not complete"""
+        for shard in self.shards:
+            arrays, shard['arrays'] = shard['arrays'], {}
+            for side in arrays:
+                arrays[side].flush()
+            # Drop the memory maps before the files are renamed or removed
+            del arrays
+            for filename in shard['files'].values():
+                temp_path = os.path.join(self.directory, filename + ".tmp")
+                if complete:
+                    os.replace(temp_path, os.path.join(self.directory, filename))
+                else:
+                    os.remove(temp_path)
+
+    def entries(self):
+        return [{'count': shard['count'], 'series': shard['files']['series'],
+                 'single': shard['files']['single']}
+                for shard in self.shards]
+
+
+def remove_stale_shards(directory, keep):
+    """Delete shards listed by a previous index that this export does not rewrite"""
+    index_path = os.path.join(directory, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return
+    with open(index_path) as f:
+        previous = json.load(f)
+    for shard in previous.get('shards', []):
+        for side in ('series', 'single'):
+            if shard[side] not in keep:
+                try:
+                    os.remove(os.path.join(directory, shard[side]))
+                except OSError:
+                    pass
+
+
+def export_dataset(base_directory, alignment_settings, output_base=None, run_folders=None,
+                   output_width=engine.OUTPUT_WIDTH, output_height=engine.OUTPUT_HEIGHT,
+                   crop_mode='full', crop_size=256, crops_per_pair=4, shard_size=SHARD_SIZE,
+                   seed=0, workers=None, progress=None, cancel_event=None):
+    """Write every aligned (series, single) pair into .npy shards
+
+    progress(done, total, series_path) is called once per pair. Pairs are
+    decoded, aligned and cropped on threads (see pipeline.run_pipeline) and
+    written straight into memory-mapped shards. Returns (samples written,
+    output directory).
+    """
+    if output_base is None:
+        output_base = default_dataset_base(base_directory)
+    if run_folders is None:
+        run_folders = engine.find_run_folders(base_directory)
+    if workers is None:
+        workers = engine.default_workers()
+
+    pairs = plan_pairs(run_folders, alignment_settings, output_width, output_height,
+                       crop_mode, crop_size, crops_per_pair, seed)
+    total = sum(len(pair['windows']) for pair in pairs)
+    if crop_mode == 'full':
+        sample_shape = (output_height, output_width, 3)
+    else:
+        sample_shape = (crop_size, crop_size, 3)
+
+    writer = ShardWriter(output_base, total, sample_shape, shard_size)
+    complete = False
+    try:
+        written = pipeline.run_pipeline(pairs, read_pair, crop_pair, writer.write,
+                                        read_threads=max(1, workers), compute_threads=1,
+                                        write_threads=max(1, workers // 2),
+                                        progress=progress, cancel_event=cancel_event)
+        if cancel_event is not None and cancel_event.is_set():
+            raise engine.ExportCancelled(written)
+        complete = True
+    finally:
+        writer.close(complete)
+
+    shards = writer.entries()
+    remove_stale_shards(output_base, {shard[side] for shard in shards for side in ('series', 'single')})
+    store.write_json_atomic(os.path.join(output_base, INDEX_FILENAME), {
+        'version': INDEX_VERSION,
+        'dtype': 'uint8',
+        'sample_shape': list(sample_shape),
+        'crop_mode': crop_mode,
+        'seed': seed,
+        'shards': shards,
+        'samples': [{'run': pair['run'], 'series': os.path.basename(pair['series_path']),
+                     'window': list(window)}
+                    for pair in pairs for window in pair['windows']]
+    })
+    return total, output_base
+
+
+class ShardedPairs:
+    """Read-only view of an exported dataset; indexing returns (series, single) without copying"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, INDEX_FILENAME)) as f:
+            self.index = json.load(f)
+        if self.index.get('version') != INDEX_VERSION:
+            raise ValueError(f"Unsupported dataset index version {self.index.get('version')}")
+        self.shards = [(np.load(os.path.join(directory, shard['series']), mmap_mode='r'),
+                        np.load(os.path.join(directory, shard['single']), mmap_mode='r'))
+                       for shard in self.index['shards']]
+        self.shard_size = self.shards[0][0].shape[0] if self.shards else 0
+
+    def __len__(self):
+        return sum(series.shape[0] for series, _ in self.shards)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        shard, slot = divmod(index, self.shard_size)
+        series, single = self.shards[shard]
+        return series[slot], single[slot]
+
+    def sample_info(self, index):
+        """Run, series file and crop window a sample came from"""
+        return self.index['samples'][index]
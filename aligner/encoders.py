@@ -0,0 +1,110 @@
+"""
+Output encoders for exported images.
+
+By default every aligned image keeps the format of its input and PIL's
+default encoder settings. An encoder configuration can instead write every
+image as PNG, lossless WebP, JPEG or raw .npy arrays, and tune each format:
+
+    {'format': 'png', 'png_compress_level': 1}
+    {'format': 'keep', 'jpeg_quality': 95, 'jpeg_subsampling': '4:4:4'}
+
+Options only apply to images written in their format, so with 'keep' the
+PNG options affect single.png and the JPEG options the series frames. The
+.npy files hold the HxWx3 uint8 array and load with np.load without
+decoding.
+
+With 'keep_depth', grayscale and 16-bit grayscale captures are exported
+with their own dtype and channels rather than as 8-bit RGB: the aligned
+crop arrives here as a NumPy array and is written as it is. 16-bit images
+need a format that holds them, PNG or .npy.
+"""
+
+import os
+import numpy as np
+from PIL import Image
+
+FORMATS = ('keep', 'png', 'webp', 'jpeg', 'npy')
+
+EXTENSIONS = {'png': '.png', 'webp': '.webp', 'jpeg': '.jpg', 'npy': '.npy'}
+
+JPEG_SUBSAMPLING = ('4:4:4', '4:2:2', '4:2:0')
+
+# PIL formats that store 16-bit grayscale
+HIGH_DEPTH_FORMATS = ('PNG', 'TIFF')
+
+# Option names and the PIL save arguments they set, per PIL format
+SAVE_OPTIONS = {
+    'PNG': {'png_compress_level': 'compress_level'},
+    'JPEG': {'jpeg_quality': 'quality', 'jpeg_subsampling': 'subsampling'},
+    'WEBP': {'webp_method': 'method'}
+}
+
+
+def default_encoder():
+    """Keep every input's format with PIL's default settings, as exports always did"""
+    return {'format': 'keep'}
+
+
+def make_encoder(output_format='keep', png_compress_level=None, jpeg_quality=None,
+                 jpeg_subsampling=None, webp_method=None, keep_depth=False):
+    """Encoder configuration; options left at None use PIL's defaults"""
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}, expected one of {', '.join(FORMATS)}")
+    if jpeg_subsampling is not None and jpeg_subsampling not in JPEG_SUBSAMPLING:
+        raise ValueError(f"Unknown JPEG subsampling {jpeg_subsampling!r}, "
+                         f"expected one of {', '.join(JPEG_SUBSAMPLING)}")
+    encoder = {'format': output_format}
+    options = {'png_compress_level': png_compress_level, 'jpeg_quality': jpeg_quality,
+               'jpeg_subsampling': jpeg_subsampling, 'webp_method': webp_method}
+    encoder.update((name, value) for name, value in options.items() if value is not None)
+    if keep_depth:
+        encoder['keep_depth'] = True
+    return encoder
+
+
+def is_default(encoder):
+    return encoder is None or encoder == default_encoder()
+
+
+def keeps_depth(encoder):
+    return bool(encoder) and encoder.get('keep_depth', False)
+
+
+def output_filename(filename, encoder):
+    """Name of the exported file for an input file name"""
+    if is_default(encoder) or encoder['format'] == 'keep':
+        return filename
+    return os.path.splitext(filename)[0] + EXTENSIONS[encoder['format']]
+
+
+def save_arguments(pil_format, encoder):
+    """PIL save() arguments for an image written in pil_format"""
+    arguments = {}
+    if pil_format == 'WEBP' and encoder and encoder['format'] == 'webp':
+        arguments['lossless'] = True
+    for name, argument in SAVE_OPTIONS.get(pil_format, {}).items():
+        if encoder and name in encoder:
+            arguments[argument] = encoder[name]
+    return arguments
+
+
+def encode(image, path, output_path, encoder=None):
+    """Write an aligned image to path in the format of the encoder
+
+    When the format is kept it comes from the extension of output_path, the
+    name the job was planned with; path may be a temporary name. image is
+    a PIL image, or a NumPy array for crops that kept their depth.
+    """
+    if encoder and encoder['format'] == 'npy':
+        with open(path, 'wb') as f:
+            np.save(f, image if isinstance(image, np.ndarray) else np.asarray(image.convert('RGB')))
+        return
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    if encoder and encoder['format'] != 'keep':
+        pil_format = encoder['format'].upper()
+    else:
+        pil_format = Image.registered_extensions()[os.path.splitext(output_path)[1].lower()]
+    if image.mode.startswith('I;16') and pil_format not in HIGH_DEPTH_FORMATS:
+        raise ValueError(f"{pil_format} cannot hold 16-bit images; export them as PNG or .npy")
+    image.save(path, format=pil_format, **save_arguments(pil_format, encoder))
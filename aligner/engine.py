@@ -0,0 +1,710 @@
+"""
+Headless alignment engine.
+
+Turns a base directory of run folders plus saved alignment settings into the
+UNSLICED_NOBLUR_ALIGNED tree. Nothing in here imports tkinter, so the export
+can run on machines without a display; the GUI calls the same functions.
+"""
+
+import io
+import os
+import re
+import math
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+
+from . import cache, encoders, framecache, metrics, pipeline, quality, store, warp
+
+OUTPUT_DIR_NAME = "UNSLICED_NOBLUR_ALIGNED"
+
+# Reference images every run folder must contain
+SINGLE_NAME = "single.png"
+SERIES_NAME = "series_0.jpg"
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Run folders are the directories whose names start with this
+RUN_PREFIX = "run"
+
+# Output size (all aligned images will be this size)
+OUTPUT_WIDTH = 600
+OUTPUT_HEIGHT = 900
+
+# Export layouts. In the preview layout images are centred and moved by
+# their offsets, as the GUI shows them and Auto Align measures them. The
+# canvas layout is the crop of the first exports, which reads image pixels
+# at the window plus the offset; settings without a layout keep it.
+CANVAS_LAYOUT = 'canvas'
+PREVIEW_LAYOUT = 'preview'
+
+# Most encoder threads of a streamed export; more only add decoded images held in flight
+MAX_WRITE_THREADS = 8
+
+# Working memory per output pixel of a tiled crop: warp map, source box and sampled values
+TILE_BYTES_PER_PIXEL = 128
+
+
+def run_sort_key(name):
+    """Natural sort key: run2 < run10 < run10_old < run10b"""
+    return tuple(int(part) if index % 2 else part
+                 for index, part in enumerate(re.split(r'(\d+)', name)))
+
+
+def list_images(run_folder):
+    """Names of the image files in a run folder, from a single directory listing"""
+    with os.scandir(run_folder) as entries:
+        return sorted(entry.name for entry in entries
+                      if entry.name.endswith(IMAGE_EXTENSIONS) and not entry.name.startswith('.')
+                      and entry.is_file())
+
+
+def has_reference_images(image_names):
+    return SINGLE_NAME in image_names and SERIES_NAME in image_names
+
+
+def list_run_directories(base_directory):
+    """Directory entries of the base directory that look like run folders"""
+    with os.scandir(base_directory) as entries:
+        return [entry for entry in entries
+                if entry.name.startswith(RUN_PREFIX) and entry.is_dir()]
+
+
+@metrics.timed('find_run_folders')
+def find_run_folders(base_directory):
+    """Find all run folders in the base directory that contain both reference images
+
+    Folders are sorted by their natural order, so names such as run12_old
+    are fine. See runs.RunIndex for a cached index that can be rescanned
+    incrementally.
+    """
+    run_folders = []
+    for entry in list_run_directories(base_directory):
+        try:
+            image_names = list_images(entry.path)
+        except OSError:
+            continue
+        if has_reference_images(image_names):
+            run_folders.append(entry.path)
+
+    run_folders.sort(key=lambda folder: run_sort_key(os.path.basename(folder)))
+    return run_folders
+
+
+def find_image_files(run_folder):
+    """Find all images in a run folder"""
+    return [os.path.join(run_folder, name) for name in list_images(run_folder)]
+
+
+def default_output_base(base_directory):
+    """Output tree lives next to the base directory"""
+    return os.path.join(os.path.dirname(base_directory), OUTPUT_DIR_NAME)
+
+
+def default_settings():
+    """Settings of a run nobody has aligned yet"""
+    return {
+        'transparency': 0.5,
+        'single_x': 0,
+        'single_y': 0,
+        'series_x': 0,
+        'series_y': 0,
+        'zoom_factor': 1.0,
+        'view_x': 0,
+        'view_y': 0,
+        'layout': PREVIEW_LAYOUT
+    }
+
+
+def run_layout(settings):
+    """Export layout of a run's settings; runs saved before layouts existed use the canvas layout"""
+    return settings.get('layout', CANVAS_LAYOUT)
+
+
+def image_offset(filename, settings):
+    """Return the (x, y) offset for an image: single.png has its own, everything else uses the series offset
+
+    Series frames whose drift against series_0.jpg was measured (see
+    registration.correct_drift_all) have it folded into the series offset:
+    a feature that drifted by +dx is read dx further right, which the canvas
+    layout does by adding the drift and the preview layout by subtracting it.
+    """
+    if filename == SINGLE_NAME:
+        return settings['single_x'], settings['single_y']
+    drift_x, drift_y = settings.get('series_drift', {}).get(filename, (0, 0))
+    if run_layout(settings) == PREVIEW_LAYOUT:
+        return settings['series_x'] - drift_x, settings['series_y'] - drift_y
+    return settings['series_x'] + drift_x, settings['series_y'] + drift_y
+
+
+def image_affine(filename, settings):
+    """Return the (rotation, scale) of an image: single.png is the reference, series images use the run's correction"""
+    if filename == SINGLE_NAME:
+        return 0.0, 1.0
+    return settings.get('series_rotation', 0.0), settings.get('series_scale', 1.0)
+
+
+def calculate_overlap_region(single_size, series_size, settings,
+                             output_width=OUTPUT_WIDTH, output_height=OUTPUT_HEIGHT):
+    """Calculate the crop region centered on the overlap of single.png and series_0.jpg
+
+    The region is in the coordinates of the run's layout: relative to the
+    images' corners for the canvas layout, to the centre for the preview.
+    """
+    single_w, single_h = single_size
+    series_w, series_h = series_size
+    centred = run_layout(settings) == PREVIEW_LAYOUT
+
+    # Calculate bounds for each image
+    single_left = settings['single_x'] - (single_w // 2 if centred else 0)
+    single_right = single_left + single_w
+    single_top = settings['single_y'] - (single_h // 2 if centred else 0)
+    single_bottom = single_top + single_h
+
+    series_left = settings['series_x'] - (series_w // 2 if centred else 0)
+    series_right = series_left + series_w
+    series_top = settings['series_y'] - (series_h // 2 if centred else 0)
+    series_bottom = series_top + series_h
+
+    # Find overlap region
+    overlap_left = max(single_left, series_left)
+    overlap_right = min(single_right, series_right)
+    overlap_top = max(single_top, series_top)
+    overlap_bottom = min(single_bottom, series_bottom)
+
+    # Check if there's actually an overlap
+    if overlap_left >= overlap_right or overlap_top >= overlap_bottom:
+        return None
+
+    overlap_center_x = (overlap_left + overlap_right) // 2
+    overlap_center_y = (overlap_top + overlap_bottom) // 2
+
+    # Define crop region centered on overlap, with target dimensions
+    return {
+        'left': overlap_center_x - output_width // 2,
+        'right': overlap_center_x + output_width // 2,
+        'top': overlap_center_y - output_height // 2,
+        'bottom': overlap_center_y + output_height // 2,
+        'width': output_width,
+        'height': output_height
+    }
+
+
+def crop_origin(image_size, x_offset, y_offset, overlap_bounds,
+                output_width=OUTPUT_WIDTH, output_height=OUTPUT_HEIGHT, layout=CANVAS_LAYOUT):
+    """Top-left of the output window in image pixels
+
+    The canvas layout reproduces pasting the image onto a white canvas of
+    size image + |offset| + output size and cropping the overlap from it,
+    without building the canvas. In the preview layout the image is centred
+    and moved by the offset. The window may extend past the image; those
+    pixels stay white.
+    """
+    width, height = image_size
+    if layout == PREVIEW_LAYOUT:
+        return overlap_bounds['left'] - x_offset + width // 2, overlap_bounds['top'] - y_offset + height // 2
+
+    canvas_width = width + abs(x_offset) + output_width
+    canvas_height = height + abs(y_offset) + output_height
+
+    # Position the image would have on the canvas
+    paste_x = max(0, -x_offset) + output_width // 2
+    paste_y = max(0, -y_offset) + output_height // 2
+
+    # Crop bounds relative to the canvas, kept within it
+    crop_left = paste_x + x_offset + overlap_bounds['left']
+    crop_top = paste_y + y_offset + overlap_bounds['top']
+    crop_left = max(0, min(crop_left, canvas_width - overlap_bounds['width']))
+    crop_top = max(0, min(crop_top, canvas_height - overlap_bounds['height']))
+
+    return crop_left - paste_x, crop_top - paste_y
+
+
+def covered_box(image_size, x_offset, y_offset, overlap_bounds,
+                output_width=OUTPUT_WIDTH, output_height=OUTPUT_HEIGHT, layout=CANVAS_LAYOUT):
+    """(left, top, right, bottom) of the output window that shows the image rather than white padding"""
+    if layout == PREVIEW_LAYOUT:
+        left, top = (math.floor(value) for value in crop_origin(image_size, x_offset, y_offset, overlap_bounds,
+                                                                 layout=layout))
+    else:
+        left, top = crop_origin(image_size, math.floor(x_offset), math.floor(y_offset), overlap_bounds,
+                                output_width, output_height)
+    width, height = image_size
+    return (max(0, -left), max(0, -top),
+            max(0, min(overlap_bounds['width'], width - left)),
+            max(0, min(overlap_bounds['height'], height - top)))
+
+
+def tile_rows(width, tile_budget):
+    """Output rows per strip of a tiled crop, so that one strip's working memory fits tile_budget bytes"""
+    return max(1, tile_budget // (width * TILE_BYTES_PER_PIXEL))
+
+
+def crop_window(image, left, top, width, height, rotation=0.0, scale=1.0, rows=None):
+    """Rows (start, stop) of the output window at (left, top) of the transformed image
+
+    Whole-pixel windows of untransformed images are a plain crop; fractional
+    windows and rotated or scaled images are sampled through a warp map.
+    """
+    start, stop = rows or (0, height)
+    if not warp.is_identity(rotation, scale) or (left, top) != (math.floor(left), math.floor(top)):
+        return warp.warp_map(image.size, left, top, width, height, rotation, scale, rows).apply(image)
+
+    # Whole-number float offsets, e.g. from drift or hand-edited settings, crop like ints
+    left, top = int(left), int(top) + start
+    height = stop - start
+    cropped = Image.new('RGB', (width, height), (255, 255, 255))
+
+    # Intersection of the output window with the image
+    source_left = max(left, 0)
+    source_top = max(top, 0)
+    source_right = min(left + width, image.width)
+    source_bottom = min(top + height, image.height)
+    if source_left >= source_right or source_top >= source_bottom:
+        return cropped
+
+    region = image.crop((source_left, source_top, source_right, source_bottom))
+    position = (source_left - left, source_top - top)
+    if region.mode == 'RGBA':
+        cropped.paste(region, position, region)
+    else:
+        cropped.paste(region, position)
+    return cropped
+
+
+def keeps_depth(image):
+    """Whether an image's pixels can be exported as an array of their own dtype and channels"""
+    return image.mode in ('L', 'RGB') or image.mode.startswith('I;16')
+
+
+def image_depth(image):
+    """(dtype, channel shape) of the arrays a keep_depth crop of image produces"""
+    if image.mode.startswith('I;16'):
+        return np.uint16, ()
+    return np.uint8, () if image.mode == 'L' else (len(image.getbands()),)
+
+
+def source_region(image, box):
+    """Pixels of a box inside the image as an array; mapped frames are sliced without a copy"""
+    left, top, right, bottom = box
+    if isinstance(image, framecache.MappedFrame):
+        return image.array[top:bottom, left:right]
+    return np.asarray(image.crop(box))
+
+
+def crop_window_array(image, left, top, width, height, rotation=0.0, scale=1.0, rows=None):
+    """crop_window as an array that keeps the image's dtype and channels; padding is white"""
+    start, stop = rows or (0, height)
+    dtype, channels = image_depth(image)
+    if not warp.is_identity(rotation, scale) or (left, top) != (math.floor(left), math.floor(top)):
+        warp_map = warp.warp_map(image.size, left, top, width, height, rotation, scale, rows)
+        region = source_region(image, warp_map.source_box) if warp_map.source_box else None
+        return warp_map.apply_array(region, dtype, channels)
+
+    left, top = int(left), int(top) + start
+    height = stop - start
+    cropped = np.full((height, width) + channels, np.iinfo(dtype).max, dtype=dtype)
+
+    source_left = max(left, 0)
+    source_top = max(top, 0)
+    source_right = min(left + width, image.width)
+    source_bottom = min(top + height, image.height)
+    if source_left < source_right and source_top < source_bottom:
+        cropped[source_top - top:source_bottom - top, source_left - left:source_right - left] = \
+            source_region(image, (source_left, source_top, source_right, source_bottom))
+    return cropped
+
+
+@metrics.timed('crop')
+def align_and_crop_to_overlap(image, x_offset, y_offset, overlap_bounds,
+                              output_width=OUTPUT_WIDTH, output_height=OUTPUT_HEIGHT,
+                              rotation=0.0, scale=1.0, tile_budget=None, keep_depth=False,
+                              layout=CANVAS_LAYOUT):
+    """Align image and crop to the overlap region
+
+    Only the part of the image inside the output window is copied into a
+    white output image; areas outside the image stay white. Fractional
+    offsets (sub-pixel drift correction) and a rotation or scale sample the
+    window through a warp map, which reads only the source pixels under it.
+
+    With tile_budget set (bytes), the window is processed in strips of rows
+    whose working memory stays within the budget, however large the window;
+    the result is identical. Strips are slower, as their warp maps are not
+    reused across frames.
+
+    With keep_depth set, grayscale, RGB and 16-bit grayscale images are
+    cropped into a NumPy array of their own dtype and channels instead of an
+    8-bit RGB image; other modes still give an RGB image.
+
+    layout places the image as in crop_origin.
+    """
+    left, top = crop_origin(image.size, x_offset, y_offset, overlap_bounds,
+                            output_width, output_height, layout)
+    width, height = overlap_bounds['width'], overlap_bounds['height']
+    as_array = keep_depth and keeps_depth(image)
+    crop = crop_window_array if as_array else crop_window
+    if tile_budget is None:
+        return crop(image, left, top, width, height, rotation, scale)
+
+    step = tile_rows(width, tile_budget)
+    if as_array:
+        dtype, channels = image_depth(image)
+        cropped = np.empty((height, width) + channels, dtype=dtype)
+        for start in range(0, height, step):
+            stop = min(start + step, height)
+            cropped[start:stop] = crop(image, left, top, width, height, rotation, scale, (start, stop))
+        return cropped
+
+    cropped = Image.new('RGB', (width, height), (255, 255, 255))
+    for start in range(0, height, step):
+        stop = min(start + step, height)
+        cropped.paste(crop(image, left, top, width, height, rotation, scale, (start, stop)), (0, start))
+    return cropped
+
+
+@metrics.timed('overlap_region')
+def run_overlap_region(run_folder, settings, output_width=OUTPUT_WIDTH, output_height=OUTPUT_HEIGHT):
+    """Open a run's reference images (header only) and calculate its overlap region"""
+    with Image.open(os.path.join(run_folder, SINGLE_NAME)) as single_image, \
+            Image.open(os.path.join(run_folder, SERIES_NAME)) as series_image:
+        return calculate_overlap_region(single_image.size, series_image.size, settings,
+                                        output_width, output_height)
+
+
+class ExportCancelled(Exception):
+    """Raised when an export is cancelled; carries the number of images already written"""
+
+    def __init__(self, processed):
+        super().__init__(f"Export cancelled after {processed} images")
+        self.processed = processed
+
+
+def default_workers():
+    """Use every core unless told otherwise"""
+    return os.cpu_count() or 1
+
+
+def process_pool(workers):
+    """Process pool used for all parallel work
+
+    The GUI exports from a worker thread, and forking a process that runs a
+    Tk interpreter is not safe, so workers always start clean interpreters.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def plan_run(run_folder, settings, output_base, overlap_bounds,
+             output_width=OUTPUT_WIDTH, output_height=OUTPUT_HEIGHT, encoder=None, tile_budget=None,
+             frame_cache=None):
+    """Build one export job per image in a run folder and create its output directory
+
+    encoder selects the output format and settings (see encoders.make_encoder);
+    by default every image keeps its input format. tile_budget (bytes) crops
+    in strips, see align_and_crop_to_overlap. frame_cache is a configuration
+    from framecache.make_config to keep decoded frames on disk between exports.
+    """
+    image_files = find_image_files(run_folder)
+    if not image_files:
+        return []
+
+    # Create run output directory
+    run_output_dir = os.path.join(output_base, os.path.basename(run_folder))
+    os.makedirs(run_output_dir, exist_ok=True)
+
+    # The reference images of the run are also scored for alignment quality
+    quality_roles = {SINGLE_NAME: 'single', SERIES_NAME: 'series'}
+
+    jobs = []
+    for image_path in image_files:
+        filename = os.path.basename(image_path)
+        x_offset, y_offset = image_offset(filename, settings)
+        rotation, scale = image_affine(filename, settings)
+        jobs.append({
+            'run': os.path.basename(run_folder),
+            'quality_role': quality_roles.get(filename),
+            'image_path': image_path,
+            'output_path': os.path.join(run_output_dir, encoders.output_filename(filename, encoder)),
+            'encoder': encoder,
+            'x_offset': x_offset,
+            'y_offset': y_offset,
+            'rotation': rotation,
+            'scale': scale,
+            'overlap_bounds': overlap_bounds,
+            'output_width': output_width,
+            'output_height': output_height,
+            'tile_budget': tile_budget,
+            'frame_cache': frame_cache,
+            'layout': run_layout(settings)
+        })
+    return jobs
+
+
+@metrics.timed('decode')
+def read_export_image(job):
+    """Decoded input image of a job
+
+    Images the GUI already decoded come from the in-memory cache. With a
+    frame cache configured, frames decoded by earlier exports are mapped
+    from it instead of decoded, and new decodes are added to it.
+
+    Files that are decoded are hashed from the bytes already read, and the
+    hash is kept in job['input_hash'] for the export manifest.
+    """
+    img = cache.shared_cache.get(job['image_path'])
+    if img is not None:
+        metrics.collector.count('cache_hits')
+        return job, img
+
+    frames = framecache.frame_cache(job['frame_cache']) if job.get('frame_cache') else None
+    img = frames.get(job['image_path']) if frames else None
+    if img is not None:
+        metrics.collector.count('frame_cache_hits')
+        return job, img
+
+    with open(job['image_path'], 'rb') as f:
+        data = f.read()
+    job['input_hash'] = store.content_hash(data)
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+    metrics.collector.count('input_bytes', len(data))
+    if frames:
+        with metrics.collector.timer('frame_cache_write'):
+            frames.put(job['image_path'], img)
+    return job, img
+
+
+def eight_bit_image(aligned):
+    """8-bit image of an aligned crop; 16-bit arrays keep their upper byte"""
+    if isinstance(aligned, Image.Image):
+        return aligned
+    if aligned.dtype != np.uint8:
+        aligned = (aligned >> 8).astype(np.uint8)
+    return Image.fromarray(aligned)
+
+
+def crop_export_image(loaded):
+    """Align and crop a decoded job image; reference images are handed to the quality collector"""
+    job, img = loaded
+    aligned_img = align_and_crop_to_overlap(img, job['x_offset'], job['y_offset'],
+                                            job['overlap_bounds'],
+                                            job['output_width'], job['output_height'],
+                                            job['rotation'], job['scale'], job.get('tile_budget'),
+                                            encoders.keeps_depth(job.get('encoder')), job['layout'])
+    if job.get('quality_role'):
+        with metrics.collector.timer('quality'):
+            box = covered_box(img.size, job['x_offset'], job['y_offset'], job['overlap_bounds'],
+                              job['output_width'], job['output_height'], job['layout'])
+            quality.collector.add(job['run'], job['quality_role'],
+                                  quality.thumbnail(eight_bit_image(aligned_img), box))
+    return job, aligned_img
+
+
+@metrics.timed('encode')
+def write_export_image(cropped):
+    """Encode and save an aligned image atomically"""
+    job, aligned_img = cropped
+    # Written under a temporary name and renamed, so readers and other export
+    # nodes never see a partially written image
+    temp_path = store.temporary_path(job['output_path'])
+    try:
+        encoders.encode(aligned_img, temp_path, job['output_path'], job.get('encoder'))
+        os.replace(temp_path, job['output_path'])
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    metrics.collector.count('images')
+    metrics.collector.count('output_bytes', os.path.getsize(job['output_path']))
+    return job['output_path']
+
+
+def export_image(job):
+    """Align, crop and save a single image; runs inside pool workers"""
+    return write_export_image(crop_export_image(read_export_image(job)))
+
+
+def export_image_in_worker(job):
+    """export_image for pool workers: also returns the input hash, metrics and quality thumbnails of this job"""
+    metrics.collector.reset()
+    output_path = export_image(job)
+    return output_path, job.get('input_hash'), metrics.collector.snapshot(), quality.collector.take_pending()
+
+
+def run_jobs(jobs, workers=None, progress=None, cancel_event=None):
+    """Run export jobs, in a process pool when workers > 1
+
+    progress(done, total, output_path) is called once per job, in job order,
+    from the calling thread. Setting cancel_event stops submitting new jobs and
+    raises ExportCancelled. Returns the number of images written.
+    """
+    if workers is None:
+        workers = default_workers()
+    total = len(jobs)
+    done = 0
+
+    if workers <= 1 or total <= 1:
+        for job in jobs:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ExportCancelled(done)
+            output_path = export_image(job)
+            done += 1
+            if progress:
+                progress(done, total, output_path)
+        return done
+
+    with process_pool(workers) as executor:
+        # Keep a bounded window of jobs in flight and collect them in order
+        pending = deque()
+        job_iter = iter(jobs)
+        try:
+            for job in itertools.islice(job_iter, workers * 4):
+                pending.append((job, executor.submit(export_image_in_worker, job)))
+            while pending:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ExportCancelled(done)
+                job, future = pending.popleft()
+                output_path, input_hash, worker_metrics, worker_quality = future.result()
+                # Handed back for the export manifest, as when the job runs in this process
+                if input_hash is not None:
+                    job['input_hash'] = input_hash
+                metrics.collector.merge(worker_metrics)
+                quality.collector.merge(worker_quality)
+                done += 1
+                if progress:
+                    progress(done, total, output_path)
+                for job in itertools.islice(job_iter, 1):
+                    pending.append((job, executor.submit(export_image_in_worker, job)))
+        except BaseException:
+            for _, future in pending:
+                future.cancel()
+            raise
+    return done
+
+
+def stream_jobs(jobs, workers=None, progress=None, cancel_event=None):
+    """Run export jobs through the threaded read -> crop -> encode pipeline
+
+    Meant for a single run inside the GUI process: decoding and encoding
+    overlap, memory stays bounded by the pipeline queues and decoded images
+    in the shared cache are reused. Encoding is the most expensive stage, so
+    it gets most of the threads, at most MAX_WRITE_THREADS; the encoders
+    release the GIL. Same contract as run_jobs.
+    """
+    if workers is None:
+        workers = default_workers()
+    compute_threads = max(1, workers // 4)
+    write_threads = max(1, min(workers - compute_threads, MAX_WRITE_THREADS))
+    written = pipeline.run_pipeline(jobs, read_export_image, crop_export_image, write_export_image,
+                                    read_threads=2, compute_threads=compute_threads,
+                                    write_threads=write_threads,
+                                    progress=progress, cancel_event=cancel_event)
+    if cancel_event is not None and cancel_event.is_set():
+        raise ExportCancelled(written)
+    return written
+
+
+def run_recorded_jobs(jobs, output_base, incremental=False, workers=None, progress=None,
+                      cancel_event=None, runner=run_jobs):
+    """Run export jobs and record each written image in the output's manifest
+
+    With incremental set, jobs whose output is still current according to the
+    manifest are skipped. The manifest is saved even if the export is
+    cancelled or fails, so the next run resumes where this one stopped.
+    runner is run_jobs (process pool) or stream_jobs (threaded pipeline).
+    Runs whose reference images were written get their quality scores
+    updated in the output's quality report (see quality.update_report).
+    Returns (images written, images skipped).
+    """
+    manifest = store.ExportManifest(output_base)
+    quality.collector.reset()
+    if incremental:
+        with metrics.collector.timer('manifest_check'):
+            todo = [job for job in jobs if not manifest.is_current(job)]
+    else:
+        todo = jobs
+    metrics.collector.count('up_to_date', len(jobs) - len(todo))
+
+    # Progress arrives in job order, so the count identifies the job
+    def record(done, total, output_path):
+        with metrics.collector.timer('manifest_record'):
+            manifest.record(todo[done - 1])
+        if progress:
+            progress(done, total, output_path)
+
+    try:
+        written = runner(todo, workers, record, cancel_event)
+    finally:
+        manifest.save()
+        quality.update_report(output_base, quality.collector.take_scores())
+    return written, len(jobs) - len(todo)
+
+
+def export_run(run_folder, settings, output_base, overlap_bounds=None,
+               output_width=OUTPUT_WIDTH, output_height=OUTPUT_HEIGHT,
+               workers=None, progress=None, cancel_event=None, encoder=None, tile_budget=None,
+               frame_cache=None):
+    """Align and crop every image in a run folder
+
+    The run is streamed through the threaded pipeline rather than a process
+    pool. Returns the number of images written, or None if the reference
+    images do not overlap with these settings.
+    """
+    if overlap_bounds is None:
+        overlap_bounds = run_overlap_region(run_folder, settings, output_width, output_height)
+    if not overlap_bounds:
+        return None
+
+    jobs = plan_run(run_folder, settings, output_base, overlap_bounds, output_width, output_height,
+                    encoder, tile_budget, frame_cache)
+    written, skipped = run_recorded_jobs(jobs, output_base, False, workers, progress, cancel_event,
+                                         runner=stream_jobs)
+    return written
+
+
+def export_all(base_directory, alignment_settings, output_base=None, run_folders=None,
+               output_width=OUTPUT_WIDTH, output_height=OUTPUT_HEIGHT,
+               workers=None, progress=None, cancel_event=None, incremental=True, encoder=None,
+               tile_budget=None, frame_cache=None):
+    """Export every run that has saved alignment settings
+
+    Runs without settings, with unreadable reference images or without an
+    overlap are skipped. Images from all runs share one worker pool. With
+    incremental set, images whose input and settings did not change since
+    the last export are not written again. encoder sets the output format
+    and settings (see encoders.make_encoder); tile_budget limits the memory
+    of each crop (see align_and_crop_to_overlap) and frame_cache keeps
+    decoded frames on disk for the next export (see framecache). Returns
+    (images processed, images already up to date, output base directory).
+    """
+    if output_base is None:
+        output_base = default_output_base(base_directory)
+    if run_folders is None:
+        run_folders = find_run_folders(base_directory)
+
+    jobs = []
+    for run_folder in run_folders:
+        run_name = os.path.basename(run_folder)
+
+        # Skip if no alignment settings saved
+        if run_name not in alignment_settings:
+            continue
+
+        settings = alignment_settings[run_name]
+
+        # Skip runs whose reference images cannot be read
+        try:
+            overlap_bounds = run_overlap_region(run_folder, settings, output_width, output_height)
+        except OSError:
+            continue
+        if not overlap_bounds:
+            continue
+
+        jobs.extend(plan_run(run_folder, settings, output_base, overlap_bounds,
+                             output_width, output_height, encoder, tile_budget, frame_cache))
+
+    total_processed, up_to_date = run_recorded_jobs(jobs, output_base, incremental,
+                                                    workers, progress, cancel_event)
+    return total_processed, up_to_date, output_base
@@ -0,0 +1,167 @@
+"""
+On-disk cache of decoded frames as memory-mapped arrays.
+
+Exporting a run again after tweaking its settings decodes every frame again,
+and decoding large JPEG and PNG frames costs more than aligning them. With
+the frame cache enabled, each frame decoded for export is also written to a
+cache directory as a raw .npy array. Later exports map that file instead of
+decoding, and cropping slices the output window straight out of the
+mapping, so only the rows under the window are read from disk.
+
+Entries are keyed by file path, modification time and size, like the
+in-memory cache, so an edited file is never served stale. The directory is
+kept under a size cap by evicting the least recently used entries (by file
+mtime, which a hit refreshes). Several processes may share one directory:
+entries are written under a temporary name and renamed into place.
+
+Only modes that map onto a plain array are cached (L, RGB, RGBA and 16-bit
+grayscale, which keeps its depth); other frames are decoded every time,
+exactly as without the cache.
+"""
+
+import os
+import hashlib
+import functools
+import numpy as np
+from PIL import Image, ImageMode
+
+from . import store
+
+FRAME_CACHE_DIR_NAME = "DECODED_FRAME_CACHE"
+
+# Default size cap of a cache directory
+DEFAULT_MAX_BYTES = 20 << 30
+
+# Modes stored, by the dtype and number of channels of their arrays
+CACHED_MODES = {('uint8', 1): 'L', ('uint8', 3): 'RGB', ('uint8', 4): 'RGBA', ('uint16', 1): 'I;16'}
+
+
+def default_cache_dir(base_directory):
+    """Cache lives next to the base directory, like the export"""
+    return os.path.join(os.path.dirname(os.path.abspath(base_directory)), FRAME_CACHE_DIR_NAME)
+
+
+def make_config(directory, max_bytes=DEFAULT_MAX_BYTES):
+    """Frame cache configuration as passed along with export jobs"""
+    return {'directory': os.path.abspath(directory), 'max_bytes': int(max_bytes)}
+
+
+def is_cacheable(image):
+    # A transparency key would be lost in the array
+    return image.mode in CACHED_MODES.values() and 'transparency' not in image.info
+
+
+class MappedFrame:
+    """A cached frame backed by a memory-mapped array
+
+    Offers the parts of the PIL image interface the crop path uses; crop()
+    copies only the requested box out of the mapping.
+    """
+
+    def __init__(self, array, mode):
+        self.array = array
+        self.mode = mode
+        self.height, self.width = array.shape[:2]
+        self.size = (self.width, self.height)
+        self.info = {}
+
+    def getbands(self):
+        return ImageMode.getmode(self.mode).bands
+
+    def crop(self, box):
+        """PIL image of a box; parts outside the frame are zero, as with PIL's crop"""
+        left, top, right, bottom = box
+        clipped_left, clipped_top = max(left, 0), max(top, 0)
+        clipped_right, clipped_bottom = min(right, self.width), min(bottom, self.height)
+        inside = self.array[clipped_top:max(clipped_bottom, clipped_top),
+                            clipped_left:max(clipped_right, clipped_left)]
+        if (clipped_left, clipped_top, clipped_right, clipped_bottom) == (left, top, right, bottom):
+            return Image.fromarray(np.ascontiguousarray(inside))
+
+        region = np.zeros((bottom - top, right - left) + self.array.shape[2:], dtype=self.array.dtype)
+        if inside.size:
+            region[clipped_top - top:clipped_bottom - top, clipped_left - left:clipped_right - left] = inside
+        return Image.fromarray(region)
+
+
+class FrameCache:
+    """Directory of decoded frames, bounded by total size in bytes"""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, path):
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    def get(self, path):
+        """MappedFrame of a cached file, or None"""
+        try:
+            entry = self.entry_path(path)
+            array = np.load(entry, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if array.ndim not in (2, 3):
+            return None
+        mode = CACHED_MODES.get((array.dtype.name, 1 if array.ndim == 2 else array.shape[-1]))
+        if mode is None:
+            return None
+        try:
+            # Refresh the entry's place in the LRU order
+            os.utime(entry)
+        except OSError:
+            pass
+        return MappedFrame(array, mode)
+
+    def put(self, path, image):
+        """Store a decoded image, if its mode can be cached, and evict old entries beyond the cap"""
+        if not is_cacheable(image):
+            return
+        entry = self.entry_path(path)
+        temp_path = store.temporary_path(entry)
+        try:
+            with open(temp_path, 'wb') as f:
+                np.save(f, np.asarray(image))
+            os.replace(temp_path, entry)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the directory fits the cap"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as scan:
+            for item in scan:
+                if not item.name.endswith('.npy'):
+                    continue
+                try:
+                    stat = item.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+                total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                # Processes that mapped the entry keep reading it until they are done
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+@functools.lru_cache(maxsize=None)
+def open_cache(directory, max_bytes):
+    return FrameCache(directory, max_bytes)
+
+
+def frame_cache(config):
+    """Process-wide FrameCache for a configuration from make_config"""
+    return open_cache(config['directory'], config['max_bytes'])
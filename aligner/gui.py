@@ -0,0 +1,936 @@
+"""
+Name: Jasdeep Singh
+Date: 2024-07-16
+Description: A GUI tool for aligning images from multiple runs using Tkinter and PIL.
+"""
+
+
+
+import tkinter as tk
+from tkinter import ttk, filedialog, messagebox
+from PIL import Image, ImageTk
+import os
+import queue
+import threading
+import numpy as np
+
+from . import cache, encoders, engine, framecache, metrics, preview, quality, registration, runs, store
+
+class ImageAlignmentTool:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("Image Alignment Tool")
+        self.root.geometry("1200x800")
+        
+        # Variables
+        self.base_directory = ""
+        self.run_folders = []
+        self.current_run_index = 0
+        self.current_run_folder = ""
+        
+        # Run folder index, rescanned in the background to pick up new captures
+        self.run_index = None
+        self.rescan_interval_ms = 2000
+        self.rescan_job = None
+        self.rescan_thread = None
+        self.rescan_queue = queue.Queue()
+        
+        # Alignment quality scores from the last exports, for jumping to the worst runs
+        self.quality_report = {}
+        self.worst_position = -1
+        
+        # Images
+        self.single_image = None
+        self.series_image = None
+        self.single_photo = None
+        self.series_photo = None
+        
+        # Decoded, pre-scaled preview levels of the current run's images
+        self.single_pyramid = None
+        self.series_pyramid = None
+        
+        # Decoded images and pyramids are shared with export; neighbours load in the background
+        self.image_cache = cache.shared_cache
+        self.prefetcher = cache.Prefetcher(self.image_cache)
+        
+        # Alignment parameters
+        self.transparency = tk.DoubleVar(value=0.5)
+        self.single_x_offset = tk.IntVar(value=0)
+        self.single_y_offset = tk.IntVar(value=0)
+        self.series_x_offset = tk.IntVar(value=0)
+        self.series_y_offset = tk.IntVar(value=0)
+        self.series_rotation = tk.DoubleVar(value=0.0)
+        self.series_scale = tk.DoubleVar(value=1.0)
+        self.estimate_affine = tk.BooleanVar(value=False)
+        # Runs saved before the preview layout keep exporting in the canvas layout until re-aligned
+        self.export_layout = engine.PREVIEW_LAYOUT
+        
+        # Display parameters
+        self.min_zoom = 0.2
+        self.max_zoom = 3.0
+        self.zoom_factor = tk.DoubleVar(value=1.0)
+        self.view_x_offset = tk.IntVar(value=0)
+        self.view_y_offset = tk.IntVar(value=0)
+        self.overlay_mode = tk.StringVar(value='blend')
+        
+        # Canvas size
+        self.canvas_width = 600
+        self.canvas_height = 400
+        
+        # Render scheduling: slider events are coalesced into one render per
+        # frame interval, and a high-quality pass follows once they stop
+        self.frame_interval_ms = 30
+        self.idle_delay_ms = 200
+        self.render_job = None
+        self.refine_job = None
+        self.render_degraded = False
+        
+        # Output size (all aligned images will be this size)
+        self.output_width = engine.OUTPUT_WIDTH
+        self.output_height = engine.OUTPUT_HEIGHT
+        
+        # Store alignment settings for each run
+        self.alignment_settings = {}
+        
+        # Background export state
+        self.export_workers = tk.IntVar(value=engine.default_workers())
+        self.export_format = tk.StringVar(value='keep')
+        self.use_frame_cache = tk.BooleanVar(value=False)
+        self.keep_depth = tk.BooleanVar(value=False)
+        self.export_thread = None
+        self.export_queue = None
+        self.export_cancel = None
+        self.export_rate = None
+        
+        self.setup_ui()
+        
+    def setup_ui(self):
+        # Main frame
+        main_frame = ttk.Frame(self.root, padding="10")
+        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+        # Configure grid weights
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(0, weight=1)
+        main_frame.columnconfigure(1, weight=1)
+        main_frame.rowconfigure(1, weight=1)
+        
+        # Directory selection
+        dir_frame = ttk.Frame(main_frame)
+        dir_frame.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        ttk.Button(dir_frame, text="Select Base Directory", 
+                  command=self.select_directory).grid(row=0, column=0, padx=(0, 10))
+        
+        self.dir_label = ttk.Label(dir_frame, text="No directory selected")
+        self.dir_label.grid(row=0, column=1, sticky=tk.W)
+        
+        # Run selection
+        run_frame = ttk.Frame(main_frame)
+        run_frame.grid(row=0, column=1, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        ttk.Label(run_frame, text="Current Run:").grid(row=0, column=0, padx=(0, 10))
+        self.run_label = ttk.Label(run_frame, text="No run loaded")
+        self.run_label.grid(row=0, column=1, padx=(0, 10))
+        
+        ttk.Button(run_frame, text="Previous Run", 
+                  command=self.previous_run).grid(row=0, column=2, padx=(0, 5))
+        ttk.Button(run_frame, text="Next Run", 
+                  command=self.next_run).grid(row=0, column=3, padx=(0, 10))
+        ttk.Button(run_frame, text="Next Worst Run", 
+                  command=self.next_worst_run).grid(row=0, column=4, padx=(0, 10))
+        
+        # Control panel
+        control_frame = ttk.Frame(main_frame)
+        control_frame.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(0, 10))
+        
+        # Transparency control
+        ttk.Label(control_frame, text="Transparency").grid(row=0, column=0, sticky=tk.W, pady=(0, 5))
+        transparency_scale = ttk.Scale(control_frame, from_=0.0, to=1.0, 
+                                     variable=self.transparency, orient=tk.HORIZONTAL,
+                                     command=self.request_render)
+        transparency_scale.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 15))
+        
+        # Zoom control
+        ttk.Label(control_frame, text="Zoom").grid(row=2, column=0, sticky=tk.W, pady=(0, 5))
+        zoom_scale = ttk.Scale(control_frame, from_=self.min_zoom, to=self.max_zoom, 
+                              variable=self.zoom_factor, orient=tk.HORIZONTAL,
+                              command=self.request_render)
+        zoom_scale.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=(0, 15))
+        
+        # View centering controls
+        ttk.Label(control_frame, text="View Position").grid(row=4, column=0, sticky=tk.W, pady=(0, 5))
+        
+        ttk.Label(control_frame, text="View X").grid(row=5, column=0, sticky=tk.W)
+        view_x_scale = ttk.Scale(control_frame, from_=-400, to=400, 
+                                variable=self.view_x_offset, orient=tk.HORIZONTAL,
+                                command=self.request_render)
+        view_x_scale.grid(row=6, column=0, sticky=(tk.W, tk.E), pady=(0, 5))
+        
+        ttk.Label(control_frame, text="View Y").grid(row=7, column=0, sticky=tk.W)
+        view_y_scale = ttk.Scale(control_frame, from_=-400, to=400, 
+                                variable=self.view_y_offset, orient=tk.HORIZONTAL,
+                                command=self.request_render)
+        view_y_scale.grid(row=8, column=0, sticky=(tk.W, tk.E), pady=(0, 15))
+        
+        # Single image controls
+        ttk.Label(control_frame, text="Single.png Position").grid(row=9, column=0, sticky=tk.W, pady=(0, 5))
+        
+        ttk.Label(control_frame, text="X Offset").grid(row=10, column=0, sticky=tk.W)
+        single_x_scale = ttk.Scale(control_frame, from_=-200, to=200, 
+                                  variable=self.single_x_offset, orient=tk.HORIZONTAL,
+                                  command=self.request_render)
+        single_x_scale.grid(row=11, column=0, sticky=(tk.W, tk.E), pady=(0, 5))
+        
+        ttk.Label(control_frame, text="Y Offset").grid(row=12, column=0, sticky=tk.W)
+        single_y_scale = ttk.Scale(control_frame, from_=-200, to=200, 
+                                  variable=self.single_y_offset, orient=tk.HORIZONTAL,
+                                  command=self.request_render)
+        single_y_scale.grid(row=13, column=0, sticky=(tk.W, tk.E), pady=(0, 15))
+        
+        # Series image controls
+        ttk.Label(control_frame, text="Series_0.jpg Position").grid(row=14, column=0, sticky=tk.W, pady=(0, 5))
+        
+        ttk.Label(control_frame, text="X Offset").grid(row=15, column=0, sticky=tk.W)
+        series_x_scale = ttk.Scale(control_frame, from_=-200, to=200, 
+                                  variable=self.series_x_offset, orient=tk.HORIZONTAL,
+                                  command=self.request_render)
+        series_x_scale.grid(row=16, column=0, sticky=(tk.W, tk.E), pady=(0, 5))
+        
+        ttk.Label(control_frame, text="Y Offset").grid(row=17, column=0, sticky=tk.W)
+        series_y_scale = ttk.Scale(control_frame, from_=-200, to=200, 
+                                  variable=self.series_y_offset, orient=tk.HORIZONTAL,
+                                  command=self.request_render)
+        series_y_scale.grid(row=18, column=0, sticky=(tk.W, tk.E), pady=(0, 5))
+        
+        ttk.Label(control_frame, text="Rotation (degrees)").grid(row=19, column=0, sticky=tk.W)
+        series_rotation_scale = ttk.Scale(control_frame, from_=-10.0, to=10.0, 
+                                         variable=self.series_rotation, orient=tk.HORIZONTAL,
+                                         command=self.request_render)
+        series_rotation_scale.grid(row=20, column=0, sticky=(tk.W, tk.E), pady=(0, 5))
+        
+        ttk.Label(control_frame, text="Scale").grid(row=21, column=0, sticky=tk.W)
+        series_scale_scale = ttk.Scale(control_frame, from_=0.9, to=1.1, 
+                                      variable=self.series_scale, orient=tk.HORIZONTAL,
+                                      command=self.request_render)
+        series_scale_scale.grid(row=22, column=0, sticky=(tk.W, tk.E), pady=(0, 15))
+        
+        # Reset and auto align buttons
+        align_frame = ttk.Frame(control_frame)
+        align_frame.grid(row=23, column=0, pady=(0, 10))
+        ttk.Button(align_frame, text="Reset Alignment", 
+                  command=self.reset_alignment).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(align_frame, text="Auto Align", 
+                  command=self.auto_align).grid(row=0, column=1, padx=(0, 5))
+        ttk.Button(align_frame, text="Correct Drift", 
+                  command=self.correct_drift).grid(row=0, column=2)
+        ttk.Checkbutton(align_frame, text="Auto Align rotation and scale", 
+                       variable=self.estimate_affine).grid(row=1, column=0, columnspan=3, sticky=tk.W)
+        
+        # Apply button
+        ttk.Button(control_frame, text="Apply to All Images in Run", 
+                  command=self.apply_alignment).grid(row=24, column=0, pady=(0, 10))
+        
+        # Save all button
+        ttk.Button(control_frame, text="Save All Processed Images", 
+                  command=self.save_all_processed).grid(row=25, column=0, pady=(0, 10))
+        
+        # Settings file buttons (the same file drives "python -m aligner batch")
+        settings_frame = ttk.Frame(control_frame)
+        settings_frame.grid(row=26, column=0, pady=(0, 10))
+        ttk.Button(settings_frame, text="Save Settings...", 
+                  command=self.save_settings_file).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(settings_frame, text="Load Settings...", 
+                  command=self.load_settings_file).grid(row=0, column=1)
+        
+        # Export worker count, progress and cancellation
+        export_frame = ttk.Frame(control_frame)
+        export_frame.grid(row=27, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        ttk.Label(export_frame, text="Workers").grid(row=0, column=0, sticky=tk.W, padx=(0, 5))
+        ttk.Spinbox(export_frame, from_=1, to=256, width=5,
+                   textvariable=self.export_workers).grid(row=0, column=1, sticky=tk.W)
+        ttk.Button(export_frame, text="Cancel Export", 
+                  command=self.cancel_export).grid(row=0, column=2, padx=(10, 0))
+        self.progress_bar = ttk.Progressbar(export_frame, orient=tk.HORIZONTAL, mode='determinate')
+        self.progress_bar.grid(row=1, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(5, 0))
+        self.progress_label = ttk.Label(export_frame, text="")
+        self.progress_label.grid(row=2, column=0, columnspan=3, sticky=tk.W)
+        ttk.Label(export_frame, text="Format").grid(row=3, column=0, sticky=tk.W, padx=(0, 5))
+        ttk.Combobox(export_frame, textvariable=self.export_format, values=encoders.FORMATS,
+                    state='readonly', width=6).grid(row=3, column=1, sticky=tk.W)
+        ttk.Checkbutton(export_frame, text="Cache decoded frames on disk",
+                       variable=self.use_frame_cache).grid(row=4, column=0, columnspan=3, sticky=tk.W)
+        ttk.Checkbutton(export_frame, text="Keep bit depth of grayscale and 16-bit images",
+                       variable=self.keep_depth).grid(row=5, column=0, columnspan=3, sticky=tk.W)
+        export_frame.columnconfigure(2, weight=1)
+        
+        # Configure control frame column weight
+        control_frame.columnconfigure(0, weight=1)
+        
+        # Canvas for image display
+        canvas_frame = ttk.Frame(main_frame)
+        canvas_frame.grid(row=1, column=1, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+        self.canvas = tk.Canvas(canvas_frame, width=self.canvas_width, 
+                               height=self.canvas_height, bg='white')
+        self.canvas.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+        # Overlay mode; transparency moves the checkerboard and the swipe divider
+        overlay_frame = ttk.Frame(canvas_frame)
+        overlay_frame.grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        ttk.Label(overlay_frame, text="Overlay:").grid(row=0, column=0, padx=(0, 5))
+        for column, mode in enumerate(preview.OVERLAY_MODES, start=1):
+            ttk.Radiobutton(overlay_frame, text=mode.capitalize(), value=mode,
+                           variable=self.overlay_mode,
+                           command=self.update_display).grid(row=0, column=column, padx=(0, 5))
+        
+        # Configure canvas frame weights
+        canvas_frame.columnconfigure(0, weight=1)
+        canvas_frame.rowconfigure(0, weight=1)
+        
+    def select_directory(self):
+        directory = filedialog.askdirectory()
+        if directory:
+            self.base_directory = directory
+            self.dir_label.config(text=f"Directory: {directory}")
+            self.load_saved_settings()
+            self.find_run_folders()
+            
+    def load_saved_settings(self):
+        """Resume from the settings sidecar of the base directory, if there is one"""
+        self.alignment_settings = {}
+        self.current_run_folder = ""
+        path = store.settings_path(self.base_directory)
+        if not os.path.exists(path):
+            return
+        try:
+            self.alignment_settings = store.load_settings(path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load saved settings: {str(e)}")
+            
+    def persist_settings(self):
+        """Write all alignment settings to the base directory's sidecar file"""
+        if not self.base_directory:
+            return
+        try:
+            store.save_settings(store.settings_path(self.base_directory), self.alignment_settings)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save settings: {str(e)}")
+            
+    def find_run_folders(self):
+        """Find all run folders in the base directory"""
+        if not self.base_directory:
+            return
+            
+        self.run_index = runs.RunIndex(self.base_directory)
+        self.run_index.scan()
+        self.run_index.save()
+        self.run_folders = self.run_index.run_folders()
+        self.load_quality_report()
+        if self.rescan_job is None:
+            self.rescan_job = self.root.after(self.rescan_interval_ms, self.rescan_runs)
+        
+        if self.run_folders:
+            self.current_run_index = 0
+            self.load_current_run()
+        else:
+            messagebox.showwarning("No Runs Found", 
+                                 "No run folders with both single.png and series_0.jpg found. "
+                                 "New run folders will be picked up as they appear.")
+            
+    def rescan_runs(self):
+        """Periodically rescan the run index on a background thread"""
+        self.rescan_job = self.root.after(self.rescan_interval_ms, self.rescan_runs)
+        
+        try:
+            index, changes = self.rescan_queue.get_nowait()
+        except queue.Empty:
+            if self.rescan_thread is not None:
+                return
+        else:
+            self.rescan_thread = None
+            # Results for a base directory that is no longer open are dropped
+            if index is self.run_index and any(changes.values()):
+                self.update_run_list()
+        
+        index = self.run_index
+        if index is None:
+            return
+        
+        def scan():
+            changes = index.scan()
+            if any(changes.values()):
+                index.save()
+            self.rescan_queue.put((index, changes))
+        
+        self.rescan_thread = threading.Thread(target=scan, daemon=True)
+        self.rescan_thread.start()
+        
+    def update_run_list(self):
+        """Refresh the run list after a rescan, staying on the current run"""
+        run_folders = self.run_index.run_folders()
+        if run_folders == self.run_folders:
+            return
+        
+        self.run_folders = run_folders
+        if self.current_run_folder in run_folders:
+            self.current_run_index = run_folders.index(self.current_run_folder)
+            self.update_run_label()
+            self.prefetch_neighbours()
+        elif run_folders:
+            # The current run disappeared or none was loaded yet
+            self.current_run_index = min(self.current_run_index, len(run_folders) - 1)
+            self.load_current_run()
+            
+    def update_run_label(self):
+        run_name = os.path.basename(self.current_run_folder)
+        text = f"{run_name} ({self.current_run_index + 1}/{len(self.run_folders)})"
+        if run_name in self.quality_report:
+            run = self.quality_report[run_name]
+            text += f" - quality {run['score']:.2f}"
+            if run['flagged']:
+                text += " (flagged)"
+        self.run_label.config(text=text)
+        
+    def load_quality_report(self):
+        """Read the quality scores the exports left in the output directory"""
+        self.quality_report = quality.load_report(engine.default_output_base(self.base_directory))
+        self.worst_position = -1
+        if self.current_run_folder:
+            self.update_run_label()
+            
+    def next_worst_run(self):
+        """Go to the next run in the quality report's ranking, starting with the worst"""
+        if not self.quality_report:
+            self.load_quality_report()
+        run_names = [os.path.basename(folder) for folder in self.run_folders]
+        ranking = [name for name in quality.ranked(self.quality_report) if name in run_names]
+        if not ranking:
+            messagebox.showinfo("No Quality Scores", "Export runs first to score their alignment.")
+            return
+        
+        self.worst_position = (self.worst_position + 1) % len(ranking)
+        self.save_current_alignment()
+        self.current_run_index = run_names.index(ranking[self.worst_position])
+        self.load_current_run()
+            
+    def load_current_run(self):
+        """Load the current run's images"""
+        if not self.run_folders:
+            return
+            
+        self.current_run_folder = self.run_folders[self.current_run_index]
+        run_name = os.path.basename(self.current_run_folder)
+        self.update_run_label()
+        
+        # Load existing alignment settings if available
+        if run_name in self.alignment_settings:
+            settings = self.alignment_settings[run_name]
+            self.transparency.set(settings['transparency'])
+            self.single_x_offset.set(settings['single_x'])
+            self.single_y_offset.set(settings['single_y'])
+            self.series_x_offset.set(settings['series_x'])
+            self.series_y_offset.set(settings['series_y'])
+            self.series_rotation.set(settings.get('series_rotation', 0.0))
+            self.series_scale.set(settings.get('series_scale', 1.0))
+            self.export_layout = engine.run_layout(settings)
+            # Load view settings if they exist
+            if 'zoom_factor' in settings:
+                self.zoom_factor.set(settings['zoom_factor'])
+                self.view_x_offset.set(settings['view_x'])
+                self.view_y_offset.set(settings['view_y'])
+        else:
+            self.reset_alignment()
+        
+        # Load images
+        try:
+            single_path = os.path.join(self.current_run_folder, engine.SINGLE_NAME)
+            series_path = os.path.join(self.current_run_folder, engine.SERIES_NAME)
+            
+            # Full-resolution images are used when prefetched; otherwise only the header is read
+            self.single_image = self.image_cache.get(single_path) or Image.open(single_path)
+            self.series_image = self.image_cache.get(series_path) or Image.open(series_path)
+            
+            max_scale = self.base_scale_ratio() * self.max_zoom
+            self.single_pyramid = self.load_pyramid(single_path, max_scale)
+            self.series_pyramid = self.load_pyramid(series_path, max_scale)
+            
+            if run_name not in self.alignment_settings:
+                self.seed_alignment()
+            
+            self.update_display()
+            self.prefetch_neighbours()
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load images: {str(e)}")
+            
+    def load_pyramid(self, path, max_scale):
+        """Preview pyramid for an image from the cache, decoding only what the largest zoom can show"""
+        return self.image_cache.get_or_load(
+            path, lambda: preview.PreviewPyramid(*preview.open_for_preview(path, max_scale)),
+            'preview', preview.PreviewPyramid.nbytes)
+        
+    def prefetch_neighbours(self):
+        """Warm the cache with the next and previous runs while the current one is aligned"""
+        tasks = []
+        neighbours = [self.current_run_index + 1, self.current_run_index - 1]
+        for index in neighbours:
+            if 0 <= index < len(self.run_folders):
+                tasks.extend(self.preview_tasks(self.run_folders[index]))
+        
+        # Full-resolution references for Auto Align and export, current run first
+        for index in [self.current_run_index] + neighbours:
+            if 0 <= index < len(self.run_folders):
+                for name in (engine.SINGLE_NAME, engine.SERIES_NAME):
+                    path = os.path.join(self.run_folders[index], name)
+                    tasks.append((path, lambda path=path: cache.decode_image(path), 'full', None))
+        
+        self.prefetcher.prefetch(tasks)
+        
+    def preview_tasks(self, run_folder):
+        """Prefetch tasks that build a run's preview pyramids"""
+        single_path = os.path.join(run_folder, engine.SINGLE_NAME)
+        series_path = os.path.join(run_folder, engine.SERIES_NAME)
+        zoom = self.alignment_settings.get(os.path.basename(run_folder), {}).get('zoom_factor', 1.0)
+        
+        def pyramid_loader(path):
+            def load():
+                with Image.open(single_path) as single_image, Image.open(series_path) as series_image:
+                    max_scale = self.fit_scale(single_image.size, series_image.size) * self.max_zoom
+                pyramid = preview.PreviewPyramid(*preview.open_for_preview(path, max_scale))
+                # Build the level the run opens at ahead of time
+                pyramid.get(max_scale / self.max_zoom * zoom)
+                return pyramid
+            return load
+        
+        return [(path, pyramid_loader(path), 'preview', preview.PreviewPyramid.nbytes)
+                for path in (single_path, series_path)]
+            
+    def previous_run(self):
+        if self.run_folders and self.current_run_index > 0:
+            self.save_current_alignment()
+            self.current_run_index -= 1
+            self.load_current_run()
+            
+    def next_run(self):
+        if self.run_folders and self.current_run_index < len(self.run_folders) - 1:
+            self.save_current_alignment()
+            self.current_run_index += 1
+            self.load_current_run()
+            
+    def save_current_alignment(self):
+        """Save current alignment settings"""
+        if self.current_run_folder:
+            run_name = os.path.basename(self.current_run_folder)
+            # Keep values without a slider, such as the measured series drift
+            previous = self.alignment_settings.get(run_name, {})
+            self.alignment_settings[run_name] = dict(previous, **self.current_settings())
+            self.persist_settings()
+            
+    def reset_alignment(self):
+        """Reset all alignment parameters to default"""
+        self.transparency.set(0.5)
+        self.single_x_offset.set(0)
+        self.single_y_offset.set(0)
+        self.series_x_offset.set(0)
+        self.series_y_offset.set(0)
+        self.series_rotation.set(0.0)
+        self.series_scale.set(1.0)
+        self.export_layout = engine.PREVIEW_LAYOUT
+        self.zoom_factor.set(1.0)
+        self.view_x_offset.set(0)
+        self.view_y_offset.set(0)
+        self.update_display()
+        
+    def seed_alignment(self):
+        """Start a new run from the nearest aligned run's settings, refined by a local search
+        
+        The neighbour's settings are shown right away; the search decodes
+        the run's reference images on a background thread, and its result
+        replaces them if the run is still open and its sliders untouched.
+        """
+        neighbour = registration.nearest_aligned_run(self.run_folders, self.alignment_settings,
+                                                     self.current_run_folder)
+        if neighbour is None:
+            return
+        
+        seed = registration.seed_settings(self.alignment_settings[neighbour])
+        self.show_seed(seed, f"Seeding from {neighbour}...")
+        run_folder = self.current_run_folder
+        shown = self.alignment_offsets()
+        seed_queue = queue.Queue()
+        
+        def search():
+            try:
+                # Full decodes go through the cache, where export can reuse them
+                single_image = self.image_cache.load_image(os.path.join(run_folder, engine.SINGLE_NAME))
+                series_image = self.image_cache.load_image(os.path.join(run_folder, engine.SERIES_NAME))
+                seed_queue.put(registration.seed_align(single_image, series_image, seed))
+            except Exception as e:
+                seed_queue.put(e)
+        
+        threading.Thread(target=search, daemon=True).start()
+        self.root.after(self.frame_interval_ms, self.poll_seed, seed_queue, run_folder, shown, seed, neighbour)
+        
+    def poll_seed(self, seed_queue, run_folder, shown, seed, neighbour):
+        """Apply the seeded search once it finishes, unless the user has moved on"""
+        try:
+            result = seed_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(self.frame_interval_ms, self.poll_seed, seed_queue, run_folder, shown, seed, neighbour)
+            return
+        
+        # Dropped once the run was left, saved or adjusted by hand
+        if (run_folder != self.current_run_folder or os.path.basename(run_folder) in self.alignment_settings
+                or self.alignment_offsets() != shown):
+            return
+        if isinstance(result, Exception):
+            self.progress_label.config(text=f"Seeded from {neighbour}; search failed: {result}")
+            return
+        
+        settings, score = result
+        text = f"Seeded from {neighbour} (NCC {score:.2f})"
+        # A poor match keeps the neighbour's offsets, which are usually close anyway
+        if score < registration.MIN_SEED_NCC:
+            settings = seed
+            text = f"Seeded from {neighbour}; no close match, try Auto Align"
+        self.show_seed(settings, text)
+        self.update_display()
+        
+    def alignment_offsets(self):
+        """The slider values an alignment search sets"""
+        settings = self.current_settings()
+        return {key: settings[key] for key in ('single_x', 'single_y', 'series_x', 'series_y',
+                                               'series_rotation', 'series_scale')}
+        
+    def show_seed(self, settings, text):
+        """Show seeded settings on the sliders"""
+        self.single_x_offset.set(settings['single_x'])
+        self.single_y_offset.set(settings['single_y'])
+        self.series_x_offset.set(settings['series_x'])
+        self.series_y_offset.set(settings['series_y'])
+        self.series_rotation.set(settings.get('series_rotation', 0.0))
+        self.series_scale.set(settings.get('series_scale', 1.0))
+        self.export_layout = settings['layout']
+        self.zoom_factor.set(settings['zoom_factor'])
+        self.view_x_offset.set(settings['view_x'])
+        self.view_y_offset.set(settings['view_y'])
+        self.progress_label.config(text=text)
+        
+    def auto_align(self):
+        """Register series_0.jpg onto single.png and fill in the series offsets"""
+        if not self.single_image or not self.series_image:
+            messagebox.showwarning("No Run Selected", "Please select a run first.")
+            return
+        
+        try:
+            # Full decodes go through the cache, where export can reuse them
+            self.single_image = self.image_cache.load_image(
+                os.path.join(self.current_run_folder, engine.SINGLE_NAME))
+            self.series_image = self.image_cache.load_image(
+                os.path.join(self.current_run_folder, engine.SERIES_NAME))
+            settings = registration.auto_align(self.single_image, self.series_image,
+                                               self.current_settings(), self.estimate_affine.get())
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to auto align: {str(e)}")
+            return
+        
+        # The sliders stay available for fine-tuning from here
+        self.series_x_offset.set(settings['series_x'])
+        self.series_y_offset.set(settings['series_y'])
+        self.series_rotation.set(settings.get('series_rotation', 0.0))
+        self.series_scale.set(settings.get('series_scale', 1.0))
+        self.export_layout = settings['layout']
+        self.update_display()
+        
+    def correct_drift(self):
+        """Measure the drift of every series frame against series_0.jpg for the current run"""
+        if not self.current_run_folder:
+            messagebox.showwarning("No Run Selected", "Please select a run first.")
+            return
+        
+        self.save_current_alignment()
+        run_name = os.path.basename(self.current_run_folder)
+        try:
+            settings = registration.correct_drift_run(self.current_run_folder,
+                                                      self.alignment_settings[run_name])
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to measure drift: {str(e)}")
+            return
+        if settings is None:
+            messagebox.showerror("Error", "Failed to read the series images of this run")
+            return
+        
+        self.alignment_settings[run_name] = settings
+        self.persist_settings()
+        largest = max(max(abs(dx), abs(dy)) for dx, dy in settings['series_drift'].values())
+        messagebox.showinfo("Drift Measured", 
+                          f"Measured drift for {len(settings['series_drift'])} series images "
+                          f"(largest {largest} px). It is applied on export.")
+        
+    def request_render(self, *args):
+        """Schedule a render for slider motion; the newest state wins"""
+        if self.render_job is None:
+            self.render_job = self.root.after(self.frame_interval_ms, self.render_frame)
+        
+        # Restart the idle timer for the high-quality pass
+        if self.refine_job is not None:
+            self.root.after_cancel(self.refine_job)
+        self.refine_job = self.root.after(self.idle_delay_ms, self.render_refined)
+        
+    def render_frame(self):
+        """Coalesced render while a slider is moving"""
+        self.render_job = None
+        self.update_display(fast=True)
+        
+    def render_refined(self):
+        """High-quality render once the sliders have gone idle"""
+        self.refine_job = None
+        if self.render_job is not None:
+            self.root.after_cancel(self.render_job)
+            self.render_job = None
+        if self.render_degraded:
+            self.update_display()
+        
+    def base_scale_ratio(self):
+        """Scale that fits the current run's images on the canvas, before zoom"""
+        return self.fit_scale(self.single_image.size, self.series_image.size)
+        
+    def fit_scale(self, single_size, series_size):
+        """Scale that fits both images on the canvas, before zoom"""
+        return preview.fit_scale(single_size, series_size, self.canvas_width, self.canvas_height)
+        
+    def update_display(self, *args, fast=False):
+        """Update the canvas display with overlapped images
+        
+        With fast set, zoom levels that are not cached yet are drawn with a
+        nearest-neighbour resize instead of LANCZOS.
+        """
+        if not self.single_pyramid or not self.series_pyramid:
+            return
+            
+        # Clear canvas
+        self.canvas.delete("all")
+        
+        frame, self.render_degraded = preview.render_view(
+            self.single_pyramid, self.series_pyramid, self.current_settings(),
+            self.base_scale_ratio(), self.canvas_width, self.canvas_height, fast,
+            self.overlay_mode.get())
+        composite = Image.fromarray(frame)
+        
+        # Convert to PhotoImage and display
+        self.composite_photo = ImageTk.PhotoImage(composite)
+        self.canvas.create_image(self.canvas_width // 2, self.canvas_height // 2, 
+                                image=self.composite_photo)
+        
+    def current_settings(self):
+        """Return the alignment settings currently shown in the UI"""
+        return {
+            'transparency': self.transparency.get(),
+            'single_x': self.single_x_offset.get(),
+            'single_y': self.single_y_offset.get(),
+            'series_x': self.series_x_offset.get(),
+            'series_y': self.series_y_offset.get(),
+            'series_rotation': self.series_rotation.get(),
+            'series_scale': self.series_scale.get(),
+            'zoom_factor': self.zoom_factor.get(),
+            'view_x': self.view_x_offset.get(),
+            'view_y': self.view_y_offset.get(),
+            'layout': self.export_layout
+        }
+        
+    def apply_alignment(self):
+        """Apply current alignment to all images in the current run"""
+        if not self.current_run_folder:
+            messagebox.showwarning("No Run Selected", "Please select a run first.")
+            return
+            
+        # Save current alignment settings
+        self.save_current_alignment()
+        
+        # Calculate the overlap region first
+        overlap_bounds = self.calculate_overlap_region()
+        if not overlap_bounds:
+            messagebox.showwarning("No Overlap", "No overlap region found between the two images.")
+            return
+        
+        run_folder = self.current_run_folder
+        # The saved settings, which keep the measured series drift, as save_all_processed exports them
+        settings = dict(self.alignment_settings[os.path.basename(run_folder)])
+        output_base = engine.default_output_base(self.base_directory)
+        output_dir = os.path.join(output_base, os.path.basename(run_folder))
+        workers = self.get_export_workers()
+        encoder = encoders.make_encoder(self.export_format.get(), keep_depth=self.keep_depth.get())
+        frame_cache = self.frame_cache_config()
+        
+        def export(progress, cancel_event):
+            return engine.export_run(run_folder, settings, output_base, overlap_bounds,
+                                     self.output_width, self.output_height,
+                                     workers, progress, cancel_event, encoder,
+                                     frame_cache=frame_cache)
+        
+        def done(written):
+            self.load_quality_report()
+            if not written:
+                messagebox.showwarning("No Images", "No images found in the current run folder.")
+            else:
+                messagebox.showinfo("Success", f"Aligned {written} images saved to {output_dir}")
+        
+        self.start_export(export, done, "Failed to apply alignment")
+    
+    def frame_cache_config(self):
+        """Frame cache next to the base directory when enabled, so re-exports skip decoding"""
+        if not self.use_frame_cache.get():
+            return None
+        return framecache.make_config(framecache.default_cache_dir(self.base_directory))
+    
+    def calculate_overlap_region(self):
+        """Calculate the overlap region between single.png and series_0.jpg"""
+        if not self.single_image or not self.series_image:
+            return None
+        
+        return engine.calculate_overlap_region(self.single_image.size, self.series_image.size,
+                                               self.current_settings(),
+                                               self.output_width, self.output_height)
+        
+    def save_all_processed(self):
+        """Save all processed images from all runs"""
+        if not self.run_folders:
+            messagebox.showwarning("No Runs", "No run folders found.")
+            return
+            
+        # Save current alignment first
+        self.save_current_alignment()
+        
+        # Snapshot the settings so the UI can keep editing while the export runs
+        alignment_settings = dict(self.alignment_settings)
+        run_folders = list(self.run_folders)
+        workers = self.get_export_workers()
+        encoder = encoders.make_encoder(self.export_format.get(), keep_depth=self.keep_depth.get())
+        frame_cache = self.frame_cache_config()
+        
+        def export(progress, cancel_event):
+            return engine.export_all(self.base_directory, alignment_settings,
+                                     run_folders=run_folders,
+                                     output_width=self.output_width, output_height=self.output_height,
+                                     workers=workers, progress=progress, cancel_event=cancel_event,
+                                     encoder=encoder, frame_cache=frame_cache)
+        
+        def done(result):
+            total_processed, up_to_date, output_base = result
+            self.load_quality_report()
+            flagged = sum(run['flagged'] for run in self.quality_report.values())
+            messagebox.showinfo("Success", f"Processed {total_processed} images from {len(alignment_settings)} runs "
+                                f"({up_to_date} already up to date).\nSaved to: {output_base}\n"
+                                f"{flagged} runs flagged for poor alignment; use Next Worst Run to review them.")
+        
+        self.start_export(export, done, "Failed to save processed images")
+        
+    def get_export_workers(self):
+        """Worker count from the UI, falling back to one per core"""
+        try:
+            return max(1, self.export_workers.get())
+        except tk.TclError:
+            return engine.default_workers()
+        
+    def start_export(self, export, on_success, error_message):
+        """Run an engine export on a background thread and poll it for progress"""
+        if self.export_thread is not None:
+            messagebox.showwarning("Export Running", "An export is already running.")
+            return
+        
+        self.export_queue = queue.Queue()
+        self.export_cancel = threading.Event()
+        export_queue = self.export_queue
+        cancel_event = self.export_cancel
+        
+        def progress(done, total, output_path):
+            export_queue.put(('progress', done, total))
+        
+        def worker():
+            try:
+                export_queue.put(('done', export(progress, cancel_event)))
+            except engine.ExportCancelled as e:
+                export_queue.put(('cancelled', e.processed))
+            except Exception as e:
+                export_queue.put(('error', e))
+        
+        self.progress_bar.config(value=0)
+        self.progress_label.config(text="Exporting...")
+        metrics.collector.reset()
+        self.export_rate = metrics.ProgressRate()
+        self.export_thread = threading.Thread(target=worker, daemon=True)
+        self.export_thread.start()
+        self.poll_export(on_success, error_message)
+        
+    def poll_export(self, on_success, error_message):
+        """Drain progress messages from the export thread"""
+        while True:
+            try:
+                message = self.export_queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            kind = message[0]
+            if kind == 'progress':
+                done, total = message[1], message[2]
+                self.progress_bar.config(maximum=total, value=done)
+                self.progress_label.config(text=self.export_rate.describe(done, total))
+                continue
+            
+            # The export finished one way or another
+            self.export_thread = None
+            if kind == 'done':
+                text = f"Export finished in {metrics.format_duration(self.export_rate.elapsed())}"
+                breakdown = metrics.collector.breakdown()
+                if breakdown:
+                    text += f" ({breakdown})"
+                self.progress_label.config(text=text)
+                on_success(message[1])
+            elif kind == 'cancelled':
+                self.progress_label.config(text=f"Export cancelled after {message[1]} images")
+            else:
+                self.progress_label.config(text="Export failed")
+                messagebox.showerror("Error", f"{error_message}: {str(message[1])}")
+            return
+        
+        self.root.after(100, self.poll_export, on_success, error_message)
+        
+    def cancel_export(self):
+        """Ask the running export to stop after the images already in flight"""
+        if self.export_thread is not None and self.export_cancel is not None:
+            self.export_cancel.set()
+            self.progress_label.config(text="Cancelling...")
+            
+    def save_settings_file(self):
+        """Write all alignment settings to a JSON file for batch export"""
+        self.save_current_alignment()
+        path = filedialog.asksaveasfilename(defaultextension=".json",
+                                            filetypes=[("JSON files", "*.json")])
+        if not path:
+            return
+        try:
+            store.save_settings(path, self.alignment_settings)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save settings: {str(e)}")
+            
+    def load_settings_file(self):
+        """Load alignment settings from a JSON file"""
+        path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        if not path:
+            return
+        try:
+            self.alignment_settings = store.load_settings(path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load settings: {str(e)}")
+            return
+        self.persist_settings()
+        self.load_current_run()
+
+def main():
+    root = tk.Tk()
+    app = ImageAlignmentTool(root)
+    root.mainloop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Timing instrumentation for exports.
+
+Each stage of the export (finding runs, decoding, overlap calculation,
+cropping, encoding) records its duration into a histogram, and counters
+track images and bytes. Pool workers record into their own collector and
+send a snapshot back with every result, so the numbers cover all processes.
+The collected metrics can be dumped as JSON or CSV, and exports can be
+profiled with cProfile.
+"""
+
+import csv
+import json
+import time
+import cProfile
+import functools
+import threading
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets in seconds: 0.5 ms to about 16 s,
+# plus an overflow bucket
+BUCKET_BOUNDS = tuple(0.0005 * 2 ** i for i in range(16))
+
+
+def empty_timing():
+    return {'count': 0, 'total': 0.0, 'min': None, 'max': 0.0,
+            'buckets': [0] * (len(BUCKET_BOUNDS) + 1)}
+
+
+def bucket_index(seconds):
+    for index, bound in enumerate(BUCKET_BOUNDS):
+        if seconds <= bound:
+            return index
+    return len(BUCKET_BOUNDS)
+
+
+def histogram_percentile(timing, fraction):
+    """Upper bound of the bucket holding the given fraction of samples"""
+    if not timing['count']:
+        return None
+    target = fraction * timing['count']
+    seen = 0
+    for index, count in enumerate(timing['buckets']):
+        seen += count
+        if seen >= target:
+            return BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else timing['max']
+    return timing['max']
+
+
+class Metrics:
+    """Thread-safe stage timings and counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
+            self.counters = {}
+
+    def record(self, name, seconds):
+        """Add one duration to a stage's histogram"""
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = empty_timing()
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['min'] = seconds if timing['min'] is None else min(timing['min'], seconds)
+            timing['max'] = max(timing['max'], seconds)
+            timing['buckets'][bucket_index(seconds)] += 1
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Picklable copy of everything recorded so far"""
+        with self.lock:
+            return {
+                'timings': {name: dict(timing, buckets=list(timing['buckets']))
+                            for name, timing in self.timings.items()},
+                'counters': dict(self.counters)
+            }
+
+    def merge(self, snapshot):
+        """Add a snapshot taken in another process"""
+        with self.lock:
+            for name, other in snapshot['timings'].items():
+                timing = self.timings.get(name)
+                if timing is None:
+                    timing = self.timings[name] = empty_timing()
+                timing['count'] += other['count']
+                timing['total'] += other['total']
+                if other['min'] is not None:
+                    timing['min'] = other['min'] if timing['min'] is None else min(timing['min'], other['min'])
+                timing['max'] = max(timing['max'], other['max'])
+                timing['buckets'] = [a + b for a, b in zip(timing['buckets'], other['buckets'])]
+            for name, amount in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        """Per-stage count, total and latency statistics in milliseconds"""
+        snapshot = self.snapshot()
+        stages = {}
+        for name, timing in snapshot['timings'].items():
+            stages[name] = {
+                'count': timing['count'],
+                'total_s': timing['total'],
+                'mean_ms': timing['total'] / timing['count'] * 1000,
+                'min_ms': timing['min'] * 1000,
+                'max_ms': timing['max'] * 1000,
+                'p50_ms': histogram_percentile(timing, 0.5) * 1000,
+                'p95_ms': histogram_percentile(timing, 0.95) * 1000
+            }
+        return {'stages': stages, 'counters': snapshot['counters']}
+
+    def breakdown(self, stages=('decode', 'crop', 'encode')):
+        """Short text showing how the image work splits between stages"""
+        summary = self.summary()['stages']
+        totals = {name: summary[name]['total_s'] for name in stages if name in summary}
+        grand_total = sum(totals.values())
+        if not grand_total:
+            return ""
+        return ", ".join(f"{name} {total / grand_total:.0%}" for name, total in totals.items())
+
+    def dump(self, path):
+        """Write the metrics as CSV if path ends in .csv, JSON otherwise"""
+        if path.lower().endswith('.csv'):
+            self.dump_csv(path)
+        else:
+            self.dump_json(path)
+
+    def dump_json(self, path):
+        data = self.summary()
+        data['histograms'] = {name: timing['buckets'] for name, timing in self.snapshot()['timings'].items()}
+        data['bucket_bounds_s'] = list(BUCKET_BOUNDS)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+    def dump_csv(self, path):
+        summary = self.summary()
+        fields = ['name', 'count', 'total_s', 'mean_ms', 'min_ms', 'max_ms', 'p50_ms', 'p95_ms']
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for name, stage in summary['stages'].items():
+                writer.writerow(dict(stage, name=name))
+            # Counters have no durations
+            for name, amount in summary['counters'].items():
+                writer.writerow({'name': name, 'count': amount})
+
+
+# Collector for the current process; pool workers report theirs back with each result
+collector = Metrics()
+
+
+def timed(name):
+    """Decorator recording every call of a function as stage name"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with collector.timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def profiled(path):
+    """Profile the enclosed code with cProfile and write the stats to path
+
+    Only the current process is profiled; use a single worker to include
+    the image work itself.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class ProgressRate:
+    """Throughput and time remaining of a running export"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.start = clock()
+
+    def describe(self, done, total, unit="images"):
+        """Text such as '120/4000 images, 35.2 images/s, ETA 1:50'"""
+        text = f"{done}/{total} {unit}"
+        elapsed = self.clock() - self.start
+        if done and elapsed > 0:
+            rate = done / elapsed
+            text += f", {rate:.1f} {unit}/s, ETA {format_duration((total - done) / rate)}"
+        return text
+
+    def elapsed(self):
+        return self.clock() - self.start
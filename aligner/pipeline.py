@@ -0,0 +1,123 @@
+"""
+Staged streaming pipeline for exporting a run.
+
+Reader threads decode images, compute threads align and crop them and
+writer threads encode and save the results. The stages are joined by
+bounded queues, so disk reads, cropping and encoding overlap while at most a
+fixed number of decoded frames is held in memory, however many frames the
+run contains. PIL releases the GIL while decoding, resampling and encoding,
+which is what lets plain threads keep several cores busy here.
+"""
+
+import queue
+import threading
+
+# Items allowed to wait between two stages
+QUEUE_SIZE = 4
+
+# Marker telling a stage its input is exhausted
+DONE = object()
+
+
+def run_stage(function, inputs, outputs, cancel_event, errors):
+    """Apply function to every (index, item) from inputs and pass the result on"""
+    while True:
+        entry = inputs.get()
+        if entry is DONE:
+            # Let the other threads of this stage see it too
+            inputs.put(DONE)
+            return
+        if cancel_event.is_set():
+            continue
+        index, item = entry
+        try:
+            result = function(item)
+        except Exception as e:
+            errors.append(e)
+            cancel_event.set()
+            continue
+        outputs.put((index, result))
+
+
+def run_pipeline(items, read, compute, write, read_threads=2, compute_threads=2, write_threads=2,
+                 queue_size=QUEUE_SIZE, progress=None, cancel_event=None):
+    """Stream items through read -> compute -> write stages
+
+    write must return something identifying the finished item (the output
+    path for exports). progress(done, total, result) is called from the
+    calling thread in item order. Setting cancel_event stops the pipeline
+    and returns early; the caller decides what cancellation means. The first
+    exception from any stage is re-raised. Returns the number of items
+    written.
+    """
+    stop = threading.Event()
+    errors = []
+    total = len(items)
+
+    pending = queue.Queue(maxsize=queue_size)
+    decoded = queue.Queue(maxsize=queue_size)
+    processed = queue.Queue(maxsize=queue_size)
+    finished = queue.Queue()
+
+    stages = [(read, pending, decoded, read_threads),
+              (compute, decoded, processed, compute_threads),
+              (write, processed, finished, write_threads)]
+    stage_threads = []
+    for function, inputs, outputs, count in stages:
+        threads = [threading.Thread(target=run_stage, args=(function, inputs, outputs, stop, errors),
+                                    daemon=True)
+                   for _ in range(max(1, count))]
+        for thread in threads:
+            thread.start()
+        stage_threads.append((threads, outputs))
+
+    # Feed items from a separate thread so the bounded queue provides backpressure
+    def feed():
+        for index, item in enumerate(items):
+            while not stop.is_set():
+                try:
+                    pending.put((index, item), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+        pending.put(DONE)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    # Close each stage once the previous one has drained
+    def close_stages():
+        feeder.join()
+        for threads, outputs in stage_threads:
+            for thread in threads:
+                thread.join()
+            outputs.put(DONE)
+
+    closer = threading.Thread(target=close_stages, daemon=True)
+    closer.start()
+
+    # Report results in item order
+    done = 0
+    waiting = {}
+    while done < total:
+        if cancel_event is not None and cancel_event.is_set():
+            stop.set()
+        try:
+            entry = finished.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if entry is DONE:
+            break
+        index, result = entry
+        waiting[index] = result
+        while done in waiting:
+            result = waiting.pop(done)
+            done += 1
+            if progress:
+                progress(done, total, result)
+
+    stop.set()
+    closer.join()
+    if errors:
+        raise errors[0]
+    return done
@@ -0,0 +1,475 @@
+"""
+Preview image caches and compositing for the alignment GUI.
+
+Each reference image is decoded once, at the lowest resolution the preview
+can ever show (JPEGs are downscaled in the DCT domain while decoding), and
+converted to RGB (RGBA if it has any transparency). 16-bit, 32-bit and float
+captures are tone-mapped to 8 bits first, through a cached lookup table
+spanning their actual range; the preview is the only place that happens,
+exports keep the full depth. Scaled copies
+for the preview are built from a pyramid of 2x reductions and cached per
+zoom level as NumPy arrays, so panning, offset and transparency changes
+never resample. The compositor blends only the pixels of the visible canvas
+rectangle, so a frame costs the same whatever the source resolution.
+
+Besides the alpha blend, the preview has diagnostic overlay modes: absolute
+difference, checkerboard, swipe and edges. The grayscale and edge maps they
+use are derived once per cached level, so switching modes only recomposites
+the viewport.
+"""
+
+import math
+import functools
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+from . import engine, warp
+
+# Scaled levels kept per image; a handful covers zooming back and forth
+SCALED_CACHE_SIZE = 6
+
+# Stop halving once the smaller side would drop below this
+MIN_LEVEL_SIZE = 32
+
+OVERLAY_MODES = ('blend', 'difference', 'checkerboard', 'swipe', 'edges')
+
+# Side of the checkerboard squares, in canvas pixels
+CHECKER_SIZE = 48
+
+# Amplification of differences and edges, which are faint on low-contrast captures
+DIFFERENCE_GAIN = 2
+EDGE_GAIN = 2
+
+# Fraction of pixels clipped at each end when stretching a grayscale map
+STRETCH_CLIP = 0.01
+
+# Modes with more than 8 bits per sample, which the preview tone-maps
+HIGH_DEPTH_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I', 'F')
+
+# Fraction of pixels clipped at each end when tone-mapping
+TONE_CLIP = 0.001
+
+# Stride of the pixel sample the tone-mapping range is taken from
+TONE_SAMPLE_STRIDE = 4
+
+# Tone-mapping ends are rounded to this step, so similar frames share a lookup table
+TONE_STEP = 64
+
+
+def scale_key(scale):
+    """Round a scale so slider jitter maps onto the same cache entry"""
+    return round(scale, 4)
+
+
+@functools.lru_cache(maxsize=16)
+def tone_lut(low, high):
+    """Lookup table mapping 16-bit values low..high linearly onto 0..255"""
+    table = np.clip((np.arange(65536) - low) * 255 / (high - low), 0, 255)
+    return np.round(table).astype(np.uint8)
+
+
+def tone_map(image):
+    """8-bit grayscale image of a high-bit-depth image, spanning its range minus TONE_CLIP at each end"""
+    values = np.asarray(image)
+    sample = values[::TONE_SAMPLE_STRIDE, ::TONE_SAMPLE_STRIDE]
+    if values.dtype.kind == 'f' or sample.min() < 0 or sample.max() > 65535:
+        # Float and wide integer data are scaled directly, without a table
+        low, high = np.percentile(sample, (TONE_CLIP * 100, 100 - TONE_CLIP * 100))
+        scale = 255 / (high - low) if high > low else 0
+        return Image.fromarray(np.clip((values - low) * scale, 0, 255).astype(np.uint8))
+
+    cumulative = np.cumsum(np.bincount(sample.ravel(), minlength=65536))
+    low = int(np.searchsorted(cumulative, TONE_CLIP * sample.size)) // TONE_STEP * TONE_STEP
+    high = -(-int(np.searchsorted(cumulative, (1 - TONE_CLIP) * sample.size)) // TONE_STEP) * TONE_STEP
+    high = min(max(high, low + TONE_STEP), 65535)
+    if values.dtype.kind == 'i':
+        # Pixels between the sampled ones may still fall outside the table
+        values = np.clip(values, 0, 65535)
+    return Image.fromarray(tone_lut(low, high)[values])
+
+
+def decode_for_preview(image):
+    """Decode an image to RGB, or RGBA when its alpha channel is actually used"""
+    if image.mode in HIGH_DEPTH_MODES:
+        return tone_map(image).convert('RGB')
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        rgba = image.convert('RGBA')
+        if rgba.getextrema()[3][0] < 255:
+            return rgba
+        return rgba.convert('RGB')
+    return image.convert('RGB')
+
+
+def luminance(array):
+    """Integer ITU-R 601 luma of an HxWx3/4 uint8 array"""
+    rgb = array[..., :3].astype(np.uint16)
+    return ((rgb[..., 0] * 77 + rgb[..., 1] * 150 + rgb[..., 2] * 29 + 128) >> 8).astype(np.uint8)
+
+
+def stretch_contrast(gray, covered=None):
+    """Map the 1st..99th percentile of a grayscale map onto 0..255 through a lookup table
+
+    Both images get the full range this way, so differences in exposure
+    between the two optical paths do not show up as misalignment.
+    """
+    values = gray if covered is None else gray[covered]
+    if not values.size:
+        return gray
+    cumulative = np.cumsum(np.bincount(values.ravel(), minlength=256))
+    low = int(np.searchsorted(cumulative, STRETCH_CLIP * values.size))
+    high = int(np.searchsorted(cumulative, (1 - STRETCH_CLIP) * values.size))
+    if high <= low:
+        return gray
+    table = np.clip((np.arange(256) - low) * 255 / (high - low), 0, 255).astype(np.uint8)
+    return table[gray]
+
+
+def edge_magnitude(gray):
+    """|d/dx| + |d/dy| of a grayscale map with central differences, amplified and clipped to uint8"""
+    values = gray.astype(np.int16)
+    edges = np.zeros_like(values)
+    edges[:, 1:-1] += np.abs(values[:, 2:] - values[:, :-2])
+    edges[1:-1, :] += np.abs(values[2:, :] - values[:-2, :])
+    edges *= EDGE_GAIN
+    return np.minimum(edges, 255).astype(np.uint8)
+
+
+def open_for_preview(path, max_scale):
+    """Decode an image at no less than max_scale of its full size
+
+    JPEGs use the decoder's DCT-domain downscaling (1/2, 1/4 or 1/8), so the
+    full-resolution image is never produced; other formats are decoded fully
+    and then reduced by a power of two. Returns (image, full size).
+    """
+    image = Image.open(path)
+    full_size = image.size
+    wanted = (max(1, math.ceil(full_size[0] * max_scale)), max(1, math.ceil(full_size[1] * max_scale)))
+
+    # Only JPEG implements draft(); it picks the largest reduction that keeps at least the wanted size
+    image.draft(image.mode, wanted)
+    image.load()
+    if image.mode in HIGH_DEPTH_MODES:
+        # reduce() does not support every high-depth mode, and the preview only shows 8 bits
+        image = tone_map(image)
+
+    if image.size == full_size and max_scale < 0.5:
+        factor = 2 ** int(math.log2(1 / max_scale))
+        image = image.reduce(factor)
+
+    return image, full_size
+
+
+class PreviewPyramid:
+    """Decoded image plus cached pre-scaled copies for the preview
+
+    image may already be reduced (see open_for_preview); full_size is the
+    size of the original, which all scales refer to.
+    """
+
+    def __init__(self, image, full_size=None, cache_size=SCALED_CACHE_SIZE):
+        # Decode once; level k is the decoded image reduced by 2**k
+        self.levels = [decode_for_preview(image)]
+        self.size = full_size or image.size
+        self.width, self.height = self.size
+        self.base_scale = image.width / self.width
+        self.cache_size = cache_size
+        self.scaled = OrderedDict()
+        self.derived = OrderedDict()
+
+    def level_for(self, scale):
+        """Smallest pyramid level that still has at least the requested resolution"""
+        level = 0
+        while scale <= self.base_scale * 0.5 ** (level + 1):
+            if len(self.levels) <= level + 1:
+                previous = self.levels[-1]
+                if min(previous.size) // 2 < MIN_LEVEL_SIZE:
+                    break
+                self.levels.append(previous.reduce(2))
+            level += 1
+        return self.levels[level]
+
+    def get(self, scale, resample=Image.Resampling.LANCZOS, fast=False):
+        """Return the image scaled by scale as an HxWx3/4 uint8 array, resampling only on a cache miss
+
+        With fast set, a cache miss is answered with an uncached
+        nearest-neighbour resize instead, for previews while a slider moves.
+        """
+        key = (scale_key(scale), resample)
+        if key in self.scaled:
+            self.scaled.move_to_end(key)
+            return self.scaled[key]
+
+        size = (max(1, int(self.width * scale)), max(1, int(self.height * scale)))
+        source = self.level_for(scale)
+        if fast:
+            return np.asarray(source if source.size == size
+                              else source.resize(size, Image.Resampling.NEAREST))
+        scaled = source if source.size == size else source.resize(size, resample)
+
+        self.scaled[key] = np.asarray(scaled)
+        if len(self.scaled) > self.cache_size:
+            self.scaled.popitem(last=False)
+        return self.scaled[key]
+
+    def get_warped(self, scale, rotation, magnification, fast=False):
+        """Like get, but rotated and scaled about the centre (see warp); uncovered areas are transparent"""
+        key = (scale_key(scale), 'warped', rotation, magnification)
+        if key in self.scaled:
+            self.scaled.move_to_end(key)
+            return self.scaled[key]
+
+        resample = Image.Resampling.NEAREST if fast else Image.Resampling.BILINEAR
+        warped = np.asarray(warp.transform_image(Image.fromarray(self.get(scale, fast=fast)),
+                                                 rotation, magnification, resample))
+        if fast:
+            return warped
+        self.scaled[key] = warped
+        if len(self.scaled) > self.cache_size:
+            self.scaled.popitem(last=False)
+        return warped
+
+    def get_channel(self, scale, kind, affine=None, fast=False):
+        """Grayscale ('gray') or edge ('edges') map of a scaled level, for the overlay modes
+
+        Returns (HxW uint8 map, HxW bool mask of covered pixels or None if
+        the level is opaque). Maps are derived from the cached colour level,
+        contrast-stretched, and cached themselves unless they come from an
+        uncached fast level.
+        """
+        warped = affine is not None and not warp.is_identity(*affine)
+        key = (scale_key(scale), kind) + (tuple(affine) if warped else ())
+        if key in self.derived:
+            self.derived.move_to_end(key)
+            return self.derived[key]
+
+        if kind == 'edges':
+            gray, covered = self.get_channel(scale, 'gray', affine, fast)
+            channel = (edge_magnitude(gray), covered)
+        else:
+            array = self.get_warped(scale, *affine, fast=fast) if warped else self.get(scale, fast=fast)
+            covered = array[..., 3] > 127 if array.shape[2] == 4 else None
+            channel = (stretch_contrast(luminance(array), covered), covered)
+
+        if not fast or self.is_cached(scale, affine=affine):
+            self.derived[key] = channel
+            if len(self.derived) > self.cache_size:
+                self.derived.popitem(last=False)
+        return channel
+
+    def nbytes(self):
+        """Memory held by the decoded levels and cached scaled copies and maps"""
+        level_bytes = sum(level.width * level.height * len(level.getbands()) for level in self.levels)
+        derived_bytes = sum(channel.nbytes + (0 if covered is None else covered.nbytes)
+                            for channel, covered in self.derived.values())
+        return level_bytes + sum(array.nbytes for array in self.scaled.values()) + derived_bytes
+
+    def is_cached(self, scale, resample=Image.Resampling.LANCZOS, affine=None):
+        """Whether a high-quality level for this scale (warped by affine, if given) is already cached"""
+        if affine is not None and not warp.is_identity(*affine):
+            return (scale_key(scale), 'warped') + tuple(affine) in self.scaled
+        return (scale_key(scale), resample) in self.scaled
+
+
+def window_slices(shape, x, y, view_x, view_y, width, height):
+    """(window slices, layer slices) of the part of a layer at (x, y) inside the window, or None"""
+    left = max(x - view_x, 0)
+    top = max(y - view_y, 0)
+    right = min(x - view_x + shape[1], width)
+    bottom = min(y - view_y + shape[0], height)
+    if left >= right or top >= bottom:
+        return None
+    return ((slice(top, bottom), slice(left, right)),
+            (slice(top + view_y - y, bottom + view_y - y), slice(left + view_x - x, right + view_x - x)))
+
+
+def place_channel(channel, x, y, view_x, view_y, width, height):
+    """Window-sized copy of a (map, covered) channel at (x, y) and the mask of window pixels it covers"""
+    values = np.zeros((height, width), dtype=np.uint8)
+    mask = np.zeros((height, width), dtype=bool)
+    array, covered = channel
+    slices = window_slices(array.shape, x, y, view_x, view_y, width, height)
+    if slices is not None:
+        target, source = slices
+        values[target] = array[source]
+        mask[target] = True if covered is None else covered[source]
+    return values, mask
+
+
+def window_coverage(array, x, y, view_x, view_y, width, height):
+    """Mask of the window pixels an HxWx3/4 colour layer at (x, y) covers with at least half opacity"""
+    mask = np.zeros((height, width), dtype=bool)
+    slices = window_slices(array.shape, x, y, view_x, view_y, width, height)
+    if slices is not None:
+        target, source = slices
+        mask[target] = True if array.shape[2] == 3 else array[source + (3,)] > 127
+    return mask
+
+
+def composite_viewport(layers, view_x, view_y, width, height, background=(255, 255, 255)):
+    """Blend layers into the width x height window whose top-left is (view_x, view_y)
+
+    layers is a list of (array, x, y, opacity) with each HxWx3 (opaque) or
+    HxWx4 uint8 array placed at (x, y) in the same coordinates as the view,
+    drawn in order. Only the part of each layer that intersects the window
+    is touched. Returns an HxWx3 uint8 array.
+    """
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = background
+
+    for array, x, y, opacity in layers:
+        # Intersection of the layer with the window, in window coordinates
+        slices = window_slices(array.shape, x, y, view_x, view_y, width, height)
+        if slices is None:
+            continue
+
+        source = array[slices[1]]
+        target = frame[slices[0]]
+        level = int(round(255 * min(max(opacity, 0.0), 1.0)))
+
+        # Integer blend: (src * a + dst * (255 - a) + 127) // 255
+        if array.shape[2] == 3:
+            if level == 255:
+                target[:] = source
+                continue
+            alpha = np.uint16(level)
+        else:
+            alpha = source[..., 3:4].astype(np.uint16)
+            if level != 255:
+                alpha = (alpha * level + 127) // 255
+        blended = target.astype(np.uint16)
+        blended *= 255 - alpha
+        blended += source[..., :3] * alpha
+        blended += 127
+        blended //= 255
+        target[:] = blended
+
+    return frame
+
+
+def fit_scale(single_size, series_size, canvas_width, canvas_height):
+    """Scale that fits both images on the canvas, before zoom"""
+    single_ratio = min(canvas_width / single_size[0], canvas_height / single_size[1])
+    series_ratio = min(canvas_width / series_size[0], canvas_height / series_size[1])
+
+    # Use the smaller ratio to ensure both images fit, then leave room for zoom
+    return min(single_ratio, series_ratio) * 0.6
+
+
+def composite_overlay(mode, single, series, single_position, series_position, view_x, view_y,
+                      width, height, transparency, background=(255, 255, 255)):
+    """Diagnostic overlay of the two images inside the width x height window at (view_x, view_y)
+
+    - difference: |single - series| of the contrast-stretched grayscale maps
+      where both images are present; black means identical
+    - checkerboard: alternating squares of the two colour images, fixed to
+      the image so they move with panning; transparency slides the board
+    - swipe: single.png left and the series image right of a divider at
+      transparency across the window
+    - edges: edges of single.png in red and of the series image in cyan, so
+      aligned edges look white and misaligned ones show coloured fringes
+
+    single and series are (map, covered) channels for difference and edges
+    (see PreviewPyramid.get_channel) and colour arrays otherwise. Returns an
+    HxWx3 uint8 array.
+    """
+    if mode in ('difference', 'edges'):
+        single_values, single_mask = place_channel(single, *single_position, view_x, view_y, width, height)
+        series_values, series_mask = place_channel(series, *series_position, view_x, view_y, width, height)
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:] = background
+        if mode == 'difference':
+            both = single_mask & series_mask
+            difference = np.abs(single_values.astype(np.int16) - series_values.astype(np.int16))
+            difference = np.minimum(difference * DIFFERENCE_GAIN, 255).astype(np.uint8)
+            frame[both] = difference[both, np.newaxis]
+        else:
+            either = single_mask | series_mask
+            frame[either] = 0
+            frame[..., 0] = np.where(single_mask, single_values, frame[..., 0])
+            frame[..., 1] = np.where(series_mask, series_values, frame[..., 1])
+            frame[..., 2] = np.where(series_mask, series_values, frame[..., 2])
+        return frame
+
+    single_frame = composite_viewport([(single, *single_position, 1.0)], view_x, view_y, width, height,
+                                      background)
+    series_frame = composite_viewport([(series, *series_position, 1.0)], view_x, view_y, width, height,
+                                      background)
+    single_covered = window_coverage(single, *single_position, view_x, view_y, width, height)
+    series_covered = window_coverage(series, *series_position, view_x, view_y, width, height)
+
+    columns = np.arange(width)
+    if mode == 'checkerboard':
+        shift = int(round(transparency * 2 * CHECKER_SIZE))
+        tile_x = (columns + view_x + shift) // CHECKER_SIZE
+        tile_y = (np.arange(height) + view_y) // CHECKER_SIZE
+        show_series = (tile_x[np.newaxis, :] + tile_y[:, np.newaxis]) % 2 == 1
+    elif mode == 'swipe':
+        show_series = np.broadcast_to(columns >= int(round(transparency * width)), (height, width))
+    else:
+        raise ValueError(f"Unknown overlay mode {mode!r}, expected one of {', '.join(OVERLAY_MODES)}")
+
+    # Where only one image is present it is shown whichever side the pattern picks
+    show_series = (show_series & series_covered) | ~single_covered
+    return np.where(show_series[..., np.newaxis], series_frame, single_frame)
+
+
+def render_view(single_pyramid, series_pyramid, settings, base_scale, canvas_width, canvas_height,
+                fast=False, mode='blend'):
+    """Render the preview canvas for a run's alignment settings without any GUI
+
+    mode is one of OVERLAY_MODES (see composite_overlay). With fast set,
+    zoom levels that are not cached yet are drawn with a nearest-neighbour
+    resize instead of LANCZOS. Returns (HxWx3 uint8 frame, whether the frame
+    was degraded by that).
+    """
+    scale_ratio = base_scale * settings['zoom_factor']
+
+    # Scaled arrays come from the cached pyramids; only new zoom levels resample
+    rotation, magnification = engine.image_affine(engine.SERIES_NAME, settings)
+    degraded = fast and not (single_pyramid.is_cached(scale_ratio) and
+                             series_pyramid.is_cached(scale_ratio, affine=(rotation, magnification)))
+    if mode in ('difference', 'edges'):
+        # Grayscale and edge maps are derived from the cached levels once
+        kind = 'gray' if mode == 'difference' else 'edges'
+        display_single = single_pyramid.get_channel(scale_ratio, kind, fast=fast)
+        display_series = series_pyramid.get_channel(scale_ratio, kind, (rotation, magnification), fast=fast)
+        single_height, single_width = display_single[0].shape
+        series_height, series_width = display_series[0].shape
+    else:
+        display_single = single_pyramid.get(scale_ratio, fast=fast)
+        if warp.is_identity(rotation, magnification):
+            display_series = series_pyramid.get(scale_ratio, fast=fast)
+        else:
+            display_series = series_pyramid.get_warped(scale_ratio, rotation, magnification, fast=fast)
+        single_height, single_width = display_single.shape[:2]
+        series_height, series_width = display_series.shape[:2]
+
+    # Virtual composite that leaves room for panning; only the canvas window is ever blended
+    composite_width = max(single_width, series_width) + 800
+    composite_height = max(single_height, series_height) + 800
+
+    # Calculate positions with alignment offsets
+    single_x = composite_width // 2 - single_width // 2 + int(settings['single_x'] * scale_ratio)
+    single_y = composite_height // 2 - single_height // 2 + int(settings['single_y'] * scale_ratio)
+    series_x = composite_width // 2 - series_width // 2 + int(settings['series_x'] * scale_ratio)
+    series_y = composite_height // 2 - series_height // 2 + int(settings['series_y'] * scale_ratio)
+
+    # Apply view panning, keeping the view within the composite
+    view_x = (composite_width - canvas_width) // 2 + settings['view_x']
+    view_y = (composite_height - canvas_height) // 2 + settings['view_y']
+    view_x = max(0, min(view_x, composite_width - canvas_width))
+    view_y = max(0, min(view_y, composite_height - canvas_height))
+
+    if mode != 'blend':
+        frame = composite_overlay(mode, display_single, display_series, (single_x, single_y),
+                                  (series_x, series_y), view_x, view_y, canvas_width, canvas_height,
+                                  settings['transparency'])
+        return frame, degraded
+
+    # Blend the series image over single.png inside the canvas window only
+    frame = composite_viewport(
+        [(display_single, single_x, single_y, 1.0),
+         (display_series, series_x, series_y, settings['transparency'])],
+        view_x, view_y, canvas_width, canvas_height)
+    return frame, degraded
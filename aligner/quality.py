@@ -0,0 +1,212 @@
+"""
+Alignment quality scores computed while exporting.
+
+When the aligned single.png and series_0.jpg crops of a run pass through
+the export, a small grayscale thumbnail of each (plus the part of the
+window actually covered by the image) is handed to the collector. Once both
+crops of a run have arrived the run is scored on their common area:
+
+- ncc: normalised cross-correlation of the intensities
+- gradient_ssim: mean SSIM of the gradient magnitudes, which ignores
+  exposure differences between the two optical paths
+
+The scores of all exported runs are kept in a report in the output
+directory, ranked worst first, and runs far below the rest are flagged.
+Pool workers send their thumbnails back with each result, like metrics.
+"""
+
+import os
+import csv
+import math
+import json
+import threading
+import numpy as np
+
+from . import store
+
+REPORT_FILENAME = "quality_report.json"
+REPORT_CSV_FILENAME = "quality_report.csv"
+REPORT_VERSION = 1
+
+# Longest side of the thumbnails that are scored
+THUMBNAIL_SIZE = 256
+
+# Side of the SSIM window, in thumbnail pixels
+SSIM_WINDOW = 7
+
+# Runs this many robust standard deviations below the median score are flagged
+OUTLIER_THRESHOLD = 3.0
+
+# Lower limit of that deviation, so runs that all score alike do not flag small differences
+MIN_SPREAD = 0.02
+
+
+def thumbnail(image, valid_box, size=THUMBNAIL_SIZE):
+    """Reduced grayscale copy of an aligned crop and its valid box scaled to match
+
+    valid_box is (left, top, right, bottom) of the crop covered by the image.
+    """
+    factor = max(1, math.ceil(max(image.size) / size))
+    gray = image.convert('L')
+    if factor > 1:
+        gray = gray.reduce(factor)
+    left, top, right, bottom = valid_box
+    scaled_box = (math.ceil(left / factor), math.ceil(top / factor), right // factor, bottom // factor)
+    return np.asarray(gray, dtype=np.float32), scaled_box
+
+
+def box_mean(array, size):
+    """Mean over every size x size window (valid positions only), via summed-area tables"""
+    table = np.pad(array, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    sums = table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+    return sums / (size * size)
+
+
+def gradient_magnitude(array):
+    dy, dx = np.gradient(array)
+    return np.hypot(dx, dy)
+
+
+def ncc(a, b):
+    a = a - a.mean()
+    b = b - b.mean()
+    denominator = math.sqrt(float((a * a).sum()) * float((b * b).sum()))
+    if denominator == 0:
+        return 0.0
+    return float((a * b).sum()) / denominator
+
+
+def ssim(a, b, window=SSIM_WINDOW, dynamic_range=255.0):
+    """Mean structural similarity with a uniform window"""
+    c1 = (0.01 * dynamic_range) ** 2
+    c2 = (0.03 * dynamic_range) ** 2
+    mean_a = box_mean(a, window)
+    mean_b = box_mean(b, window)
+    var_a = box_mean(a * a, window) - mean_a ** 2
+    var_b = box_mean(b * b, window) - mean_b ** 2
+    covariance = box_mean(a * b, window) - mean_a * mean_b
+    index = (((2 * mean_a * mean_b + c1) * (2 * covariance + c2)) /
+             ((mean_a ** 2 + mean_b ** 2 + c1) * (var_a + var_b + c2)))
+    return float(index.mean())
+
+
+def score_pair(single, series):
+    """Scores of two thumbnails of the same window; None if they share too little area"""
+    (single_array, single_box), (series_array, series_box) = single, series
+    left = max(single_box[0], series_box[0])
+    top = max(single_box[1], series_box[1])
+    right = min(single_box[2], series_box[2], single_array.shape[1], series_array.shape[1])
+    bottom = min(single_box[3], series_box[3], single_array.shape[0], series_array.shape[0])
+    if right - left < 2 * SSIM_WINDOW or bottom - top < 2 * SSIM_WINDOW:
+        return None
+
+    a = single_array[top:bottom, left:right]
+    b = series_array[top:bottom, left:right]
+    gradient_a = gradient_magnitude(a)
+    gradient_b = gradient_magnitude(b)
+    # Gradients of 8-bit data stay well below 255; scale SSIM's constants to their range
+    gradient_range = max(float(gradient_a.max()), float(gradient_b.max()), 1.0)
+    scores = {'ncc': ncc(a, b), 'gradient_ssim': ssim(gradient_a, gradient_b, dynamic_range=gradient_range)}
+    scores['score'] = scores['gradient_ssim']
+    return scores
+
+
+class QualityCollector:
+    """Pairs up the reference crops of each run as they are exported and scores them"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.scores = {}
+
+    def reset(self):
+        with self.lock:
+            self.pending = {}
+            self.scores = {}
+
+    def add(self, run_name, role, item):
+        """Record the 'single' or 'series' thumbnail of a run; scores the run once both are in"""
+        with self.lock:
+            pair = self.pending.setdefault(run_name, {})
+            pair[role] = item
+            if len(pair) < 2:
+                return
+            del self.pending[run_name]
+        scores = score_pair(pair['single'], pair['series'])
+        if scores is not None:
+            with self.lock:
+                self.scores[run_name] = scores
+
+    def take_pending(self):
+        """Remove and return the unpaired thumbnails, for pool workers to send back"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def merge(self, pending):
+        """Add thumbnails recorded in another process"""
+        for run_name, pair in pending.items():
+            for role, item in pair.items():
+                self.add(run_name, role, item)
+
+    def take_scores(self):
+        with self.lock:
+            scores, self.scores = self.scores, {}
+        return scores
+
+
+# Collector for the current process; pool workers report theirs back with each result
+collector = QualityCollector()
+
+
+def load_report(output_base):
+    """Per-run scores from an output directory's report, or {} if there is none"""
+    path = os.path.join(output_base, REPORT_FILENAME)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != REPORT_VERSION:
+        return {}
+    return data['runs']
+
+
+def flag_outliers(runs):
+    """Mark runs whose score is far below the others, using the median absolute deviation"""
+    scores = np.array([run['score'] for run in runs.values()])
+    if len(scores) < 3:
+        for run in runs.values():
+            run['flagged'] = False
+        return
+    median = float(np.median(scores))
+    spread = max(1.4826 * float(np.median(np.abs(scores - median))), MIN_SPREAD)
+    for run in runs.values():
+        run['flagged'] = (median - run['score']) / spread > OUTLIER_THRESHOLD
+
+
+def ranked(runs):
+    """Run names from worst to best score"""
+    return sorted(runs, key=lambda name: runs[name]['score'])
+
+
+def update_report(output_base, scores):
+    """Merge new run scores into the report and rewrite it; returns all runs' entries"""
+    runs = load_report(output_base)
+    runs.update(scores)
+    if not runs:
+        return runs
+    flag_outliers(runs)
+
+    os.makedirs(output_base, exist_ok=True)
+    store.write_json_atomic(os.path.join(output_base, REPORT_FILENAME),
+                            {'version': REPORT_VERSION, 'ranking': ranked(runs), 'runs': runs})
+    # Written under a temporary name too, as several queue workers may rewrite it at once
+    with store.atomic_write(os.path.join(output_base, REPORT_CSV_FILENAME), newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank', 'run', 'score', 'ncc', 'gradient_ssim', 'flagged'])
+        for rank, name in enumerate(ranked(runs), start=1):
+            run = runs[name]
+            writer.writerow([rank, name, f"{run['score']:.4f}", f"{run['ncc']:.4f}",
+                             f"{run['gradient_ssim']:.4f}", int(run['flagged'])])
+    return runs
@@ -0,0 +1,664 @@
+"""
+Automatic registration of series_0.jpg against single.png.
+
+Offsets are estimated with FFT phase correlation: both images are converted
+to grayscale, reduced by a common factor so they share a pixel scale, padded
+to the same shape and correlated. A second pass at full resolution on a
+window around the image centre refines the coarse estimate.
+
+The offsets produced match what the GUI sliders mean: in the preview both
+images are centred on the canvas and then moved by their x/y offsets.
+Aligned settings are therefore marked for the export's preview layout.
+
+Rotation and scale between the two optical paths are estimated with the
+Fourier-Mellin method: the magnitude spectra of both images, which do not
+depend on translation, are resampled to log-polar coordinates, where
+rotation and scaling become shifts that phase correlation can find.
+
+Runs of the same rig sit at nearly the same offsets, so a new run can
+instead be seeded with the settings of the nearest aligned run and refined
+by a local search: a coarse-to-fine pyramid over a small window, maximising
+normalised cross-correlation within a few pixels of the previous level's
+estimate. Its cost depends on the window, not on the frame size.
+
+Drift correction registers every series frame of a run against
+series_0.jpg in batches of frames at once; the measured drift is stored in
+the run's settings and corrected on export (see engine.image_offset): a
+feature at x in series_0.jpg that is at x + dx in a frame is read dx
+further right, which means subtracting dx from the series offset in the
+preview layout and adding it in the legacy canvas layout.
+"""
+
+import os
+import math
+import numpy as np
+from PIL import Image
+
+from . import engine, warp
+
+# Longest side of the coarse registration images
+COARSE_SIZE = 1024
+
+# Side of the full-resolution refinement window
+REFINE_SIZE = 512
+
+# Series frames registered together in one batched FFT
+DRIFT_BATCH_SIZE = 16
+
+# Spectral whitening of the drift refinement; below 1 the correlation peak is
+# smoother and its sub-pixel position less biased than with pure phase correlation
+DRIFT_WHITENING = 0.5
+
+
+# Largest error of a seed from a neighbouring run the local search can correct, in full-resolution pixels
+SEED_SEARCH_RADIUS = 64
+
+# Side of the local search window and the search radius at the coarsest level, in level pixels
+LOCAL_WINDOW = 96
+LOCAL_RADIUS = 4
+
+# Levels whose window would be smaller than this are skipped
+MIN_LOCAL_WINDOW = 16
+
+# Seeded searches scoring below this fall back to full registration
+MIN_SEED_NCC = 0.5
+
+# Settings taken over from the neighbouring run a new run is seeded from
+SEED_KEYS = ('single_x', 'single_y', 'series_x', 'series_y', 'series_rotation', 'series_scale',
+             'zoom_factor', 'view_x', 'view_y')
+
+# Log-polar resampling of the magnitude spectrum: angle steps over 180 degrees and radius steps
+LOG_POLAR_ANGLES = 720
+LOG_POLAR_RADII = 512
+
+# Smaller estimates are treated as no rotation or scale difference at all
+MIN_ROTATION = 0.05
+MIN_SCALE_CHANGE = 0.0005
+
+
+def to_gray_array(image, factor=1):
+    """Convert an image of any mode to a float32 grayscale array, reduced by an integer factor"""
+    gray = image.convert('F')
+    if factor > 1:
+        gray = gray.reduce(factor)
+    return np.asarray(gray, dtype=np.float32)
+
+
+def hann_window(shape):
+    """2D Hann window to suppress the edge discontinuities of the FFT"""
+    return np.outer(np.hanning(shape[0]), np.hanning(shape[1])).astype(np.float32)
+
+
+def pad_to_shape(array, shape):
+    """Pad an array at the bottom/right with its mean value"""
+    if array.shape == tuple(shape):
+        return array
+    padded = np.full(shape, array.mean(), dtype=np.float32)
+    padded[:array.shape[0], :array.shape[1]] = array
+    return padded
+
+
+def subpixel_peak(left, centre, right):
+    """Parabolic interpolation of correlation peaks, elementwise over arrays"""
+    denominator = left - 2 * centre + right
+    safe = np.where(denominator == 0, 1, denominator)
+    return np.where(denominator == 0, 0.0, 0.5 * (left - right) / safe)
+
+
+def batch_phase_correlation(reference, stack, whitening=1.0):
+    """Phase correlation of every frame of a (N, H, W) stack against one reference
+
+    Returns arrays (dy, dx, response) with one entry per frame, each with the
+    meaning phase_correlation gives them. All FFTs of the stack run as one
+    batched call. whitening is the exponent of the spectral normalisation:
+    1 is phase correlation, 0 plain cross-correlation.
+    """
+    window = hann_window(reference.shape)
+    ref_fft = np.fft.rfft2((reference - reference.mean()) * window)
+    stack_fft = np.fft.rfft2((stack - stack.mean(axis=(1, 2), keepdims=True)) * window)
+
+    cross_power = stack_fft * np.conj(ref_fft)
+    if whitening == 1:
+        cross_power /= np.abs(cross_power) + 1e-12
+    elif whitening:
+        cross_power /= np.abs(cross_power) ** whitening + 1e-12
+    corr = np.fft.irfft2(cross_power, s=reference.shape)
+
+    frames, height, width = corr.shape
+    index = np.arange(frames)
+    peak_y, peak_x = np.unravel_index(corr.reshape(frames, -1).argmax(axis=1), (height, width))
+    centre = corr[index, peak_y, peak_x]
+    dy = peak_y + subpixel_peak(corr[index, (peak_y - 1) % height, peak_x], centre,
+                                corr[index, (peak_y + 1) % height, peak_x])
+    dx = peak_x + subpixel_peak(corr[index, peak_y, (peak_x - 1) % width], centre,
+                                corr[index, peak_y, (peak_x + 1) % width])
+
+    # Peaks past the middle are negative shifts
+    dy = np.where(dy > height / 2, dy - height, dy)
+    dx = np.where(dx > width / 2, dx - width, dx)
+    return dy, dx, centre
+
+
+def phase_correlation(reference, moving):
+    """Estimate the translation of moving relative to reference
+
+    Returns (dy, dx, response) such that moving[y + dy, x + dx] ~= reference[y, x].
+    Both arrays must have the same shape. response is the height of the
+    normalised correlation peak, close to 1 for a clean match.
+    """
+    dy, dx, response = batch_phase_correlation(reference, moving[np.newaxis])
+    return float(dy[0]), float(dx[0]), float(response[0])
+
+
+def bilinear_sample(array, x, y):
+    """Sample a 2D array at float coordinates, clamping at the edges"""
+    height, width = array.shape
+    x = np.clip(x, 0, width - 1)
+    y = np.clip(y, 0, height - 1)
+    x0 = np.minimum(np.floor(x).astype(int), width - 2)
+    y0 = np.minimum(np.floor(y).astype(int), height - 2)
+    fx = x - x0
+    fy = y - y0
+    return ((array[y0, x0] * (1 - fx) + array[y0, x0 + 1] * fx) * (1 - fy) +
+            (array[y0 + 1, x0] * (1 - fx) + array[y0 + 1, x0 + 1] * fx) * fy)
+
+
+def log_polar_spectrum(gray, angles=LOG_POLAR_ANGLES, radii=LOG_POLAR_RADII):
+    """High-pass filtered magnitude spectrum of a square array in log-polar coordinates
+
+    Returns (array of shape (angles, radii), log of the radius step).
+    """
+    size = gray.shape[0]
+    window = hann_window(gray.shape)
+    spectrum = np.abs(np.fft.fftshift(np.fft.fft2((gray - gray.mean()) * window)))
+
+    # Suppress the low frequencies that dominate natural images
+    frequencies = np.cos(np.pi * np.fft.fftshift(np.fft.fftfreq(size)))
+    emphasis = np.outer(frequencies, frequencies)
+    spectrum *= (1 - emphasis) * (2 - emphasis)
+
+    max_radius = size / 2
+    log_step = math.log(max_radius) / (radii - 1)
+    theta = np.linspace(0, np.pi, angles, endpoint=False)[:, np.newaxis]
+    radius = np.exp(np.arange(radii) * log_step)[np.newaxis, :]
+    centre = size // 2
+    x = centre + radius * np.cos(theta)
+    y = centre - radius * np.sin(theta)
+    return bilinear_sample(spectrum, x, y).astype(np.float32), log_step
+
+
+def estimate_rotation_scale(single_image, series_image, coarse_size=COARSE_SIZE):
+    """Estimate the rotation (degrees) and scale that map series_image onto single.png's geometry
+
+    The result is in settings terms: series_rotation and series_scale make
+    warp.transform_image(series_image, rotation, scale) match single.png up
+    to a translation. Only the centred square of each image is used.
+    """
+    longest = max(single_image.width, single_image.height, series_image.width, series_image.height)
+    factor = max(1, math.ceil(longest / coarse_size))
+    single = to_gray_array(single_image, factor)
+    series = to_gray_array(series_image, factor)
+
+    size = min(single.shape + series.shape)
+    single_top, single_left, _, _ = centre_window(single.shape, size)
+    series_top, series_left, _, _ = centre_window(series.shape, size)
+    single_polar, log_step = log_polar_spectrum(single[single_top:single_top + size,
+                                                       single_left:single_left + size])
+    series_polar, _ = log_polar_spectrum(series[series_top:series_top + size,
+                                                series_left:series_left + size])
+
+    d_angle, d_log_radius, _ = phase_correlation(single_polar, series_polar)
+    rotation = d_angle * 180 / LOG_POLAR_ANGLES
+    scale = math.exp(d_log_radius * log_step)
+    if abs(rotation) < MIN_ROTATION:
+        rotation = 0.0
+    if abs(scale - 1) < MIN_SCALE_CHANGE:
+        scale = 1.0
+    return rotation, scale
+
+
+def estimate_shift(single_image, series_image, coarse_size=COARSE_SIZE, refine_size=REFINE_SIZE):
+    """Estimate where single.png content appears in series_0.jpg, in full-resolution pixels
+
+    Returns (dx, dy, response): a feature at (x, y) in single_image is at
+    (x + dx, y + dy) in series_image.
+    """
+    # Reduce both images by the same factor so they keep a common pixel scale
+    longest = max(single_image.width, single_image.height, series_image.width, series_image.height)
+    factor = max(1, math.ceil(longest / coarse_size))
+
+    single = to_gray_array(single_image, factor)
+    series = to_gray_array(series_image, factor)
+    shape = (max(single.shape[0], series.shape[0]), max(single.shape[1], series.shape[1]))
+    dy, dx, response = phase_correlation(pad_to_shape(single, shape), pad_to_shape(series, shape))
+    dx, dy = dx * factor, dy * factor
+
+    if factor > 1 and refine_size:
+        dx, dy, response = refine_shift(single_image, series_image, dx, dy, response,
+                                        factor, refine_size)
+
+    return dx, dy, response
+
+
+def refine_shift(single_image, series_image, dx, dy, response, factor, refine_size=REFINE_SIZE):
+    """Refine a coarse shift with phase correlation on full-resolution windows"""
+    dx_int, dy_int = int(round(dx)), int(round(dy))
+
+    # Window in single_image around its centre whose shifted copy lies inside series_image
+    left = max(0, single_image.width // 2 - refine_size // 2, -dx_int)
+    top = max(0, single_image.height // 2 - refine_size // 2, -dy_int)
+    right = min(left + refine_size, single_image.width, series_image.width - dx_int)
+    bottom = min(top + refine_size, single_image.height, series_image.height - dy_int)
+    if right - left < 32 or bottom - top < 32:
+        return dx, dy, response
+
+    single = to_gray_array(single_image.crop((left, top, right, bottom)))
+    series = to_gray_array(series_image.crop((left + dx_int, top + dy_int,
+                                              right + dx_int, bottom + dy_int)))
+    fine_dy, fine_dx, fine_response = phase_correlation(single, series)
+
+    # A residual of more than two coarse pixels means the refinement locked onto something else
+    if abs(fine_dx) > 2 * factor or abs(fine_dy) > 2 * factor:
+        return dx, dy, response
+    return dx_int + fine_dx, dy_int + fine_dy, fine_response
+
+
+def auto_align(single_image, series_image, settings=None, affine=False):
+    """Return a copy of settings with series offsets that register series_0.jpg onto single.png
+
+    The single.png offsets are kept as they are; the preview centres both
+    images, so the size difference is folded into the series offset. With
+    affine set, the series rotation and scale are estimated first and the
+    offsets are measured on the corrected series image.
+    """
+    settings = dict(settings) if settings else engine.default_settings()
+    if affine:
+        rotation, scale = estimate_rotation_scale(single_image, series_image)
+        settings['series_rotation'] = rotation
+        settings['series_scale'] = scale
+        if not warp.is_identity(rotation, scale):
+            series_image = warp.transform_image(series_image, rotation, scale)
+    dx, dy, response = estimate_shift(single_image, series_image)
+
+    settings['layout'] = engine.PREVIEW_LAYOUT
+    settings['series_x'] = int(round(settings['single_x'] - dx
+                                     + (series_image.width // 2 - single_image.width // 2)))
+    settings['series_y'] = int(round(settings['single_y'] - dy
+                                     + (series_image.height // 2 - single_image.height // 2)))
+    settings['registration_response'] = response
+    return settings
+
+
+def auto_align_run(run_folder, settings=None, affine=False):
+    """Auto-align one run folder from its reference images; None if they cannot be read"""
+    try:
+        with Image.open(os.path.join(run_folder, engine.SINGLE_NAME)) as single_image, \
+                Image.open(os.path.join(run_folder, engine.SERIES_NAME)) as series_image:
+            return auto_align(single_image, series_image, settings, affine)
+    except OSError:
+        return None
+
+
+def nearest_aligned_run(run_folders, alignment_settings, run_folder):
+    """Name of the aligned run closest to run_folder in the run list; the earlier one wins ties"""
+    names = [os.path.basename(folder) for folder in run_folders]
+    index = names.index(os.path.basename(run_folder))
+    for distance in range(1, len(names)):
+        for neighbour in (index - distance, index + distance):
+            if 0 <= neighbour < len(names) and names[neighbour] in alignment_settings:
+                return names[neighbour]
+    return None
+
+
+def seed_settings(neighbour_settings):
+    """Settings of a new run that start from a neighbouring run's offsets and affine correction"""
+    settings = engine.default_settings()
+    settings.update((key, neighbour_settings[key]) for key in SEED_KEYS if key in neighbour_settings)
+    return settings
+
+
+def level_window(image, box, factor):
+    """Grayscale array of a box of an image reduced by factor, without copying the box at full resolution"""
+    if factor > 1:
+        return to_gray_array(image.reduce(factor, box))
+    return to_gray_array(image.crop(box))
+
+
+def series_level_window(series_image, left, top, width, height, factor, rotation, scale):
+    """Grayscale window of the rotated and scaled series image, reduced by factor
+
+    The window covers (left, top) to (left + width * factor, top + height *
+    factor) of warp.transform_image(series_image, rotation, scale), but
+    only the source pixels under it are reduced and resampled.
+    """
+    if warp.is_identity(rotation, scale):
+        return level_window(series_image, (left, top, left + width * factor, top + height * factor), factor)
+
+    a, b, c, d, e, f = warp.inverse_coefficients(rotation, scale, (series_image.width - 1) / 2,
+                                                 (series_image.height - 1) / 2)
+    corners = [(x, y) for x in (left, left + width * factor) for y in (top, top + height * factor)]
+    xs = [a * x + b * y + c for x, y in corners]
+    ys = [d * x + e * y + f for x, y in corners]
+    crop_left = max(0, int(math.floor(min(xs))) - 2 * factor)
+    crop_top = max(0, int(math.floor(min(ys))) - 2 * factor)
+    crop_right = min(series_image.width, int(math.ceil(max(xs))) + 2 * factor)
+    crop_bottom = min(series_image.height, int(math.ceil(max(ys))) + 2 * factor)
+    if crop_right - crop_left < factor or crop_bottom - crop_top < factor:
+        return np.zeros((height, width), dtype=np.float32)
+    reduced = Image.fromarray(level_window(series_image, (crop_left, crop_top, crop_right, crop_bottom), factor))
+
+    # Window pixel (u, v) is centred on full-resolution pixel left + factor * u + half
+    half = (factor - 1) / 2
+    x_offset = (a * (left + half) + b * (top + half) + c - crop_left - half) / factor
+    y_offset = (d * (left + half) + e * (top + half) + f - crop_top - half) / factor
+    # PIL samples at pixel centres, which moves the constant terms by half a pixel
+    coefficients = (a, b, x_offset + 0.5 * (1 - a - b), d, e, y_offset + 0.5 * (1 - d - e))
+    window = reduced.transform((width, height), Image.AFFINE, coefficients, resample=Image.Resampling.BILINEAR)
+    return np.asarray(window, dtype=np.float32)
+
+
+def ncc_surface(template, region):
+    """Normalised cross-correlation of template at every position inside region
+
+    region is larger than template by 2r in each direction; the result has
+    shape (2r + 1, 2r + 1) and its centre is the unshifted position.
+    """
+    height, width = template.shape
+    count = template.size
+    centred = template - template.mean()
+    template_norm = float((centred * centred).sum())
+
+    # The template is centred, so the window means drop out of the numerator
+    region_fft = np.fft.rfft2(region)
+    template_fft = np.fft.rfft2(centred, s=region.shape)
+    correlation = np.fft.irfft2(region_fft * np.conj(template_fft), s=region.shape)
+    numerator = correlation[:region.shape[0] - height + 1, :region.shape[1] - width + 1]
+
+    # Window sums and sums of squares from summed-area tables
+    def window_sums(array):
+        table = np.pad(array, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+        return table[height:, width:] - table[:-height, width:] - table[height:, :-width] + table[:-height, :-width]
+
+    region = region.astype(np.float64)
+    sums = window_sums(region)
+    variances = window_sums(region * region) - sums * sums / count
+    denominator = np.sqrt(np.maximum(variances, 0) * template_norm)
+    return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), 0.0)
+
+
+def local_shift_search(single_image, series_image, dx, dy, rotation=0.0, scale=1.0,
+                       search_radius=SEED_SEARCH_RADIUS, window=LOCAL_WINDOW):
+    """Refine a shift estimate with a coarse-to-fine NCC search near it
+
+    dx, dy have the meaning estimate_shift gives them, measured against the
+    series image rotated and scaled by the settings. The coarsest level is
+    reduced enough that LOCAL_RADIUS of its pixels cover search_radius;
+    every finer level searches two pixels around the doubled estimate. Only
+    a window of about window x window level pixels in the middle of the
+    overlap is read at each level. Returns (dx, dy, ncc) in whole pixels,
+    ncc being the correlation at full resolution.
+    """
+    dx, dy = int(round(dx)), int(round(dy))
+    factor = 2 ** max(0, math.ceil(math.log2(max(search_radius, 1) / LOCAL_RADIUS)))
+    uncertainty = search_radius
+    score = 0.0
+    while factor >= 1:
+        radius = max(1, math.ceil(uncertainty / factor))
+        margin = radius * factor
+        # Part of single_image whose shifted copy, widened by the search radius, stays inside the series image
+        overlap_left = max(0, margin - dx)
+        overlap_top = max(0, margin - dy)
+        overlap_right = min(single_image.width, series_image.width - dx - margin)
+        overlap_bottom = min(single_image.height, series_image.height - dy - margin)
+        width = min(window, (overlap_right - overlap_left) // factor)
+        height = min(window, (overlap_bottom - overlap_top) // factor)
+
+        if width >= MIN_LOCAL_WINDOW and height >= MIN_LOCAL_WINDOW:
+            left = (overlap_left + overlap_right - width * factor) // 2
+            top = (overlap_top + overlap_bottom - height * factor) // 2
+            template = level_window(single_image, (left, top, left + width * factor, top + height * factor),
+                                    factor)
+            region = series_level_window(series_image, left + dx - margin, top + dy - margin,
+                                         width + 2 * radius, height + 2 * radius, factor, rotation, scale)
+            surface = ncc_surface(template, region)
+            peak_y, peak_x = np.unravel_index(int(surface.argmax()), surface.shape)
+            dx += (peak_x - radius) * factor
+            dy += (peak_y - radius) * factor
+            score = float(surface[peak_y, peak_x])
+            uncertainty = factor
+        factor //= 2
+    return dx, dy, score
+
+
+def seed_align(single_image, series_image, settings, search_radius=SEED_SEARCH_RADIUS):
+    """Refine the series offsets of seeded settings with a local search
+
+    Returns (a copy of settings with refined series offsets, ncc). The
+    rotation and scale of the seed are kept.
+    """
+    settings = dict(settings)
+    rotation = settings.get('series_rotation', 0.0)
+    scale = settings.get('series_scale', 1.0)
+    width_difference = series_image.width // 2 - single_image.width // 2
+    height_difference = series_image.height // 2 - single_image.height // 2
+    # The inverse of the offsets auto_align derives from a shift
+    dx = settings['single_x'] - settings['series_x'] + width_difference
+    dy = settings['single_y'] - settings['series_y'] + height_difference
+    dx, dy, score = local_shift_search(single_image, series_image, dx, dy, rotation, scale, search_radius)
+    settings['layout'] = engine.PREVIEW_LAYOUT
+    settings['series_x'] = int(round(settings['single_x'] - dx + width_difference))
+    settings['series_y'] = int(round(settings['single_y'] - dy + height_difference))
+    return settings, score
+
+
+def seed_align_run(run_folder, seed, affine=False):
+    """Align one run from seeded settings, falling back to full registration when the search scores poorly
+
+    None if the reference images cannot be read.
+    """
+    try:
+        with Image.open(os.path.join(run_folder, engine.SINGLE_NAME)) as single_image, \
+                Image.open(os.path.join(run_folder, engine.SERIES_NAME)) as series_image:
+            settings, score = seed_align(single_image, series_image, seed)
+            if score < MIN_SEED_NCC:
+                # The seed's rotation and scale may be off as well, so they are estimated again
+                affine = affine or not warp.is_identity(seed.get('series_rotation', 0.0),
+                                                        seed.get('series_scale', 1.0))
+                return auto_align(single_image, series_image, seed, affine)
+            return settings
+    except OSError:
+        return None
+
+
+def fit_to_shape(array, shape):
+    """Crop or pad (with the mean) an array at the bottom/right to shape"""
+    return pad_to_shape(array[:shape[0], :shape[1]], shape)
+
+
+def centre_window(shape, size):
+    """(top, left, height, width) of a window of at most size x size at the centre of shape"""
+    height, width = min(size, shape[0]), min(size, shape[1])
+    return (shape[0] - height) // 2, (shape[1] - width) // 2, height, width
+
+
+def estimate_drift(series_paths, subpixel=False, coarse_size=COARSE_SIZE, refine_size=REFINE_SIZE,
+                   batch_size=DRIFT_BATCH_SIZE):
+    """Drift of every series frame relative to the first one
+
+    Returns one (dx, dy) per path: a feature at (x, y) in the first frame is
+    at (x + dx, y + dy) in that frame. Frames are reduced and correlated
+    against the first frame batch_size at a time, then refined on a
+    full-resolution window at the image centre, also batched. Without
+    subpixel the drift is rounded to whole pixels.
+    """
+    with Image.open(series_paths[0]) as reference_image:
+        reference_image.load()
+        longest = max(reference_image.size)
+        factor = max(1, math.ceil(longest / coarse_size))
+        reference = to_gray_array(reference_image, factor)
+        full_reference = to_gray_array(reference_image) if refine_size else None
+
+    drift = [(0, 0)]
+    for start in range(1, len(series_paths), batch_size):
+        paths = series_paths[start:start + batch_size]
+        coarse = []
+        full = []
+        for path in paths:
+            with Image.open(path) as image:
+                coarse.append(fit_to_shape(to_gray_array(image, factor), reference.shape))
+                if full_reference is not None:
+                    # 8-bit grayscale keeps a batch of full-resolution frames small
+                    full.append(image.convert('L'))
+        dy, dx, _ = batch_phase_correlation(reference, np.stack(coarse))
+        dx, dy = dx * factor, dy * factor
+
+        if full_reference is not None:
+            dx, dy = refine_drift(full_reference, full, dx, dy, factor, refine_size)
+
+        for frame_dx, frame_dy in zip(dx, dy):
+            if subpixel:
+                drift.append((float(frame_dx), float(frame_dy)))
+            else:
+                drift.append((int(round(frame_dx)), int(round(frame_dy))))
+    return drift
+
+
+def refine_drift(reference, frames, dx, dy, factor, refine_size=REFINE_SIZE):
+    """Refine coarse drift estimates with one batched correlation of full-resolution windows
+
+    frames are the full-resolution images of the batch, reference the first
+    frame as a grayscale array.
+    """
+    top, left, height, width = centre_window(reference.shape, refine_size)
+    dx_int = np.zeros(len(frames), dtype=int)
+    dy_int = np.zeros(len(frames), dtype=int)
+
+    windows = []
+    for index, frame in enumerate(frames):
+        # Where the reference window's content sits in this frame, kept inside the frame
+        frame_top = min(max(0, top + int(round(dy[index]))), max(0, frame.height - height))
+        frame_left = min(max(0, left + int(round(dx[index]))), max(0, frame.width - width))
+        window = frame.crop((frame_left, frame_top, frame_left + width, frame_top + height))
+        windows.append(fit_to_shape(to_gray_array(window), (height, width)))
+        dy_int[index] = frame_top - top
+        dx_int[index] = frame_left - left
+
+    fine_dy, fine_dx, _ = batch_phase_correlation(reference[top:top + height, left:left + width],
+                                                  np.stack(windows), DRIFT_WHITENING)
+
+    # As in refine_shift, a residual of more than two coarse pixels is not trusted
+    reliable = (np.abs(fine_dx) <= 2 * factor) & (np.abs(fine_dy) <= 2 * factor)
+    return (np.where(reliable, dx_int + fine_dx, dx),
+            np.where(reliable, dy_int + fine_dy, dy))
+
+
+def correct_drift_run(run_folder, settings, subpixel=False):
+    """Return a copy of settings with the drift of every series frame; None if a frame cannot be read"""
+    series_paths = sorted(path for path in engine.find_image_files(run_folder)
+                          if os.path.basename(path) != engine.SINGLE_NAME)
+    # series_0.jpg is the frame the series offset was tuned on, so it is the reference
+    reference_path = os.path.join(run_folder, engine.SERIES_NAME)
+    series_paths = [reference_path] + [path for path in series_paths if path != reference_path]
+
+    try:
+        drift = estimate_drift(series_paths, subpixel)
+    except OSError:
+        return None
+    settings = dict(settings)
+    settings['series_drift'] = {os.path.basename(path): list(shift)
+                                for path, shift in zip(series_paths, drift)}
+    return settings
+
+
+def correct_drift_all(run_folders, alignment_settings, subpixel=False, overwrite=False,
+                      workers=None, progress=None):
+    """Measure series drift for every run that has settings, in a process pool when workers > 1
+
+    Runs that already have a measured drift are skipped unless overwrite is
+    set. progress(done, total, run_name) is called once per run. Returns a
+    new settings mapping.
+    """
+    alignment_settings = dict(alignment_settings)
+    todo = [folder for folder in run_folders
+            if os.path.basename(folder) in alignment_settings
+            and (overwrite or 'series_drift' not in alignment_settings[os.path.basename(folder)])]
+    previous = [alignment_settings[os.path.basename(folder)] for folder in todo]
+    if workers is None:
+        workers = engine.default_workers()
+
+    if workers <= 1 or len(todo) <= 1:
+        results = map(correct_drift_run, todo, previous, [subpixel] * len(todo))
+        executor = None
+    else:
+        executor = engine.process_pool(workers)
+        results = executor.map(correct_drift_run, todo, previous, [subpixel] * len(todo))
+
+    try:
+        for done, (folder, settings) in enumerate(zip(todo, results), start=1):
+            run_name = os.path.basename(folder)
+            if settings is not None:
+                alignment_settings[run_name] = settings
+            if progress:
+                progress(done, len(todo), run_name)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    return alignment_settings
+
+
+def auto_align_all(run_folders, alignment_settings=None, overwrite=False, workers=None, progress=None,
+                   affine=False, seeded=False):
+    """Auto-align every run folder, in a process pool when workers > 1
+
+    Runs that already have settings are skipped unless overwrite is set, and
+    runs whose reference images cannot be read are left out. With affine
+    set, series rotation and scale are estimated too. With seeded set, runs
+    are aligned one after another, each seeded from the nearest aligned run
+    and refined by a local search; runs without an aligned neighbour and
+    poor matches get full registration.
+    progress(done, total, run_name) is called once per run. Returns a new
+    settings mapping including the untouched runs.
+    """
+    alignment_settings = dict(alignment_settings or {})
+    todo = [folder for folder in run_folders
+            if overwrite or os.path.basename(folder) not in alignment_settings]
+    previous = [alignment_settings.get(os.path.basename(folder)) for folder in todo]
+    if workers is None:
+        workers = engine.default_workers()
+
+    if seeded:
+        for done, (folder, settings) in enumerate(zip(todo, previous), start=1):
+            run_name = os.path.basename(folder)
+            # Runs aligned earlier in this loop count as neighbours too
+            others = {name: value for name, value in alignment_settings.items() if name != run_name}
+            neighbour = nearest_aligned_run(run_folders, others, folder)
+            if neighbour is None:
+                settings = auto_align_run(folder, settings, affine)
+            else:
+                settings = seed_align_run(folder, seed_settings(others[neighbour]), affine)
+            if settings is not None:
+                alignment_settings[run_name] = settings
+            if progress:
+                progress(done, len(todo), run_name)
+        return alignment_settings
+
+    if workers <= 1 or len(todo) <= 1:
+        results = map(auto_align_run, todo, previous, [affine] * len(todo))
+        executor = None
+    else:
+        executor = engine.process_pool(workers)
+        results = executor.map(auto_align_run, todo, previous, [affine] * len(todo))
+
+    try:
+        for done, (folder, settings) in enumerate(zip(todo, results), start=1):
+            run_name = os.path.basename(folder)
+            if settings is not None:
+                alignment_settings[run_name] = settings
+            if progress:
+                progress(done, len(todo), run_name)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    return alignment_settings
@@ -0,0 +1,112 @@
+"""
+Cached, incrementally rescanned index of the run folders in a base directory.
+
+A full discovery lists every run folder, which is slow on network shares
+with thousands of runs. The index remembers each run's directory mtime and
+image list, so a rescan lists the base directory once and only re-lists run
+folders that changed (a new frame, a renamed file). It is saved next to the
+alignment settings, so reopening a base directory starts from the last
+index. The GUI rescans periodically, so runs a capture rig writes while the
+tool is open show up without reloading.
+"""
+
+import os
+import json
+import time
+import threading
+
+from . import engine, metrics, store
+
+INDEX_FILENAME = "run_index.json"
+INDEX_VERSION = 1
+
+# Folders modified this close to a scan are listed again on the next one:
+# coarse filesystem timestamps may not show entries added in the same tick
+MTIME_SLACK_NS = 2 * 10 ** 9
+
+
+def index_path(base_directory):
+    return os.path.join(base_directory, INDEX_FILENAME)
+
+
+class RunIndex:
+    """Run folders of a base directory with their image lists"""
+
+    def __init__(self, base_directory, persistent=True):
+        self.base_directory = base_directory
+        self.path = index_path(base_directory) if persistent else None
+        self.runs = {}
+        self.lock = threading.Lock()
+        if self.path and os.path.exists(self.path):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        # Anything unexpected just means a full scan
+        if data.get('version') == INDEX_VERSION:
+            self.runs = data['runs']
+
+    def save(self):
+        """Write the index next to the settings; a read-only base directory is not an error"""
+        if not self.path:
+            return
+        with self.lock:
+            data = {'version': INDEX_VERSION, 'runs': dict(self.runs)}
+        try:
+            store.write_json_atomic(self.path, data)
+        except OSError:
+            pass
+
+    # Recorded under the stage of the full discovery it replaces
+    @metrics.timed('find_run_folders')
+    def scan(self):
+        """Bring the index up to date with the file system
+
+        Only run folders that are new or whose mtime changed are listed.
+        Returns a dict of run names that were 'added', 'changed' or
+        'removed'.
+        """
+        scan_ns = time.time_ns()
+        changes = {'added': [], 'changed': [], 'removed': []}
+        seen = set()
+
+        for entry in engine.list_run_directories(self.base_directory):
+            seen.add(entry.name)
+            try:
+                mtime_ns = entry.stat().st_mtime_ns
+            except OSError:
+                continue
+            with self.lock:
+                known = self.runs.get(entry.name)
+            if (known is not None and known['mtime_ns'] == mtime_ns
+                    and known['scanned_ns'] - mtime_ns > MTIME_SLACK_NS):
+                continue
+
+            try:
+                images = engine.list_images(entry.path)
+            except OSError:
+                continue
+            with self.lock:
+                self.runs[entry.name] = {'mtime_ns': mtime_ns, 'scanned_ns': scan_ns, 'images': images}
+            if known is None:
+                changes['added'].append(entry.name)
+            elif known['images'] != images:
+                changes['changed'].append(entry.name)
+
+        with self.lock:
+            for name in list(self.runs):
+                if name not in seen:
+                    del self.runs[name]
+                    changes['removed'].append(name)
+        return changes
+
+    def run_folders(self):
+        """Paths of the indexed runs that have both reference images, in natural order"""
+        with self.lock:
+            names = [name for name, run in self.runs.items() if engine.has_reference_images(run['images'])]
+        names.sort(key=engine.run_sort_key)
+        return [os.path.join(self.base_directory, name) for name in names]
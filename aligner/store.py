@@ -0,0 +1,175 @@
+"""
+Persistent alignment settings and the export manifest.
+
+Settings live in a versioned sidecar file in the base directory, so closing
+the GUI never loses offsets. The manifest in the output directory records,
+for every exported image, the input file it came from (mtime, size and
+content hash) and the parameters it was exported with, so a re-export only
+redoes images whose inputs or settings changed.
+"""
+
+import os
+import json
+import socket
+import contextlib
+import hashlib
+import threading
+
+SETTINGS_FILENAME = "alignment_settings.json"
+SETTINGS_VERSION = 1
+
+MANIFEST_FILENAME = "export_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def temporary_path(path):
+    """Name to write path's new contents under before renaming them over it
+
+    Unique per host, process and thread, so writers on several machines
+    sharing the output directory never write into the same temporary file.
+    """
+    return f"{path}.tmp-{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+
+
+@contextlib.contextmanager
+def atomic_write(path, newline=None):
+    """Text file to write path's new contents to; renamed over path only if writing succeeds"""
+    temp_path = temporary_path(path)
+    try:
+        with open(temp_path, 'w', newline=newline) as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temporary file and rename it over path"""
+    with atomic_write(path) as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def settings_path(base_directory):
+    """Sidecar settings file of a base directory"""
+    return os.path.join(base_directory, SETTINGS_FILENAME)
+
+
+def load_settings(path):
+    """Load per-run alignment settings
+
+    Accepts the versioned format written by save_settings as well as a plain
+    {run name: settings} mapping.
+    """
+    with open(path) as f:
+        data = json.load(f)
+
+    if 'version' not in data:
+        return data
+    if data['version'] > SETTINGS_VERSION:
+        raise ValueError(f"{path} was written by a newer version (settings version {data['version']})")
+    return data['runs']
+
+
+def save_settings(path, alignment_settings):
+    """Save per-run alignment settings in the versioned format"""
+    write_json_atomic(path, {'version': SETTINGS_VERSION, 'runs': alignment_settings})
+
+
+def file_signature(path):
+    """Cheap change check: modification time and size"""
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def content_hash(data):
+    """file_hash of bytes already read"""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def file_hash(path):
+    """Content hash used when mtime or size changed"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def job_params(job):
+    """Everything besides the input file that determines an exported image"""
+    params = {
+        'x_offset': job['x_offset'],
+        'y_offset': job['y_offset'],
+        'overlap_bounds': job['overlap_bounds'],
+        'output_width': job['output_width'],
+        'output_height': job['output_height']
+    }
+    # Only recorded when set, so manifests of untransformed exports stay current
+    if job['rotation'] != 0 or job['scale'] != 1:
+        params['rotation'] = job['rotation']
+        params['scale'] = job['scale']
+    # The output encoder likewise, when it is not the default
+    if job.get('encoder') not in (None, {'format': 'keep'}):
+        params['encoder'] = job['encoder']
+    # And the preview layout, so runs re-aligned into it are exported again
+    if job.get('layout', 'canvas') != 'canvas':
+        params['layout'] = job['layout']
+    return params
+
+
+class ExportManifest:
+    """Record of exported images, stored next to them in the output directory"""
+
+    def __init__(self, output_base):
+        self.output_base = output_base
+        self.path = os.path.join(output_base, MANIFEST_FILENAME)
+        self.entries = {}
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            # An unknown format just means everything gets exported again
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = data['outputs']
+
+    def key(self, job):
+        return os.path.relpath(job['output_path'], self.output_base)
+
+    def is_current(self, job):
+        """Whether the existing output of a job still matches its input and settings"""
+        entry = self.entries.get(self.key(job))
+        if entry is None or entry['params'] != job_params(job):
+            return False
+        if not os.path.exists(job['output_path']):
+            return False
+
+        signature = file_signature(job['image_path'])
+        if signature['mtime_ns'] == entry['mtime_ns'] and signature['size'] == entry['size']:
+            return True
+
+        # Touched but possibly unchanged: fall back to the content hash, if the export had one
+        if signature['size'] != entry['size'] or entry.get('hash') is None:
+            return False
+        if file_hash(job['image_path']) != entry['hash']:
+            return False
+        entry.update(signature)
+        return True
+
+    def record(self, job):
+        """Remember that a job's output was written from its current input
+
+        Only the input is stat'ed here; its content hash is the one the
+        export computed while reading it (see engine.read_export_image), and
+        is missing when the image came from a cache instead.
+        """
+        entry = file_signature(job['image_path'])
+        entry['input'] = job['image_path']
+        entry['hash'] = job.get('input_hash')
+        entry['params'] = job_params(job)
+        self.entries[self.key(job)] = entry
+
+    def save(self):
+        os.makedirs(self.output_base, exist_ok=True)
+        write_json_atomic(self.path, {'version': MANIFEST_VERSION, 'outputs': self.entries})
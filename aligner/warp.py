@@ -0,0 +1,160 @@
+"""
+Rotation and scale of the series images relative to single.png.
+
+The two optical paths differ slightly in magnification and rotation, so the
+series images of a run can carry an affine correction on top of their
+offsets: 'series_rotation' (degrees, clockwise on screen) and
+'series_scale', both applied about the image centre before the offsets. An
+identity transform leaves the plain crop path untouched.
+
+For export, the sampling positions of the output window are computed once
+as a WarpMap and reused for every frame of the run that shares the window;
+applying it is a vectorised bilinear gather. Fractional offsets from
+sub-pixel drift correction are sampled the same way, as a map without
+rotation or scale.
+"""
+
+import math
+import functools
+import numpy as np
+from PIL import Image
+
+# Warp maps kept per process; frames of one run with the same offset share one
+WARP_CACHE_SIZE = 4
+
+# Sub-pixel positions are quantised to 1/16 pixel so the bilinear weights are
+# integers summing to 256 and the blend fits in uint16
+SUBPIXEL_STEPS = 16
+
+
+def is_identity(rotation, scale):
+    return rotation == 0 and scale == 1
+
+
+def inverse_coefficients(rotation, scale, centre_x, centre_y):
+    """PIL AFFINE coefficients mapping transformed image coordinates back to the source image"""
+    angle = math.radians(rotation)
+    a = math.cos(angle) / scale
+    b = math.sin(angle) / scale
+    d = -b
+    e = a
+    return (a, b, centre_x - a * centre_x - b * centre_y,
+            d, e, centre_y - d * centre_x - e * centre_y)
+
+
+def transform_image(image, rotation, scale, resample=Image.Resampling.BILINEAR):
+    """Rotate and scale an image about its centre, keeping its size; uncovered areas become transparent"""
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    coefficients = inverse_coefficients(rotation, scale, (image.width - 1) / 2, (image.height - 1) / 2)
+    return image.transform(image.size, Image.AFFINE, coefficients, resample=resample,
+                           fillcolor=(0, 0, 0, 0))
+
+
+class WarpMap:
+    """Bilinear sampling positions of an output window in a rotated and scaled source image
+
+    Output pixel (u, v) shows the transformed image at (left + u, top + v),
+    which is the source image at centre + A^-1 (p - centre). Samples that
+    fall outside the source stay white, as in the plain crop. rows =
+    (start, stop) limits the map to those rows of the window, for tiled
+    exports; every row is computed exactly as in the map of the whole
+    window. Only the box of source pixels under the map is read.
+    """
+
+    def __init__(self, image_size, left, top, width, height, rotation, scale, rows=None):
+        source_width, source_height = image_size
+        start, stop = rows or (0, height)
+        self.width = width
+        self.height = stop - start
+        a, b, c, d, e, f = inverse_coefficients(rotation, scale, (source_width - 1) / 2,
+                                                (source_height - 1) / 2)
+
+        u, v = np.meshgrid(np.arange(width, dtype=np.float64) + left,
+                           np.arange(start, stop, dtype=np.float64) + top)
+        x = (a * u + b * v + c).ravel()
+        y = (d * u + e * v + f).ravel()
+
+        inside = (x >= 0) & (x <= source_width - 1) & (y >= 0) & (y <= source_height - 1)
+        self.inside = np.flatnonzero(inside)
+        x, y = x[inside], y[inside]
+
+        x0 = np.minimum(np.floor(x).astype(np.int32), max(source_width - 2, 0))
+        y0 = np.minimum(np.floor(y).astype(np.int32), max(source_height - 2, 0))
+        fx = np.round((x - x0) * SUBPIXEL_STEPS).astype(np.uint16)[:, np.newaxis]
+        fy = np.round((y - y0) * SUBPIXEL_STEPS).astype(np.uint16)[:, np.newaxis]
+        x1 = np.minimum(x0 + 1, source_width - 1)
+        y1 = np.minimum(y0 + 1, source_height - 1)
+
+        # Source pixels the samples touch; indices are relative to this box
+        if len(x0):
+            self.source_box = (int(x0.min()), int(y0.min()), int(x1.max()) + 1, int(y1.max()) + 1)
+        else:
+            self.source_box = None
+        box_left, box_top = self.source_box[:2] if self.source_box else (0, 0)
+        box_width = self.source_box[2] - box_left if self.source_box else 0
+        x0 -= box_left
+        x1 -= box_left
+        y0 -= box_top
+        y1 -= box_top
+
+        # Flat indices of the four neighbours and their integer weights
+        steps = SUBPIXEL_STEPS
+        self.indices = [y0 * box_width + x0, y0 * box_width + x1,
+                        y1 * box_width + x0, y1 * box_width + x1]
+        self.weights = [(steps - fx) * (steps - fy), fx * (steps - fy), (steps - fx) * fy, fx * fy]
+
+    def sample(self, flat):
+        """Bilinear samples of the inside positions from the (pixels, channels) array of the source box
+
+        Integer arithmetic, so 8-bit data accumulates in uint16 and 16-bit data in uint32.
+        """
+        accumulate = np.uint16 if flat.dtype == np.uint8 else np.uint32
+        sampled = np.take(flat, self.indices[0], axis=0).astype(accumulate) * self.weights[0]
+        for indices, weights in zip(self.indices[1:], self.weights[1:]):
+            sampled += np.take(flat, indices, axis=0).astype(accumulate) * weights
+        sampled += 128
+        sampled >>= 8
+        return sampled
+
+    def apply(self, image):
+        """Sample an image through the map into a white RGB output image"""
+        output = np.full((self.width * self.height, 3), 255, dtype=np.uint8)
+        if self.source_box is None:
+            return Image.fromarray(output.reshape(self.height, self.width, 3))
+
+        mode = image.mode
+        if mode not in ('RGB', 'RGBA'):
+            mode = 'RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB'
+        # Only the box under the window is converted and copied, never the whole frame
+        region = image.crop(self.source_box)
+        if region.mode != mode:
+            region = region.convert(mode)
+        source = np.asarray(region)
+        sampled = self.sample(source.reshape(-1, source.shape[2]))
+
+        if source.shape[2] == 4:
+            # Blend onto white like the alpha paste of the plain crop
+            alpha = sampled[:, 3:4].astype(np.uint32)
+            sampled = (sampled[:, :3] * alpha + 255 * (255 - alpha) + 127) // 255
+
+        output[self.inside] = sampled[:, :3]
+        return Image.fromarray(output.reshape(self.height, self.width, 3))
+
+    def apply_array(self, region, dtype, channels=()):
+        """Sample the array of the source box into an output array of the same dtype and channels
+
+        region is None when the map reads no source pixels; outside samples
+        are white, the largest value of the dtype.
+        """
+        output = np.full((self.width * self.height,) + channels, np.iinfo(dtype).max, dtype=dtype)
+        if region is not None and self.source_box is not None:
+            sampled = self.sample(region.reshape(region.shape[0] * region.shape[1], -1))
+            output[self.inside] = sampled.reshape((-1,) + channels)
+        return output.reshape((self.height, self.width) + channels)
+
+
+@functools.lru_cache(maxsize=WARP_CACHE_SIZE)
+def warp_map(image_size, left, top, width, height, rotation, scale, rows=None):
+    """Cached WarpMap; every frame of a run with the same size and window reuses it"""
+    return WarpMap(image_size, left, top, width, height, rotation, scale, rows)
@@ -0,0 +1,385 @@
+"""
+Export work queue on a shared directory, for exporting with several machines.
+
+A planner turns the saved alignment settings into one job per run and
+writes them to a queue directory that every node can reach:
+
+    QUEUE/plan.json              output settings and the per-run jobs
+    QUEUE/leases/RUN/GENERATION  claims of a run, one file per attempt
+    QUEUE/done/RUN.json          finished runs, with their quality scores
+
+Workers claim a run by creating the next lease generation with O_EXCL, which
+only one of them can win. While exporting they keep touching the lease; a
+lease not touched for the lease time belongs to a crashed worker and anyone
+may claim the next generation. A worker whose lease was taken over stops
+before marking the run done. Images are written to a temporary file and
+renamed, and a done marker is only written once the whole run is out, so a
+half-exported run is simply exported again. Lease expiry compares file
+mtimes with the local clock, so the nodes' clocks must be synchronised.
+
+Several worker processes on one machine work the same way, which is how
+the queue can be tried out locally.
+"""
+
+import os
+import json
+import time
+import errno
+import socket
+import hashlib
+import threading
+
+from . import encoders, engine, metrics, quality, store
+
+PLAN_FILENAME = "plan.json"
+PLAN_VERSION = 1
+QUEUE_DIR_NAME = "EXPORT_QUEUE"
+
+# Seconds without a heartbeat before a claimed run may be reclaimed
+LEASE_SECONDS = 120
+
+# Seconds between polls of a worker waiting for other workers' runs
+POLL_SECONDS = 5
+
+
+def default_queue_dir(base_directory):
+    """Queue lives next to the base directory, like the export"""
+    return os.path.join(os.path.dirname(base_directory), QUEUE_DIR_NAME)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def job_signature(job):
+    """Hash of everything that determines a run's export"""
+    fields = {key: job[key] for key in ('run_folder', 'settings', 'overlap_bounds')}
+    # Only included when set, so plans of default exports keep their signatures
+    if not encoders.is_default(job.get('encoder')):
+        fields['encoder'] = job['encoder']
+    text = json.dumps(fields, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def plan_export(base_directory, alignment_settings, queue_dir=None, output_base=None,
+                run_folders=None, output_width=engine.OUTPUT_WIDTH, output_height=engine.OUTPUT_HEIGHT,
+                encoder=None):
+    """Write a plan with one job per exportable run to the queue directory
+
+    Runs are skipped for the same reasons export_all skips them. Planning
+    again keeps the runs whose job did not change done; changed runs are
+    queued again. Returns the queue directory and the plan.
+    """
+    base_directory = os.path.abspath(base_directory)
+    if queue_dir is None:
+        queue_dir = default_queue_dir(base_directory)
+    if output_base is None:
+        output_base = engine.default_output_base(base_directory)
+    if run_folders is None:
+        run_folders = engine.find_run_folders(base_directory)
+
+    jobs = []
+    for run_folder in run_folders:
+        run_name = os.path.basename(run_folder)
+        if run_name not in alignment_settings:
+            continue
+        settings = alignment_settings[run_name]
+        try:
+            overlap_bounds = engine.run_overlap_region(run_folder, settings, output_width, output_height)
+        except OSError:
+            continue
+        if not overlap_bounds:
+            continue
+        job = {'run': run_name, 'run_folder': os.path.abspath(run_folder), 'settings': settings,
+               'overlap_bounds': overlap_bounds, 'encoder': encoder}
+        job['signature'] = job_signature(job)
+        jobs.append(job)
+
+    plan = {
+        'version': PLAN_VERSION,
+        'base_directory': base_directory,
+        'output_base': os.path.abspath(output_base),
+        'output_width': output_width,
+        'output_height': output_height,
+        'jobs': jobs
+    }
+    queue = WorkQueue(queue_dir, plan)
+    for directory in (queue_dir, queue.done_dir, queue.leases_dir, plan['output_base']):
+        os.makedirs(directory, exist_ok=True)
+
+    # Forget the results of runs whose job changed or that are no longer planned
+    signatures = {job['run']: job['signature'] for job in jobs}
+    for filename in os.listdir(queue.done_dir):
+        run_name, extension = os.path.splitext(filename)
+        if extension != '.json':
+            continue
+        done = queue.done_marker(run_name)
+        if done is None or done.get('signature') != signatures.get(run_name):
+            os.remove(os.path.join(queue.done_dir, filename))
+
+    store.write_json_atomic(os.path.join(queue_dir, PLAN_FILENAME), plan)
+    return queue_dir, plan
+
+
+class Lease:
+    """A worker's claim on one run, kept alive by a heartbeat thread"""
+
+    def __init__(self, queue, job, generation, worker_id, lease_seconds):
+        self.queue = queue
+        self.job = job
+        self.generation = generation
+        self.worker_id = worker_id
+        self.path = queue.lease_path(job['run'], generation)
+        self.stop = threading.Event()
+        self.lost = threading.Event()
+        self.thread = threading.Thread(target=self.heartbeat, args=(lease_seconds / 4,), daemon=True)
+        self.thread.start()
+
+    def heartbeat(self, interval):
+        while not self.stop.wait(interval):
+            if not self.is_held():
+                self.lost.set()
+                return
+            try:
+                os.utime(self.path)
+            except OSError:
+                self.lost.set()
+                return
+
+    def is_held(self):
+        """Whether no other worker has claimed the run since"""
+        return self.queue.latest_generation(self.job['run']) == self.generation
+
+    def release(self):
+        self.stop.set()
+        self.thread.join()
+
+
+class AnyEvent:
+    """Set as soon as any of its events is; stands in for an export's cancel_event"""
+
+    def __init__(self, *events):
+        self.events = [event for event in events if event is not None]
+
+    def is_set(self):
+        return any(event.is_set() for event in self.events)
+
+
+class WorkQueue:
+    """Jobs of a plan and their claims and results in the queue directory"""
+
+    def __init__(self, queue_dir, plan=None):
+        self.queue_dir = queue_dir
+        if plan is None:
+            with open(os.path.join(queue_dir, PLAN_FILENAME)) as f:
+                plan = json.load(f)
+            if plan.get('version') != PLAN_VERSION:
+                raise ValueError(f"Unsupported export plan version {plan.get('version')}")
+        self.plan = plan
+        self.done_dir = os.path.join(queue_dir, "done")
+        self.leases_dir = os.path.join(queue_dir, "leases")
+
+    def lease_path(self, run_name, generation):
+        return os.path.join(self.leases_dir, run_name, str(generation))
+
+    def done_path(self, run_name):
+        return os.path.join(self.done_dir, f"{run_name}.json")
+
+    def done_marker(self, run_name):
+        try:
+            with open(self.done_path(run_name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_done(self, job):
+        done = self.done_marker(job['run'])
+        return done is not None and done.get('signature') == job['signature']
+
+    def generations(self, run_name):
+        try:
+            return sorted(int(name) for name in os.listdir(os.path.join(self.leases_dir, run_name))
+                          if name.isdigit())
+        except FileNotFoundError:
+            return []
+
+    def latest_generation(self, run_name):
+        generations = self.generations(run_name)
+        return generations[-1] if generations else 0
+
+    def is_expired(self, run_name, generation, lease_seconds):
+        try:
+            return time.time() - os.stat(self.lease_path(run_name, generation)).st_mtime > lease_seconds
+        except FileNotFoundError:
+            return True
+
+    def try_claim(self, job, worker_id, lease_seconds=LEASE_SECONDS):
+        """Claim a run that is neither done nor held by a live worker; returns a Lease or None"""
+        run_name = job['run']
+        if self.is_done(job):
+            return None
+        generation = self.latest_generation(run_name)
+        if generation and not self.is_expired(run_name, generation, lease_seconds):
+            return None
+
+        # Creating the next generation is the atomic step: only one worker can win it
+        os.makedirs(os.path.join(self.leases_dir, run_name), exist_ok=True)
+        try:
+            fd = os.open(self.lease_path(run_name, generation + 1), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return None
+            raise
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'worker': worker_id, 'claimed': time.time()}, f)
+
+        # Another worker may have finished the run after the check above
+        if self.is_done(job):
+            os.utime(self.lease_path(run_name, generation + 1), (0, 0))
+            return None
+        # Older generations only belonged to crashed or superseded workers
+        for old in range(1, generation + 1):
+            self.remove_lease(run_name, old)
+        return Lease(self, job, generation + 1, worker_id, lease_seconds)
+
+    def remove_lease(self, run_name, generation):
+        try:
+            os.remove(self.lease_path(run_name, generation))
+        except OSError:
+            pass
+
+    def expire_lease(self, lease):
+        """Make a released lease claimable at once
+
+        The file stays, so generation numbers never repeat and a stalled
+        worker of an older generation can never appear to hold the run.
+        """
+        try:
+            os.utime(lease.path, (0, 0))
+        except OSError:
+            pass
+
+    def complete(self, lease, written, scores):
+        """Mark a leased run done; returns False if the lease was lost in the meantime"""
+        lease.release()
+        if lease.lost.is_set() or not lease.is_held():
+            return False
+        store.write_json_atomic(self.done_path(lease.job['run']), {
+            'signature': lease.job['signature'],
+            'worker': lease.worker_id,
+            'written': written,
+            'finished': time.time(),
+            'quality': scores
+        })
+        self.expire_lease(lease)
+        return True
+
+    def abandon(self, lease):
+        """Give a run back to the queue after a failed export"""
+        lease.release()
+        if lease.is_held():
+            self.expire_lease(lease)
+
+    def status(self, lease_seconds=LEASE_SECONDS):
+        """Counts of 'done', 'running' and 'pending' runs"""
+        counts = {'done': 0, 'running': 0, 'pending': 0}
+        for job in self.plan['jobs']:
+            if self.is_done(job):
+                counts['done'] += 1
+                continue
+            generation = self.latest_generation(job['run'])
+            if generation and not self.is_expired(job['run'], generation, lease_seconds):
+                counts['running'] += 1
+            else:
+                counts['pending'] += 1
+        return counts
+
+    def quality_scores(self):
+        scores = {}
+        for job in self.plan['jobs']:
+            done = self.done_marker(job['run'])
+            if done is not None and done.get('quality'):
+                scores[job['run']] = done['quality']
+        return scores
+
+    def export_job(self, lease, workers=None, tile_budget=None, frame_cache=None, cancel_event=None):
+        """Export every image of a leased run; returns (images written, quality scores)
+
+        Raises engine.ExportCancelled when cancel_event is set or the lease is lost.
+        """
+        job = lease.job
+        plan = self.plan
+        jobs = engine.plan_run(job['run_folder'], job['settings'], plan['output_base'], job['overlap_bounds'],
+                               plan['output_width'], plan['output_height'], job.get('encoder'), tile_budget,
+                               frame_cache)
+        quality.collector.reset()
+        written = engine.stream_jobs(jobs, workers, cancel_event=AnyEvent(lease.lost, cancel_event))
+        return written, quality.collector.take_scores().get(job['run'])
+
+
+def run_worker(queue_dir, worker_id=None, workers=None, lease_seconds=LEASE_SECONDS,
+               wait=True, progress=None, cancel_event=None, tile_budget=None, frame_cache=None):
+    """Claim and export runs from a queue until none are left
+
+    With wait set, the worker keeps polling while other workers still hold
+    runs, so it can take over the runs of workers that crash. The last
+    worker to see every run done writes the quality report. tile_budget is
+    this machine's memory limit per crop (see engine.align_and_crop_to_overlap)
+    and frame_cache its cache of decoded frames (see framecache).
+    progress(done, total, run_name) is called after each run this worker
+    finishes. Setting cancel_event stops the current export too, and gives
+    its run back to the queue at once. Returns the number of runs this
+    worker exported.
+    """
+    if worker_id is None:
+        worker_id = default_worker_id()
+    queue = WorkQueue(queue_dir)
+    jobs = queue.plan['jobs']
+    finished = set()
+    exported = 0
+    position = 0
+
+    while cancel_event is None or not cancel_event.is_set():
+        lease = None
+        # Start after the last claim so workers spread out over the plan
+        for offset in range(len(jobs)):
+            job = jobs[(position + offset) % len(jobs)]
+            if job['run'] in finished:
+                continue
+            lease = queue.try_claim(job, worker_id, lease_seconds)
+            if lease is not None:
+                position = (position + offset + 1) % len(jobs)
+                break
+            if queue.is_done(job):
+                finished.add(job['run'])
+
+        if lease is None:
+            if len(finished) == len(jobs) or not wait:
+                break
+            delay = min(POLL_SECONDS, lease_seconds / 4)
+            if cancel_event is not None:
+                cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+            continue
+
+        try:
+            with metrics.collector.timer('queue_job'):
+                written, scores = queue.export_job(lease, workers, tile_budget, frame_cache, cancel_event)
+        except engine.ExportCancelled:
+            # Expired right away, so another worker need not wait out the lease
+            queue.abandon(lease)
+            continue
+        except BaseException:
+            queue.abandon(lease)
+            raise
+        if queue.complete(lease, written, scores):
+            finished.add(lease.job['run'])
+            exported += 1
+            if progress:
+                progress(len(finished), len(jobs), lease.job['run'])
+
+    if len(finished) == len(jobs) and jobs:
+        # Every worker that gets here writes the same report; each file is replaced atomically
+        quality.update_report(queue.plan['output_base'], queue.quality_scores())
+    return exported
@@ -0,0 +1,280 @@
+"""
+Benchmarks for the preview and export paths.
+
+Generates a synthetic base directory (see benchmarks/synthetic.py), then
+measures:
+
+- preview render latency per slider event (p50/p99), through the same
+  offscreen render path update_display uses, so no display is needed
+- export throughput in images per second, single process, process pool and
+  the single-run streaming pipeline
+- output size and export speed of each output encoder setting
+- peak RSS of a full export_all, measured in a child process
+
+Results are written as JSON so runs from different commits can be compared:
+
+    python -m benchmarks.bench --output before.json
+    python -m benchmarks.bench --output after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import PIL
+from PIL import Image
+
+from aligner import encoders, engine, metrics, preview, store
+from benchmarks import synthetic
+
+CANVAS_WIDTH = 600
+CANVAS_HEIGHT = 400
+MAX_ZOOM = 3.0
+
+# Encoder settings compared by bench_encoders; lossless WebP at the default
+# effort takes seconds per image, so only its fastest method is included
+ENCODER_CHOICES = {
+    'keep': encoders.default_encoder(),
+    'png_level_1': encoders.make_encoder('png', png_compress_level=1),
+    'png_level_6': encoders.make_encoder('png', png_compress_level=6),
+    'webp_lossless_method_0': encoders.make_encoder('webp', webp_method=0),
+    'jpeg_q95_444': encoders.make_encoder('jpeg', jpeg_quality=95, jpeg_subsampling='4:4:4'),
+    'jpeg_q75_420': encoders.make_encoder('jpeg', jpeg_quality=75, jpeg_subsampling='4:2:0'),
+    'npy': encoders.make_encoder('npy')
+}
+
+
+def percentiles(samples):
+    """Summary of latency samples in milliseconds"""
+    values = np.array(samples) * 1000
+    return {
+        'count': len(samples),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'mean_ms': float(values.mean()),
+        'max_ms': float(values.max())
+    }
+
+
+def slider_events(settings, steps):
+    """Settings sequences for dragging each kind of slider"""
+    events = {}
+    events['offset'] = [dict(settings, series_x=settings['series_x'] + i - steps // 2)
+                        for i in range(steps)]
+    events['transparency'] = [dict(settings, transparency=i / max(1, steps - 1)) for i in range(steps)]
+    events['pan'] = [dict(settings, view_x=i * 8 - steps * 4) for i in range(steps)]
+    events['zoom'] = [dict(settings, zoom_factor=0.2 + (MAX_ZOOM - 0.2) * i / max(1, steps - 1))
+                      for i in range(steps)]
+    return events
+
+
+def bench_preview(run_folder, settings, steps):
+    """Latency of rendering one canvas frame per slider event"""
+    single_path = os.path.join(run_folder, engine.SINGLE_NAME)
+    series_path = os.path.join(run_folder, engine.SERIES_NAME)
+
+    start = time.perf_counter()
+    with Image.open(single_path) as single_image, Image.open(series_path) as series_image:
+        base_scale = preview.fit_scale(single_image.size, series_image.size, CANVAS_WIDTH, CANVAS_HEIGHT)
+    max_scale = base_scale * MAX_ZOOM
+    single_pyramid = preview.PreviewPyramid(*preview.open_for_preview(single_path, max_scale))
+    series_pyramid = preview.PreviewPyramid(*preview.open_for_preview(series_path, max_scale))
+    results = {'load_run_ms': (time.perf_counter() - start) * 1000}
+
+    # Warm the level the run opens at, as the GUI does on load
+    preview.render_view(single_pyramid, series_pyramid, settings, base_scale,
+                        CANVAS_WIDTH, CANVAS_HEIGHT)
+
+    for name, sequence in slider_events(settings, steps).items():
+        for fast in (True, False):
+            if name == 'zoom':
+                # Every zoom step must resample, so start from cold caches
+                single_pyramid.scaled.clear()
+                series_pyramid.scaled.clear()
+            samples = []
+            for event in sequence:
+                start = time.perf_counter()
+                preview.render_view(single_pyramid, series_pyramid, event, base_scale,
+                                    CANVAS_WIDTH, CANVAS_HEIGHT, fast)
+                samples.append(time.perf_counter() - start)
+            results[f"{name}_{'fast' if fast else 'full'}"] = percentiles(samples)
+    return results
+
+
+def bench_export(base_directory, alignment_settings, workers):
+    """Export throughput for each execution path"""
+    run_folders = engine.find_run_folders(base_directory)
+    results = {}
+
+    for label, count in (('serial', 1), ('pool', workers)):
+        output_base = tempfile.mkdtemp(prefix="bench_export_")
+        metrics.collector.reset()
+        try:
+            start = time.perf_counter()
+            written, _, _ = engine.export_all(base_directory, alignment_settings,
+                                              output_base=output_base, run_folders=run_folders,
+                                              workers=count, incremental=False)
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(output_base, ignore_errors=True)
+        results[label] = {'workers': count, 'images': written, 'seconds': elapsed,
+                          'images_per_second': written / elapsed,
+                          'stages': metrics.collector.summary()['stages']}
+
+    output_base = tempfile.mkdtemp(prefix="bench_export_")
+    try:
+        run_folder = run_folders[0]
+        start = time.perf_counter()
+        written = engine.export_run(run_folder, alignment_settings[os.path.basename(run_folder)],
+                                    output_base, workers=workers)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_base, ignore_errors=True)
+    results['pipeline_single_run'] = {'workers': workers, 'images': written, 'seconds': elapsed,
+                                      'images_per_second': written / elapsed}
+    return results
+
+
+def bench_encoders(base_directory, alignment_settings, workers):
+    """Export speed and output size for each encoder setting"""
+    run_folders = engine.find_run_folders(base_directory)
+    results = {}
+    for label, encoder in ENCODER_CHOICES.items():
+        output_base = tempfile.mkdtemp(prefix="bench_encode_")
+        metrics.collector.reset()
+        try:
+            start = time.perf_counter()
+            written, _, _ = engine.export_all(base_directory, alignment_settings,
+                                              output_base=output_base, run_folders=run_folders,
+                                              workers=workers, incremental=False, encoder=encoder)
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(output_base, ignore_errors=True)
+        summary = metrics.collector.summary()
+        output_bytes = summary['counters'].get('output_bytes', 0)
+        results[label] = {'encoder': encoder, 'images': written, 'seconds': elapsed,
+                          'images_per_second': written / elapsed,
+                          'encode_mean_ms': summary['stages']['encode']['mean_ms'],
+                          'mib_per_image': output_bytes / written / 2 ** 20}
+    return results
+
+
+def print_encoders(results):
+    print(f"{'encoder':24s} {'images/s':>10s} {'encode ms':>10s} {'MiB/image':>10s}")
+    for label, result in results.items():
+        print(f"{label:24s} {result['images_per_second']:10.1f} {result['encode_mean_ms']:10.1f} "
+              f"{result['mib_per_image']:10.2f}")
+
+
+PEAK_RSS_SCRIPT = """
+import json, resource, sys, tempfile
+from aligner import engine, store
+base, workers = sys.argv[1], int(sys.argv[2])
+settings = store.load_settings(store.settings_path(base))
+output = tempfile.mkdtemp(prefix="bench_rss_")
+engine.export_all(base, settings, output_base=output, workers=workers, incremental=False)
+own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+print(json.dumps({'main_kib': own, 'largest_worker_kib': children}))
+"""
+
+
+def bench_peak_rss(base_directory, workers):
+    """Peak resident memory of a full export, in a fresh interpreter"""
+    results = {}
+    for label, count in (('serial', 1), ('pool', workers)):
+        output = subprocess.run([sys.executable, "-c", PEAK_RSS_SCRIPT, base_directory, str(count)],
+                                capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        measured = json.loads(output.stdout.strip().splitlines()[-1])
+        results[label] = {'workers': count,
+                          'main_mib': measured['main_kib'] / 1024,
+                          'largest_worker_mib': measured['largest_worker_kib'] / 1024}
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous, prefix=""):
+    """Print metrics that moved between two result files"""
+    for key, value in current.items():
+        old = previous.get(key) if isinstance(previous, dict) else None
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            compare(value, old or {}, name + ".")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            print(f"{name:60s} {old:12.3f} -> {value:12.3f} ({(value - old) / old * 100:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark preview rendering and export.")
+    parser.add_argument("--base", default=None,
+                        help="existing synthetic base directory (default: generate a temporary one)")
+    parser.add_argument("--runs", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=8)
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=1500)
+    parser.add_argument("--steps", type=int, default=60, help="slider events per preview benchmark")
+    parser.add_argument("--workers", type=int, default=engine.default_workers())
+    parser.add_argument("--skip-rss", action="store_true", help="skip the peak RSS measurement")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    temporary = None
+    base_directory = args.base
+    if base_directory is None:
+        temporary = tempfile.mkdtemp(prefix="bench_base_")
+        base_directory = os.path.join(temporary, "base")
+        synthetic.make_tree(base_directory, args.runs, args.frames, args.width, args.height)
+
+    try:
+        alignment_settings = store.load_settings(store.settings_path(base_directory))
+        run_folder = engine.find_run_folders(base_directory)[0]
+        results = {
+            'meta': {
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'pillow': PIL.__version__,
+                'numpy': np.__version__,
+                'cpus': os.cpu_count(),
+                'runs': args.runs,
+                'frames': args.frames,
+                'width': args.width,
+                'height': args.height
+            },
+            'preview': bench_preview(run_folder, alignment_settings[os.path.basename(run_folder)],
+                                     args.steps),
+            'export': bench_export(base_directory, alignment_settings, args.workers),
+            'encoders': bench_encoders(base_directory, alignment_settings, args.workers)
+        }
+        if not args.skip_rss:
+            results['peak_rss'] = bench_peak_rss(base_directory, args.workers)
+    finally:
+        if temporary:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_encoders(results['encoders'])
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
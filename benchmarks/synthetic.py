@@ -0,0 +1,78 @@
+"""
+Synthetic run-folder generator for benchmarks.
+
+Builds BASE/runN/single.png and BASE/runN/series_K.jpg from one smooth random
+texture per run, with known offsets between single.png and the series stack
+and a small drift between series frames. Also writes the matching
+alignment_settings.json so the tree can be exported straight away.
+
+    python -m benchmarks.synthetic /tmp/bench_base --runs 4 --frames 8 --width 2000 --height 1500
+"""
+
+import os
+import argparse
+import numpy as np
+from PIL import Image, ImageFilter
+
+from aligner import engine, store
+
+
+def texture(rng, width, height, blur=2.0):
+    """Smooth random RGB texture, so registration and JPEG behave like on real captures"""
+    noise = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return Image.fromarray(noise).filter(ImageFilter.GaussianBlur(blur))
+
+
+def make_run(run_folder, rng, width, height, frames, max_offset=40, max_drift=3):
+    """Write one run folder; returns its ground-truth settings in GUI slider terms"""
+    os.makedirs(run_folder, exist_ok=True)
+    margin = max_offset + frames * max_drift + 1
+    source = texture(rng, width + 2 * margin, height + 2 * margin)
+
+    # single.png is the centre crop; series frames are shifted copies
+    single = source.crop((margin, margin, margin + width, margin + height))
+    single.save(os.path.join(run_folder, engine.SINGLE_NAME), compress_level=1)
+
+    dx, dy = (int(v) for v in rng.integers(-max_offset, max_offset + 1, 2))
+    for k in range(frames):
+        drift_x, drift_y = (int(v) for v in rng.integers(-max_drift, max_drift + 1, 2)) if k else (0, 0)
+        left = margin + dx + drift_x
+        top = margin + dy + drift_y
+        frame = source.crop((left, top, left + width, top + height))
+        frame.save(os.path.join(run_folder, f"series_{k}.jpg"), quality=90)
+
+    # A feature at (x, y) in single.png is at (x - dx, y - dy) in series_0.jpg
+    settings = engine.default_settings()
+    settings['series_x'] = dx
+    settings['series_y'] = dy
+    return settings
+
+
+def make_tree(base_directory, runs=4, frames=8, width=2000, height=1500, seed=0):
+    """Write a synthetic base directory and its settings sidecar; returns the settings"""
+    rng = np.random.default_rng(seed)
+    alignment_settings = {}
+    for index in range(runs):
+        run_name = f"run{index}"
+        alignment_settings[run_name] = make_run(os.path.join(base_directory, run_name),
+                                                rng, width, height, frames)
+    store.save_settings(store.settings_path(base_directory), alignment_settings)
+    return alignment_settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic run folders.")
+    parser.add_argument("base_directory")
+    parser.add_argument("--runs", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=8, help="series frames per run")
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=1500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    make_tree(args.base_directory, args.runs, args.frames, args.width, args.height, args.seed)
+    print(f"Wrote {args.runs} runs to {args.base_directory}")
+
+
+if __name__ == "__main__":
+    main()
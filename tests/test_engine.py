@@ -0,0 +1,113 @@
+import itertools
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from aligner import engine
+
+OUTPUT_WIDTH, OUTPUT_HEIGHT = 60, 50
+
+OFFSETS = [(0, 0), (7, 3), (-9, -4), (25, -30), (-80, 10), (130, 95), (-200, -150)]
+
+BOUNDS = [
+    {'left': 0, 'top': 0, 'width': 40, 'height': 30},
+    {'left': -20, 'top': -15, 'width': 60, 'height': 50},
+    {'left': 90, 'top': 70, 'width': 45, 'height': 35},
+]
+
+
+def canvas_crop(image, x_offset, y_offset, overlap_bounds,
+                output_width=OUTPUT_WIDTH, output_height=OUTPUT_HEIGHT):
+    """The original export crop: paste onto a padded white canvas, then crop it
+
+    The algorithm of the first aligner.py, kept as the reference the direct
+    crop must reproduce pixel for pixel; do not adapt it to later changes.
+    """
+    canvas_width = image.width + abs(x_offset) + output_width
+    canvas_height = image.height + abs(y_offset) + output_height
+    canvas = Image.new('RGB', (canvas_width, canvas_height), (255, 255, 255))
+    paste_x = max(0, -x_offset) + output_width // 2
+    paste_y = max(0, -y_offset) + output_height // 2
+    if image.mode == 'RGBA':
+        canvas.paste(image, (paste_x, paste_y), image)
+    else:
+        canvas.paste(image, (paste_x, paste_y))
+    crop_left = paste_x + x_offset + overlap_bounds['left']
+    crop_top = paste_y + y_offset + overlap_bounds['top']
+    crop_left = max(0, min(crop_left, canvas_width - overlap_bounds['width']))
+    crop_top = max(0, min(crop_top, canvas_height - overlap_bounds['height']))
+    return canvas.crop((crop_left, crop_top,
+                        crop_left + overlap_bounds['width'], crop_top + overlap_bounds['height']))
+
+
+def preview_crop(image, x_offset, y_offset, overlap_bounds):
+    """Crop of the preview layout: the image centred on the origin and moved by its offset"""
+    cropped = Image.new('RGB', (overlap_bounds['width'], overlap_bounds['height']), (255, 255, 255))
+    cropped.paste(image.convert('RGB'), (x_offset - image.width // 2 - overlap_bounds['left'],
+                                         y_offset - image.height // 2 - overlap_bounds['top']))
+    return cropped
+
+
+def make_image(mode, width=120, height=90):
+    rng = np.random.default_rng(7)
+    if mode == 'I;16':
+        return Image.fromarray(rng.integers(0, 256, (height, width), dtype=np.uint16))
+    rgba = Image.fromarray(rng.integers(0, 256, (height, width, 4), dtype=np.uint8))
+    if mode == 'P':
+        return rgba.convert('RGB').quantize(64)
+    return rgba.convert(mode)
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'L', 'P', 'I;16'])
+def test_crop_matches_canvas_crop(mode):
+    image = make_image(mode)
+    for (x_offset, y_offset), bounds in itertools.product(OFFSETS, BOUNDS):
+        expected = np.asarray(canvas_crop(image, x_offset, y_offset, bounds))
+        for tile_budget in (None, 8 * OUTPUT_WIDTH * engine.TILE_BYTES_PER_PIXEL):
+            cropped = engine.align_and_crop_to_overlap(image, x_offset, y_offset, bounds,
+                                                       OUTPUT_WIDTH, OUTPUT_HEIGHT, tile_budget=tile_budget)
+            assert cropped.mode == 'RGB'
+            assert np.array_equal(np.asarray(cropped), expected), (x_offset, y_offset, bounds, tile_budget)
+
+
+def test_whole_number_float_offsets_crop_like_ints():
+    image = make_image('RGB')
+    bounds = BOUNDS[1]
+    expected = np.asarray(canvas_crop(image, 7, -4, bounds))
+    for tile_budget in (None, 8 * OUTPUT_WIDTH * engine.TILE_BYTES_PER_PIXEL):
+        cropped = engine.align_and_crop_to_overlap(image, 7.0, -4.0, bounds, OUTPUT_WIDTH, OUTPUT_HEIGHT,
+                                                   tile_budget=tile_budget)
+        assert np.array_equal(np.asarray(cropped), expected)
+
+
+def test_keep_depth_crop_of_rgb_matches_canvas_crop():
+    image = make_image('RGB')
+    for (x_offset, y_offset), bounds in itertools.product(OFFSETS, BOUNDS):
+        expected = np.asarray(canvas_crop(image, x_offset, y_offset, bounds))
+        cropped = engine.align_and_crop_to_overlap(image, x_offset, y_offset, bounds,
+                                                   OUTPUT_WIDTH, OUTPUT_HEIGHT, keep_depth=True)
+        assert np.array_equal(cropped, expected), (x_offset, y_offset, bounds)
+
+
+def test_preview_layout_crop_matches_preview():
+    image = make_image('RGB')
+    for (x_offset, y_offset), bounds in itertools.product(OFFSETS, BOUNDS):
+        expected = np.asarray(preview_crop(image, x_offset, y_offset, bounds))
+        for tile_budget in (None, 8 * OUTPUT_WIDTH * engine.TILE_BYTES_PER_PIXEL):
+            cropped = engine.align_and_crop_to_overlap(image, x_offset, y_offset, bounds,
+                                                       OUTPUT_WIDTH, OUTPUT_HEIGHT, tile_budget=tile_budget,
+                                                       layout=engine.PREVIEW_LAYOUT)
+            assert np.array_equal(np.asarray(cropped), expected), (x_offset, y_offset, bounds, tile_budget)
+
+
+def test_settings_without_layout_keep_the_canvas_layout():
+    legacy = {'single_x': 0, 'single_y': 0, 'series_x': 7, 'series_y': -4,
+              'series_drift': {'series_1.jpg': [2, 1]}}
+    aligned = dict(legacy, layout=engine.PREVIEW_LAYOUT)
+
+    assert engine.run_layout(legacy) == engine.CANVAS_LAYOUT
+    assert engine.run_layout(engine.default_settings()) == engine.PREVIEW_LAYOUT
+    # Drift is read in the direction the feature moved, whichever way the layout moves the image
+    assert engine.image_offset('series_1.jpg', legacy) == (9, -3)
+    assert engine.image_offset('series_1.jpg', aligned) == (5, -5)
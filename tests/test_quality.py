@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+
+from aligner import engine, quality
+from benchmarks import synthetic
+
+
+def export_report(tmp_path, alignment_settings):
+    output_base = str(tmp_path / "out")
+    engine.export_all(str(tmp_path / "base"), alignment_settings, output_base,
+                      output_width=200, output_height=160, workers=1)
+    return quality.load_report(output_base)
+
+
+def test_ground_truth_export_scores_high(tmp_path):
+    truth = synthetic.make_tree(str(tmp_path / "base"), runs=3, frames=2, width=320, height=240)
+
+    report = export_report(tmp_path, truth)
+
+    assert set(report) == set(truth)
+    for run in report.values():
+        assert run['ncc'] > 0.9
+        assert not run['flagged']
+
+
+def test_misaligned_run_is_flagged(tmp_path):
+    truth = synthetic.make_tree(str(tmp_path / "base"), runs=4, frames=2, width=320, height=240)
+    settings = truth
+    settings['run3']['series_x'] += 12
+
+    report = export_report(tmp_path, settings)
+
+    assert quality.ranked(report)[0] == 'run3'
+    assert report['run3']['flagged']
+    assert not any(report[name]['flagged'] for name in ('run0', 'run1', 'run2'))
+    assert report['run3']['ncc'] < np.median([report[name]['ncc'] for name in report]) - 0.3
+
+
+def test_interrupted_report_write_keeps_the_previous_csv(tmp_path):
+    output_base = str(tmp_path)
+    scores = {f"run{index}": {'score': 0.9, 'ncc': 0.95, 'gradient_ssim': 0.9} for index in range(50)}
+    quality.update_report(output_base, scores)
+    csv_path = os.path.join(output_base, quality.REPORT_CSV_FILENAME)
+    with open(csv_path) as f:
+        previous = f.read()
+
+    # A score that cannot be formatted fails the rewrite partway through the rows
+    with pytest.raises(TypeError):
+        quality.update_report(output_base, {'run49': {'score': 0.95, 'ncc': None, 'gradient_ssim': 0.95}})
+
+    with open(csv_path) as f:
+        assert f.read() == previous
+    assert sorted(os.listdir(output_base)) == sorted([quality.REPORT_FILENAME, quality.REPORT_CSV_FILENAME])
@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from aligner import registration, store
+from benchmarks import synthetic
+
+
+def test_seed_align_settings_save_as_json(tmp_path):
+    run_folder = str(tmp_path / "run0")
+    truth = synthetic.make_run(run_folder, np.random.default_rng(3), 400, 300, 1)
+    seed = dict(truth, series_x=truth['series_x'] + 3, series_y=truth['series_y'] - 2)
+
+    with Image.open(os.path.join(run_folder, "single.png")) as single_image, \
+            Image.open(os.path.join(run_folder, "series_0.jpg")) as series_image:
+        settings, score = registration.seed_align(single_image, series_image, seed)
+
+    assert (settings['series_x'], settings['series_y']) == (truth['series_x'], truth['series_y'])
+    assert type(settings['series_x']) is int and type(settings['series_y']) is int
+    assert score > registration.MIN_SEED_NCC
+
+    path = store.settings_path(str(tmp_path))
+    store.save_settings(path, {'run0': settings})
+    assert store.load_settings(path) == {'run0': settings}
+    # No temporary file is left next to the sidecar
+    assert sorted(os.listdir(tmp_path)) == sorted(["run0", os.path.basename(path)])
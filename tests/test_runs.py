@@ -0,0 +1,17 @@
+from PIL import Image
+
+from aligner import metrics, runs
+
+
+def test_scan_is_timed_as_run_discovery(tmp_path):
+    run_folder = tmp_path / "run0"
+    run_folder.mkdir()
+    for name in ("single.png", "series_0.jpg"):
+        Image.new('RGB', (8, 8)).save(run_folder / name)
+    metrics.collector.reset()
+
+    index = runs.RunIndex(str(tmp_path), persistent=False)
+    index.scan()
+
+    assert index.run_folders() == [str(run_folder)]
+    assert metrics.collector.summary()['stages']['find_run_folders']['count'] == 1
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from aligner import engine, store
+from benchmarks import synthetic
+
+
+def test_failed_json_write_keeps_old_file_and_no_temporary(tmp_path):
+    path = str(tmp_path / "settings.json")
+    store.write_json_atomic(path, {'run0': 1})
+
+    with pytest.raises(TypeError):
+        store.write_json_atomic(path, {'run0': object()})
+
+    assert os.listdir(tmp_path) == ["settings.json"]
+    with open(path) as f:
+        assert f.read() == '{\n  "run0": 1\n}'
+
+
+def test_touched_input_stays_current_with_the_hash_of_the_export(tmp_path):
+    truth = synthetic.make_tree(str(tmp_path / "base"), runs=1, frames=2, width=120, height=90)
+    output_base = str(tmp_path / "out")
+    for workers in (1, 2):
+        engine.export_all(str(tmp_path / "base"), truth, output_base, output_width=60, output_height=50,
+                          workers=workers, incremental=False)
+        manifest = store.ExportManifest(output_base)
+        assert all(entry['hash'] == store.file_hash(entry['input']) for entry in manifest.entries.values())
+
+    # A new modification time alone does not make the export stale
+    for entry in manifest.entries.values():
+        os.utime(entry['input'], ns=(entry['mtime_ns'] + 10 ** 9, entry['mtime_ns'] + 10 ** 9))
+    written, up_to_date, _ = engine.export_all(str(tmp_path / "base"), truth, output_base,
+                                               output_width=60, output_height=50, workers=1)
+    assert (written, up_to_date) == (0, 3)
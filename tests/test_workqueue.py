@@ -0,0 +1,25 @@
+import threading
+
+import pytest
+
+from aligner import engine, workqueue
+from benchmarks import synthetic
+
+
+def test_cancelled_export_gives_the_run_back_at_once(tmp_path):
+    base_directory = str(tmp_path / "base")
+    truth = synthetic.make_tree(base_directory, runs=1, frames=2, width=120, height=90)
+    queue_dir, plan = workqueue.plan_export(base_directory, truth, str(tmp_path / "queue"),
+                                            str(tmp_path / "out"), output_width=60, output_height=50)
+    queue = workqueue.WorkQueue(queue_dir)
+    job = plan['jobs'][0]
+    lease = queue.try_claim(job, "first")
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    with pytest.raises(engine.ExportCancelled):
+        queue.export_job(lease, workers=1, cancel_event=cancel_event)
+    assert not lease.lost.is_set()
+    queue.abandon(lease)
+
+    assert queue.try_claim(job, "second") is not None